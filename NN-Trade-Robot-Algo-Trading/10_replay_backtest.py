@@ -0,0 +1,99 @@
+"""
+In this code, we replay the stored candles (csv/ or store/) of the portfolio through the decision logic of the
+live strategy (OneBarHoldRule of functions_strategy, as in 7_live_strategy.py) at maximum speed:
+- model inputs of all bars are rendered and predicted in large batches, or the scores are taken from the signal
+  store of 12_score_signals.py (Config.backtest_use_signals) if it covers the period
+- every bar goes through OneBarHoldRule.trade with a virtual clock instead of datetime.now()
+- orders are filled by a simulated broker at bar prices (Config.backtest_fill) with Config.backtest_commission
+The period is Config.backtest_start .. Config.backtest_end.
+
+Trades are saved to NN/_backtest/replay_trades_{timeframe_0}.csv, the PnL report is printed.
+"""
+
+import os
+import time
+import functions
+import functions_cache
+import functions_nn
+import functions_replay
+import functions_signals
+import functions_strategy
+import numpy as np
+import pandas as pd
+
+from my_config.trade_config import Config  # Configuration file for the trading bot
+
+
+if __name__ == "__main__":
+
+    # whether to redirect output from console to a file
+    functions.start_redirect_output_from_screen_to_file(False, filename="10_replay_backtest_log.txt")
+
+    timeframe_0 = Config.timeframe_0  # the timeframe we trade on
+    input_mode = Config.input_mode  # "image" - chart images, "series" - normalized raw series
+    draw_window = Config.draw_window  # data window
+    batch_size = 256  # number of bars rendered and predicted at once
+
+    # the neural network of the live strategy, compiled for batched inference when the scores are not stored
+    model_filename = os.path.join("NN_winner", f"{functions_nn.MODEL_NAMES[input_mode]}.hdf5")
+    model_id = functions_signals.get_model_id(model_filename)
+    params = functions_signals.get_params(timeframe_0, Config.period_sma_fast, Config.period_sma_slow, draw_window,
+                                          input_mode)
+    predictor = None
+
+    clock = functions_replay.VirtualClock()
+    broker = functions_replay.SimulatedBroker(functions_strategy.BUY_SELL_BUY, fill=Config.backtest_fill)
+    gateway = functions_replay.ImmediateGateway(broker)
+    last_prices = {}
+
+    for ticker in sorted(Config.portfolio):
+        _start = time.perf_counter()
+        data = functions_replay.get_replay_data(ticker, timeframe_0, Config.period_sma_fast, Config.period_sma_slow,
+                                                draw_window, Config.backtest_start, Config.backtest_end)
+        logits = None
+        if Config.backtest_use_signals:
+            logits = functions_signals.get_logits(model_id, ticker, timeframe_0, data["datetime"], params)
+            # every replayed bar with a full window must be scored, otherwise the store is behind the candles
+            _first = max(data["first"], draw_window - 1)
+            if logits is not None and np.isnan(logits[_first:, 1]).any():
+                logits = None
+        if logits is None:
+            if predictor is None:
+                # TensorFlow is loaded only when the scores have to be predicted
+                import functions_tf
+                from keras.models import load_model
+                predictor = functions_tf.CompiledModel(load_model(model_filename),
+                                                       functions_tf.get_input_shape(input_mode, draw_window),
+                                                       backend=Config.live_inference_backend, max_batch=batch_size)
+            logits = functions_replay.predict_logits(data, draw_window, input_mode, predictor.predict_batch,
+                                                     batch_size)
+        _predicted = time.perf_counter()
+
+        strategy = functions_strategy.OneBarHoldRule(
+            ticker=ticker,
+            security_board=Config.security_board,
+            client_id="replay",
+            clock=clock,
+            report_orders=False,
+        )
+        functions_replay.replay(strategy, data, logits, clock, broker, gateway)
+        last_prices[ticker] = (pd.Timestamp(data["datetime"][-1]).to_pydatetime(), data["close"][-1])
+        _bars = len(data["close"]) - data["first"]
+        print(f"{ticker}: {_bars} bars, predicted in {_predicted - _start:.1f} s, "
+              f"replayed in {time.perf_counter() - _predicted:.1f} s")
+
+    trades = functions_replay.get_trades(broker.fills, last_prices, commission=Config.backtest_commission)
+    _filename = functions.join_paths(["NN", "_backtest", f"replay_trades_{timeframe_0}.csv"])
+    os.makedirs(os.path.dirname(_filename), exist_ok=True)
+    trades.to_csv(_filename, index=False)
+
+    print(f"\nTrades saved to {_filename}")
+    for _name, _value in functions_replay.get_report(trades).items():
+        print(f"{_name:>15}: {_value:.4f}" if isinstance(_value, float) else f"{_name:>15}: {_value}")
+    for ticker, _trades in trades.groupby("ticker"):
+        _report = functions_replay.get_report(_trades)
+        print(f"{ticker}: {_report['trades']} trades, win rate {_report['win rate']:.2%}, pnl {_report['pnl']:.4f}")
+    print(functions_cache.format_stats(functions_cache.RENDER, functions_cache.SMA))
+
+    # stop redirecting output from the console to the file
+    functions.stop_redirect_output_from_screen_to_file()
@@ -0,0 +1,86 @@
+"""
+In this code, we search for the parameters of the samples instead of picking them by hand:
+timeframe pair, period_sma_fast, period_sma_slow, draw_window and steps_skip (Config.sweep_grid).
+
+Every point of the grid is evaluated with walk-forward validation on the same time-ordered folds (see functions_sweep):
+a model is trained on the periods before a fold and validated on the fold, the validation period is also backtested
+bar by bar with the rule of the live strategy. Points run in a pool of processes over candles in shared memory,
+artifacts are cached in NN/_sweep by the hash of the parameters, so an interrupted sweep continues where it stopped.
+
+The ranked results are saved to NN/_sweep/sweep_results.csv, the best points are printed.
+"""
+
+import functions
+import functions_dataset
+import functions_sweep
+import functools
+import multiprocessing
+import os
+import time
+
+from my_config.trade_config import Config  # Configuration file for the trading bot
+
+
+if __name__ == '__main__':  # Entry point when running this script, also required by the spawned workers
+
+    # whether to redirect output from console to a file
+    functions.start_redirect_output_from_screen_to_file(False, filename="11_parameter_sweep_log.txt")
+
+    tickers = sorted(Config.training_NN)  # tickers for training the neural network
+    input_mode = Config.input_mode  # "image" - chart images, "series" - normalized raw series
+    points = functions_sweep.get_grid(Config.sweep_grid)
+    timeframes = sorted({_point[_name] for _point in points for _name in ("timeframe_0", "timeframe_1")})
+    workers = min(Config.sweep_workers or os.cpu_count(), len(points)) or 1
+
+    # Candles of all tickers and timeframes are read once and shared with the workers
+    candles, version = functions_sweep.load_candles(tickers, timeframes)
+    bounds = functions_sweep.get_fold_bounds(candles, tickers, min(timeframes, key=functions.TIMEFRAME_MINUTES.get),
+                                             Config.sweep_folds)
+    settings = {
+        "tickers": tickers,
+        "input_mode": input_mode,
+        "version": version,
+        "bounds": bounds,
+        "train_periods": Config.sweep_train_periods,
+        "epochs": Config.sweep_epochs,
+        "batch_size": Config.train_batch_size,
+        "eval_batch_size": 256,
+        "seed": Config.train_seed,
+        "threshold": Config.eval_threshold,
+        "cache_inputs": Config.sweep_cache_inputs,
+        "shard_size": Config.dataset_shard_size,
+        "backtest": Config.sweep_backtest,
+        "commission": Config.backtest_commission,
+        "fill": Config.backtest_fill,
+        "threads": max(os.cpu_count() // workers, 1),  # TensorFlow threads of every worker
+    }
+    print(f"{len(points)} points x {Config.sweep_folds} folds, {workers} workers")
+
+    blocks, candles_spec = functions_dataset.share_arrays(candles)
+    results, _start_time = [], time.perf_counter()
+    try:
+        # TensorFlow is not fork-safe: workers are spawned, one point per worker process
+        with multiprocessing.get_context("spawn").Pool(workers, maxtasksperchild=1) as pool:
+            for result in pool.imap_unordered(functools.partial(functions_sweep.run_point,
+                                                                candles_spec=candles_spec, settings=settings), points):
+                results.append(result)
+                _elapsed = time.perf_counter() - _start_time
+                _left = _elapsed / len(results) * (len(points) - len(results))
+                print(f"{len(results)}/{len(points)} points in {_elapsed / 60:.1f} min, ~{_left / 60:.0f} min left: "
+                      + ", ".join(f"{_name}={result[_name]}" for _name in functions_sweep.POINT_PARAMS)
+                      + f" -> {Config.sweep_rank}={result.get(Config.sweep_rank, float('nan')):.4f}")
+    finally:
+        functions_dataset.release_arrays(blocks, unlink=True)
+
+    ranked = functions_sweep.rank_results(results, Config.sweep_rank)
+    _filename = os.path.join(functions_sweep.get_sweep_folder(), "sweep_results.csv")
+    os.makedirs(os.path.dirname(_filename), exist_ok=True)
+    ranked.to_csv(_filename, index=False)
+
+    print(f"\nResults saved to {_filename}, the best points by {Config.sweep_rank}:")
+    _columns = [_name for _name in (*functions_sweep.POINT_PARAMS, "val_accuracy", "trades", "total_return",
+                                    "max_drawdown", f"{Config.sweep_rank}_std") if _name in ranked]
+    print(ranked[_columns].head(10).to_string())
+
+    # stop redirecting output from the console to the file
+    functions.stop_redirect_output_from_screen_to_file()
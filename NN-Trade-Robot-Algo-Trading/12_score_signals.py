@@ -0,0 +1,93 @@
+"""
+In this code, we score every bar of the history with the neural network from NN_winner once and keep the scores,
+so backtests and analyses do not need TensorFlow and do not render the charts again.
+
+For every ticker with timeframe_0 candles (store/ or csv/) every bar with a full window of draw_window bars is scored:
+- the inputs are rendered by a pool of processes from the candles and SMA in shared memory
+- the parent predicts the rendered bars in batches, while the workers render the next ones
+  (a few units ahead, the memory stays bounded)
+The logits are written to the signal store signals/{model_id}/{ticker}_{timeframe_0} (see functions_signals).
+With Config.signals_incremental only bars newer than the last stored score are scored.
+"""
+
+import functions
+import functions_dataset
+import functions_nn
+import functions_signals
+import functions_tf
+import multiprocessing
+import os
+import time
+import numpy as np
+
+from keras.models import load_model
+
+from my_config.trade_config import Config  # Configuration file for the trading bot
+
+
+if __name__ == "__main__":
+
+    # whether to redirect output from console to a file
+    functions.start_redirect_output_from_screen_to_file(False, filename="12_score_signals_log.txt")
+
+    timeframe_0 = Config.timeframe_0  # the timeframe the neural network was trained on
+    input_mode = Config.input_mode  # "image" - chart images, "series" - normalized raw series
+    draw_window = Config.draw_window  # data window
+    batch_size = 256  # number of bars in one forward pass
+    workers = Config.signals_workers or os.cpu_count()  # number of processes rendering the inputs
+    # the scores depend on the model and on the parameters of its inputs
+    params = functions_signals.get_params(timeframe_0, Config.period_sma_fast, Config.period_sma_slow, draw_window,
+                                          input_mode)
+
+    model_filename = os.path.join("NN_winner", f"{functions_tf.MODEL_NAMES[input_mode]}.hdf5")
+    model_id = functions_signals.get_model_id(model_filename)
+    print(f"Model {model_id}")
+
+    # Candles and SMA of all tickers go to shared memory, the work units are the bars still to be scored
+    blocks, units, rows = [], [], {}
+    for ticker in functions_signals.list_tickers(timeframe_0):
+        df = functions_nn.get_df_tf0(ticker, timeframe_0, Config.period_sma_fast, Config.period_sma_slow)
+        _datetimes = df["datetime"].to_numpy(dtype="datetime64[ns]").view(np.int64)
+        _first, rows[ticker] = draw_window - 1, 0
+        if Config.signals_incremental:
+            _first, rows[ticker] = functions_signals.get_first_bar(model_id, ticker, timeframe_0, params, _datetimes,
+                                                                   draw_window)
+        print(f"{ticker}: {len(df)} bars, {max(len(df) - _first, 0)} to score")
+        if _first >= len(df):
+            continue
+        _blocks, _spec = functions_dataset.share_arrays({
+            "close": df["close"].to_numpy(),
+            "sma_fast": df["sma_fast"].to_numpy(),
+            "sma_slow": df["sma_slow"].to_numpy(),
+            "datetimes": _datetimes,
+        })
+        blocks += _blocks
+        units += functions_signals.get_units(ticker, _first, len(df), Config.signals_unit, _spec)
+
+    # Compiled forward pass with a preallocated input buffer of one batch
+    predictor = functions_tf.CompiledModel(load_model(model_filename),
+                                           functions_tf.get_input_shape(input_mode, draw_window),
+                                           backend=Config.live_inference_backend, max_batch=batch_size)
+
+    _total = sum(_unit["stop"] - _unit["start"] for _unit in units)
+    _done, _start_time = 0, time.perf_counter()
+    try:
+        # TensorFlow is not fork-safe: workers are spawned; units come back in order and are appended to the store
+        with multiprocessing.get_context("spawn").Pool(workers) as pool:
+            for _unit, _inputs, _datetimes in functions_signals.render_units(pool, units, draw_window, input_mode,
+                                                                             ahead=2 * workers):
+                _logits = np.concatenate([predictor.predict_batch(_inputs[_i0:_i0 + batch_size])
+                                          for _i0 in range(0, len(_inputs), batch_size)])
+                ticker = _unit["ticker"]
+                rows[ticker] = functions_signals.append_signals(model_id, ticker, timeframe_0, _datetimes, _logits,
+                                                                params, rows=rows[ticker])
+                _done += len(_logits)
+                _elapsed = time.perf_counter() - _start_time
+                print(f"{_done}/{_total} bars ({ticker}), {_done / _elapsed:.0f} bars/s")
+    finally:
+        functions_dataset.release_arrays(blocks, unlink=True)
+
+    print(f"\nSignals of {model_id} saved to {os.path.join('signals', model_id)}")
+
+    # stop redirecting output from the console to the file
+    functions.stop_redirect_output_from_screen_to_file()
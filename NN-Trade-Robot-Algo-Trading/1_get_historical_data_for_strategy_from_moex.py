@@ -4,34 +4,82 @@ import asyncio
 import aiohttp
 import aiomoex
 import functions
+import functions_store
 import os
 import pandas as pd
-from datetime import datetime, timedelta
+from datetime import datetime
 from my_config.trade_config import Config  # Configuration file for the trading robot
 
 
-async def get_candles(session, ticker, timeframes, start, end):
+async def fetch_candles_chunk(session, semaphore, ticker, tf, start, end, retries, backoff):
+    """Function to get one chunk of candles from MOEX under the shared concurrency limit, with retries."""
+    for _attempt in range(retries + 1):
+        try:
+            async with semaphore:
+                return await aiomoex.get_market_candles(session, ticker, interval=tf, start=start, end=end)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            if _attempt == retries:
+                raise
+            _delay = backoff * 2 ** _attempt  # Exponential backoff
+            functions.print_warning(f"{ticker} {tf} {start}..{end}: {e!r}, retry in {_delay} s")
+            await asyncio.sleep(_delay)
+
+
+async def get_candles(session, semaphore, ticker, timeframe, start, end, incremental, chunk_days, retries, backoff):
     """Function to get candles from MOEX."""
-    for timeframe in timeframes:
-        tf = functions.get_timeframe_moex(timeframe)
-        data = await aiomoex.get_market_candles(session, ticker, interval=tf, start=start, end=end)  # M10
-        df = pd.DataFrame(data)
-        df['datetime'] = pd.to_datetime(df['begin'], format='%Y-%m-%d %H:%M:%S')
-        # For M1, M10, H1 - adjust the candle date to the correct format
-        if tf in [1, 10, 60]:
-            df['datetime'] = df['datetime'].apply(lambda x: x + timedelta(minutes=tf))
-        df = df[["datetime", "open", "high", "low", "close", "volume"]].copy()
-        df.to_csv(os.path.join("csv", f"{ticker}_{timeframe}.csv"), index=False, encoding='utf-8', sep=',')
-        print(f"{ticker} {tf}:")
-        print(df)
-
-
-async def get_all_historical_candles(portfolio, timeframes, start, end):
-    """Starting asynchronous task to fetch historical data for each ticker in the portfolio."""
-    async with aiohttp.ClientSession() as session:
+    tf = functions.get_timeframe_moex(timeframe)
+    _filename = os.path.join("csv", f"{ticker}_{timeframe}.csv")
+
+    # In incremental mode continue from the day of the last stored candle
+    _last_datetime = functions.get_last_datetime_from_csv(_filename) if incremental else None
+    _start = _last_datetime.strftime("%Y-%m-%d") if _last_datetime else start
+
+    # Split the date range into chunks and fetch them concurrently, the results come back in order
+    _chunks = functions.split_date_range(_start, end, chunk_days)
+    _data = await asyncio.gather(*[
+        fetch_candles_chunk(session, semaphore, ticker, tf, _chunk_start, _chunk_end, retries, backoff)
+        for _chunk_start, _chunk_end in _chunks
+    ])
+    data = [candle for _chunk in _data for candle in _chunk]
+    if not data:
+        print(f"{ticker} {tf}: no new candles")
+        return
+    df = pd.DataFrame(data)
+    df = df.drop_duplicates(subset='begin').sort_values('begin', ignore_index=True)  # Stitch the chunks
+    # The last candle of the end day may still be forming: it is not stored, the next run downloads it again
+    if str(df['begin'].iloc[-1])[:10] >= end:
+        df = df.iloc[:-1]
+    df['datetime'] = pd.to_datetime(df['begin'], format='%Y-%m-%d %H:%M:%S')
+    # For M1, M10, H1 - adjust the candle date to the correct format
+    if tf in [1, 10, 60]:
+        df['datetime'] = df['datetime'] + pd.Timedelta(minutes=tf)  # Vectorized shift of the whole column
+    df = df[["datetime", "open", "high", "low", "close", "volume"]].copy()
+
+    if _last_datetime:
+        df = df[df['datetime'] > _last_datetime]  # Keep only candles that are not stored yet
+        if not functions_store.store_exists(ticker, timeframe):
+            functions_store.convert_csv_to_store(ticker, timeframe)  # The store starts with the whole csv history
+        # Intraday candles keep the time even if all appended ones end at midnight
+        _date_format = '%Y-%m-%d %H:%M:%S' if tf in [1, 10, 60] else None
+        functions.append_df_to_csv_atomically(df, _filename, date_format=_date_format)
+        functions_store.append_candles(df, ticker, timeframe)  # Binary columnar copy for fast reading
+    else:
+        df.to_csv(_filename, index=False, encoding='utf-8', sep=',')
+        functions_store.write_candles(df, ticker, timeframe)  # Binary columnar copy for fast reading
+    print(f"{ticker} {tf}: {len(df)} candles from {len(_chunks)} chunks")
+
+
+async def get_all_historical_candles(portfolio, timeframes, start, end, incremental,
+                                     concurrency, chunk_days, retries, backoff):
+    """Starting asynchronous task to fetch historical data for each ticker and timeframe in the portfolio."""
+    semaphore = asyncio.Semaphore(concurrency)  # Limit of simultaneous requests to MOEX ISS
+    connector = aiohttp.TCPConnector(limit=concurrency)  # Pool of connections reused by all requests
+    async with aiohttp.ClientSession(connector=connector) as session:
         strategy_tasks = []
         for instrument in portfolio:
-            strategy_tasks.append(asyncio.create_task(get_candles(session, instrument, timeframes, start, end)))
+            for timeframe in timeframes:
+                strategy_tasks.append(asyncio.create_task(get_candles(
+                    session, semaphore, instrument, timeframe, start, end, incremental, chunk_days, retries, backoff)))
         await asyncio.gather(*strategy_tasks)
 
 
@@ -43,6 +91,9 @@ if __name__ == "__main__":
     timeframe_1 = Config.timeframe_1  # Timeframe for training the neural network - output
     start = Config.start  # From what date we download historical data from MOEX
     end = datetime.now().strftime("%Y-%m-%d")  # Up to today
+    incremental = Config.incremental_download  # Download only the missing candles
+    concurrency = Config.download_concurrency  # Maximum number of simultaneous requests to MOEX
+    chunk_days = Config.download_chunk_days  # Length of one requested date range in days
 
     # Creating necessary directories
     functions.create_some_folders(timeframes=[timeframe_0, timeframe_1])
@@ -55,6 +106,11 @@ if __name__ == "__main__":
             timeframes=[timeframe_0, timeframe_1],  # For which timeframes we download data
             start=start,
             end=end,
+            incremental=incremental,
+            concurrency=concurrency,
+            chunk_days=chunk_days,
+            retries=Config.download_retries,
+            backoff=Config.download_backoff,
         )
     )
     loop.run_until_complete(task)  # Wait for the loop to finish executing
\ No newline at end of file
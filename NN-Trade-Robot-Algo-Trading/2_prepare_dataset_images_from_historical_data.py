@@ -2,17 +2,21 @@
 In this code, we prepare data for training the neural network.
 We generate images according to the following algorithm:
 1. Take the image of the closing price chart + SMA1 + SMA2 for a certain
-interval on timeframe_0.
-2. If the closing price on the higher timeframe_1 > closing price of the previous candle on the higher
-timeframe_1, then assign class 1 to this image, otherwise class 0.
+interval on timeframe_0, ending at a bar whose date is present in timeframe_1.
+2. If the closing price of the next candle on the higher timeframe_1 > closing price at the date of the bar
+on the higher timeframe_1, then assign class 1 to this image, otherwise class 0.
 """
 
 exit(777)  # To prevent running the code, otherwise it will overwrite results
 
 import functions
+import functions_dataset
 import functions_nn
+import functools
+import multiprocessing
 import os
-import matplotlib.pyplot as plt
+import time
+import numpy as np
 from my_config.trade_config import Config  # Configuration file for the trading robot
 
 
@@ -28,60 +32,110 @@ if __name__ == "__main__":
     draw_window = Config.draw_window  # Data window
     steps_skip = Config.steps_skip  # Step for shifting the data window
     draw_size = Config.draw_size  # Size of the image side
+    render_batch = 256  # Number of images rendered at once
+
+    # Output format of the dataset
+    input_mode = Config.input_mode  # "image" - chart images, "series" - normalized raw series
+    dataset_format = Config.dataset_format  # "shards" - .npy shards of uint8 tensors, "png" - one file per image
+    if input_mode == "series": dataset_format = "shards"  # series are stored only in shards
+    export_png = dataset_format == "png" or Config.dataset_export_png  # PNG files as a debug view
+    shards_folder = functions_dataset.get_shards_folder(timeframe_0, input_mode)
+    workers = Config.dataset_workers or os.cpu_count()  # Number of processes rendering images
+    params = {
+        "timeframe_0": timeframe_0,
+        "draw_window": draw_window,
+        "render_batch": render_batch,
+        "input_mode": input_mode,
+        "dataset_format": dataset_format,
+        "export_png": export_png,
+        "shards_folder": shards_folder,
+        "png_folder": os.path.join("NN", f"training_dataset_{timeframe_0}"),
+    }
+
+    # Incremental regeneration: the manifest of every ticker records the samples generated with these parameters
+    incremental = Config.dataset_incremental
+    sample_params = {
+        "timeframe_0": timeframe_0,
+        "timeframe_1": timeframe_1,
+        "period_sma_slow": period_sma_slow,
+        "period_sma_fast": period_sma_fast,
+        "sma": "fixed_point",  # SMA of functions_indicators, older datasets used pandas rolling
+        "windows": "bar_aligned",  # windows end at the sample bar, older datasets had misaligned windows
+        "draw_window": draw_window,
+        "steps_skip": steps_skip,
+        "draw_size": draw_size,
+        "input_mode": input_mode,
+        "dataset_format": dataset_format,
+        "dataset_shard_size": Config.dataset_shard_size,
+        "export_png": export_png,
+    }
 
     # Creating necessary directories
     functions.create_some_folders(timeframes=[timeframe_0], classes=["0", "1"])
+    functions_dataset.remove_other_tickers(shards_folder, params["png_folder"], portfolio)  # Not in the portfolio now
 
-    for ticker in portfolio:
+    blocks, units, samples = [], [], {}
+    for ticker in sorted(portfolio):
 
         # Reading data for training the neural network - output - timeframe_1
         df_out = functions_nn.get_df_t1(ticker, timeframe_1)
         # print(df_out)
-        _date_out = df_out["datetime"].tolist()
-        _date_out_index = {_date_out[i]: i for i in range(len(_date_out))}  # {date: index}
-        _close_out = df_out["close"].tolist()
 
         # Reading data for training the neural network - input - timeframe_0
         df_in = functions_nn.get_df_tf0(ticker, timeframe_0, period_sma_fast, period_sma_slow)
         # print(df_in)
-        _date_in = df_in["datetime"].tolist()
-        _close_in = df_in["close"].tolist()
-        sma_fast = df_in["sma_fast"].tolist()
-        sma_slow = df_in["sma_slow"].tolist()
 
         # # Output on the chart Close + SMA of the last 200 values
         # df_in[['close', 'sma_fast', 'sma_slow']].iloc[-200:].plot(label='df', figsize=(16, 8))
         # plt.show()
 
-        _steps, j = 0, 0
-        # Draw images only for the lower TF
-        for _date in _date_in:
-            if _date in _date_out:  # If the date of the lower TF is present in the dates of the higher TF
-                _steps += 1
-                j += 1
-                if _steps >= steps_skip and j >= draw_window:
-                    _steps = 0
-
-                    # Form the image for the neural network with reference to the date and ticker with step steps_skip
-                    # Size [draw_size, draw_size]
-                    _sma_fast_list = sma_fast[j-draw_window:j]
-                    _sma_slow_list = sma_slow[j-draw_window:j]
-                    _closes_list = _close_in[j-draw_window:j]
-
-                    # Generating an image for training/testing the neural network
-                    img = functions_nn.generate_img(_sma_fast_list, _sma_slow_list, _closes_list, draw_window)
-                    # img.show()  # Show the generated image
-
-                    _date_str = _date.strftime("%Y_%m_%d_%H_%M_%S")
-                    _filename = f"{ticker}-{timeframe_0}-{_date_str}.png"
-                    _path = os.path.join("NN", f"training_dataset_{timeframe_0}")
-
-                    # Performing classification of images
-                    # if data.close[0] > data.close[-1]:
-                    if _close_out[_date_out_index[_date]] > _close_out[_date_out_index[_date]-1]:
-                        _path = os.path.join(_path, "1")
-                    else:
-                        _path = os.path.join(_path, "0")
-
-                    img.save(os.path.join(_path, _filename))
-                print(ticker, _date)  # Output the ticker and date
+        # Draw images only for the lower TF whose date is present in the dates of the higher TF, with step steps_skip
+        # Performing classification of images: if the next close on the higher TF > the close at the date - class 1
+        _ends, _dates, _labels, _label_dates = functions_nn.get_windows_and_labels(df_in, df_out, draw_window,
+                                                                                   steps_skip)
+
+        _datetimes = _dates.astype("datetime64[ns]").view(np.int64)
+        samples[ticker] = _datetimes
+
+        # Samples already generated with the same parameters are skipped, otherwise the ticker starts from scratch
+        _generated = 0
+        if incremental:
+            _generated = functions_dataset.get_generated_samples(shards_folder, ticker, sample_params, _datetimes)
+        if not _generated:
+            functions_dataset.remove_manifest(shards_folder, ticker)
+            functions_dataset.remove_shards(shards_folder, f"{ticker}_")  # Shards of the previous run
+            functions_dataset.remove_pngs(params["png_folder"], f"{ticker}-{timeframe_0}-")  # PNGs of the previous run
+        print(ticker, f"{len(_ends)} samples, {len(_ends) - _generated} new")  # Output the ticker and the samples
+        if _generated == len(_ends):
+            continue
+
+        # Candles, SMA and samples go to shared memory, workers render (ticker, shard) units from there
+        _blocks, _spec = functions_dataset.share_arrays({
+            "close": df_in["close"].to_numpy(),
+            "sma_fast": df_in["sma_fast"].to_numpy(),
+            "sma_slow": df_in["sma_slow"].to_numpy(),
+            "ends": _ends,
+            "datetimes": _datetimes,
+            "labels": _labels,
+            "label_datetimes": _label_dates.astype("datetime64[ns]").view(np.int64),
+        })
+        blocks += _blocks
+        # The last shard of the previous run is rendered again, so the shards are the same as after a full run
+        units += functions_dataset.get_units(ticker, len(_ends), Config.dataset_shard_size, _spec,
+                                             first_sample=_generated)
+
+    # Rendering with a progress and throughput report
+    _total = sum(_unit["stop"] - _unit["start"] for _unit in units)
+    _done, _start_time = 0, time.perf_counter()
+    try:
+        with multiprocessing.Pool(workers) as pool:
+            for ticker, _count in pool.imap_unordered(functools.partial(functions_dataset.render_unit, params=params),
+                                                      units):
+                _done += _count
+                _elapsed = time.perf_counter() - _start_time
+                print(f"{_done}/{_total} images ({ticker}), {_done / _elapsed:.0f} images/s")
+    finally:
+        functions_dataset.release_arrays(blocks, unlink=True)
+
+    for ticker, _datetimes in samples.items():
+        functions_dataset.save_manifest(shards_folder, ticker, sample_params, _datetimes)
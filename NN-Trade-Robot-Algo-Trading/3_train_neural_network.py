@@ -18,15 +18,14 @@ We select the 27th epoch and place it in the `NN_winner` folder under the name `
 exit(777)  # prevent code from running, otherwise, it will overwrite the results
 
 import functions
+import functions_dataset
+import functions_nn
+import functions_tf
 import matplotlib.pyplot as plt
 import os
 import tensorflow as tf
 
-from tensorflow import keras
 from tensorflow import config
-from keras.models import Sequential
-from keras.layers import Conv2D, MaxPooling2D, Rescaling
-from keras.layers import Activation, Dropout, Flatten, Dense, BatchNormalization
 from keras.callbacks import ModelCheckpoint
 
 from my_config.trade_config import Config  # Configuration file for the trading bot
@@ -42,6 +41,7 @@ if __name__ == '__main__':  # Entry point when running this script
 
     timeframe_0 = Config.timeframe_0  # timeframe for training the neural network - input - for images
     draw_size = Config.draw_size  # size of the side of the square image
+    if Config.train_on_the_fly: draw_size = Config.draw_window  # images rendered on the fly are draw_window wide
 
     # =================================================================================================================
 
@@ -49,9 +49,18 @@ if __name__ == '__main__':  # Entry point when running this script
     data_dir = os.path.join(os.path.join(cur_run_folder, "NN"), f"training_dataset_{timeframe_0}")  # directory with data
     num_classes = 2  # total classes
     epochs = 40  # number of epochs
-    batch_size = 10  # batch size
+    batch_size = Config.train_batch_size  # batch size
     img_height, img_width = draw_size, draw_size  # image dimensions
-    input_shape = (img_height, img_width, 3)  # image shape
+    input_mode = Config.input_mode  # "image" - chart images, "series" - normalized raw series
+    if input_mode == "series": img_height = Config.draw_window  # series are draw_window long
+    input_shape = functions_tf.get_input_shape(input_mode, img_height)  # input shape
+
+    # input pipeline
+    parallel_calls = Config.train_parallel_calls or tf.data.AUTOTUNE  # parallel decoding of images
+    train_cache = Config.train_cache  # "" - no cache, "memory" - in memory, otherwise path of the cache on disk
+    val_cache = f"{train_cache}_val" if train_cache not in ("", "memory") else train_cache
+    train_shuffle = Config.train_shuffle  # shuffle the training samples every epoch
+    seed = Config.train_seed  # seed of the shuffling
 
     # # First type of model
     # model = Sequential()
@@ -77,49 +86,48 @@ if __name__ == '__main__':  # Entry point when running this script
     #     metrics=['accuracy']
     # )
 
-    # Second type of model
-    model = keras.Sequential([
-        keras.layers.Rescaling(1. / 255),
-        keras.layers.Conv2D(32, 3, activation='relu'),
-        keras.layers.MaxPooling2D(),
-        keras.layers.BatchNormalization(),
-        keras.layers.Conv2D(32, 3, activation='relu'),
-        keras.layers.MaxPooling2D(),
-        keras.layers.BatchNormalization(),
-        keras.layers.Conv2D(32, 3, activation='relu'),
-        keras.layers.MaxPooling2D(),
-        keras.layers.BatchNormalization(),
-        keras.layers.Flatten(),
-        keras.layers.Dense(128, activation='relu'),
-        keras.layers.Dense(num_classes)
-    ])
-    # version with Adam optimization (a stochastic gradient descent method)
-    model.compile(
-        optimizer='adam',
-        loss=keras.losses.SparseCategoricalCrossentropy(from_logits=True),
-        metrics=['accuracy'])
+    # Second type of model - Conv2D over chart images, or a compact Conv1D model over the raw series
+    model = functions_tf.build_model(input_mode, num_classes)
+
+    model_name = functions_tf.MODEL_NAMES[input_mode]  # cnn_Open for images, cnn1d_Open for series
 
     # model.summary()
 
+    if Config.train_on_the_fly:
+        # images are rendered from the candles inside the input pipeline: no 2_prepare run and no files on disk
+        samples = functions_nn.load_samples(Config.training_NN, timeframe_0, Config.timeframe_1, Config.period_sma_fast,
+                                            Config.period_sma_slow, Config.draw_window, Config.steps_skip)
+        # the latest 20% of the samples by datetime (of all tickers) are used for validation, earlier samples whose
+        # class is given by a bar of the validation period are not used
+        train_numbers, val_numbers = functions_dataset.get_time_split(samples["datetimes"], samples["label_datetimes"],
+                                                                      0.2)
+        train_ds, num_train = functions_tf.get_rendered_dataset(samples, train_numbers, Config.draw_window,
+                                                                parallel_calls, input_mode=input_mode)
+        val_ds, num_val = functions_tf.get_rendered_dataset(samples, val_numbers, Config.draw_window,
+                                                            parallel_calls, input_mode=input_mode)
+    elif Config.dataset_format == "shards" or input_mode == "series":
+        # shards prepared by 2_prepare (ordered by ticker): the latest 20% of the samples by datetime (of all tickers)
+        # are used for validation, earlier samples whose class is given by a bar of the validation period are not used
+        shards_folder = functions_dataset.get_shards_folder(timeframe_0, input_mode)
+        index = functions_dataset.load_index(shards_folder)
+        train_numbers, val_numbers = functions_dataset.get_time_split(index["datetimes"], index["label_datetimes"], 0.2)
+        train_ds, num_train = functions_tf.get_shards_dataset(shards_folder, train_numbers, input_shape,
+                                                              parallel_calls, input_mode=input_mode)
+        val_ds, num_val = functions_tf.get_shards_dataset(shards_folder, val_numbers, input_shape, parallel_calls,
+                                                          input_mode=input_mode)
+    else:
+        # PNG files decoded in parallel, split as image_dataset_from_directory(validation_split=0.2, shuffle=False)
+        train_ds, num_train = functions_tf.get_png_dataset(data_dir, 0.2, "training", parallel_calls)
+        val_ds, num_val = functions_tf.get_png_dataset(data_dir, 0.2, "validation", parallel_calls)
+    print(f"Using {num_train} samples for training, {num_val} for validation.")
+
     # training dataset
-    train_ds = tf.keras.utils.image_dataset_from_directory(
-        data_dir,
-        validation_split=0.2,
-        subset="training",
-        # seed=123,
-        shuffle=False,
-        image_size=(img_height, img_width),
-        batch_size=batch_size)
+    train_ds = functions_tf.build_pipeline(train_ds, num_train, batch_size, cache=train_cache, shuffle=train_shuffle,
+                                           seed=seed, parallel_calls=parallel_calls)
 
     # validation dataset
-    val_ds = tf.keras.utils.image_dataset_from_directory(
-        data_dir,
-        validation_split=0.2,
-        subset="validation",
-        # seed=123,
-        shuffle=False,
-        image_size=(img_height, img_width),
-        batch_size=batch_size)
+    val_ds = functions_tf.build_pipeline(val_ds, num_val, batch_size, cache=val_cache, shuffle=False,
+                                         seed=seed, parallel_calls=parallel_calls)
 
     # # normalization is built directly into the model
     # normalization_layer = tf.keras.layers.Rescaling(1. / 255)
@@ -127,7 +135,8 @@ if __name__ == '__main__':  # Entry point when running this script
     # val_ds = val_ds.map(lambda x, y: (normalization_layer(x), y))
 
     # for model saving
-    callbacks = [ModelCheckpoint(functions.join_paths([cur_run_folder, "NN", "_models", 'cnn_Open{epoch:1d}.hdf5'])),
+    callbacks = [ModelCheckpoint(functions.join_paths([cur_run_folder, "NN", "_models", model_name + '{epoch:1d}.hdf5'])),
+                 functions_tf.ThroughputLogger(num_train),  # samples/sec of every epoch
                  # keras.callbacks.EarlyStopping(monitor='loss', patience=10),
                  ]
 
@@ -1,58 +1,140 @@
 """
-In this code, we implement a check of the neural network's image class predictions.
+In this code, we evaluate the neural network's class predictions on the whole dataset or on a time-based holdout
+(Config.eval_holdout_start - only samples from this date).
+
+The samples are streamed through the model in large batches (Config.eval_batch_size), reading/rendering of the next
+batches runs in parallel with the inference. We print:
+- confusion matrix and precision/recall/F1 of every class at the class-1 logit threshold Config.eval_threshold
+- calibration of the class-1 logit threshold: precision/recall/share of signals over thresholds and the best F1
+- reliability of the predicted probability of class 1
+- throughput in samples/sec and the counters of the render cache (functions_cache)
+
+Per-sample predictions (ticker, datetime, label, logits) are saved to NN/_eval/predictions_{model}_{timeframe}.npz,
+see functions_eval.load_predictions.
 """
 
 import os
+import time
 import functions
+import functions_cache
+import functions_dataset
+import functions_eval
+import functions_nn
+import functions_tf
 import numpy as np
+import pandas as pd
+import tensorflow as tf
 from PIL import Image
 
 from keras.models import load_model
-from keras.utils.image_utils import img_to_array
 
 from my_config.trade_config import Config  # Configuration file for the trading bot
 
 
 if __name__ == "__main__":
 
+    # whether to redirect output from console to a file
+    functions.start_redirect_output_from_screen_to_file(False, filename="4_check_predictions_log.txt")
+
     timeframe_0 = Config.timeframe_0  # the timeframe we trade on == the timeframe the neural network was trained on
+    input_mode = Config.input_mode  # "image" - chart images, "series" - normalized raw series
+    batch_size = Config.eval_batch_size  # number of samples in one forward pass
+    threshold = Config.eval_threshold  # class 1 if its logit >= threshold
+    parallel_calls = Config.train_parallel_calls or tf.data.AUTOTUNE  # parallel reading of samples
+    model_name = functions_tf.MODEL_NAMES[input_mode]
 
     # load the trained neural network
-    model = load_model(os.path.join("NN_winner", "cnn_Open.hdf5"))
+    model = load_model(os.path.join("NN_winner", f"{model_name}.hdf5"))
     # Check its architecture
     model.summary()
 
-    # load an image to test its class prediction
-    _path0 = functions.join_paths(["NN", f"training_dataset_{timeframe_0}", "0"])
-    images_class_0 = [f for f in os.listdir(_path0) if os.path.isfile(os.path.join(_path0, f))]  # images of class 0
-    _path1 = functions.join_paths(["NN", f"training_dataset_{timeframe_0}", "1"])
-    images_class_1 = [f for f in os.listdir(_path1) if os.path.isfile(os.path.join(_path1, f))]  # images of class 1
-
-    images_class_0 = images_class_0[:10]  # keep the first 10
-    images_class_1 = images_class_1[:10]  # keep the first 10
-
-    # print(images_class_0)
-
-    for _img in images_class_0:
-        img = Image.open(os.path.join(_path0, _img))
-        # send the image to the neural network
-        img_array = img_to_array(img)  # https://www.tensorflow.org/api_docs/python/tf/keras/utils/img_to_array
-        # print(img_array.shape)
-        img_array = np.expand_dims(img_array, axis=0)
-        # print(img_array.shape)
-        _predict = model.predict(img_array, verbose=0)
-        _class = 0
-        if _predict[0][1] >= 0: _class = 1
-        print(f"For image: {_path0}\{_img} Predicted: {_predict} => class={_class}")
-
-    for _img in images_class_1:
-        img = Image.open(os.path.join(_path1, _img))
-        # send the image to the neural network
-        img_array = img_to_array(img)  # https://www.tensorflow.org/api_docs/python/tf/keras/utils/img_to_array
-        # print(img_array.shape)
-        img_array = np.expand_dims(img_array, axis=0)
-        # print(img_array.shape)
-        _predict = model.predict(img_array, verbose=0)
-        _class = 0
-        if _predict[0][1] >= 0: _class = 1
-        print(f"For image: {_path1}\{_img} Predicted: {_predict} => class={_class}")
+    # samples to evaluate: tickers, datetimes, labels and a function reading a batch of them by their numbers
+    if Config.train_on_the_fly:
+        # render from the candles, the same samples as in 3_train
+        samples = functions_nn.load_samples(Config.training_NN, timeframe_0, Config.timeframe_1, Config.period_sma_fast,
+                                            Config.period_sma_slow, Config.draw_window, Config.steps_skip)
+        draw_size = Config.draw_window
+        tickers, datetimes, labels = samples["tickers"], samples["datetimes"], samples["labels"]
+
+        def read_batch(numbers):
+            return functions_nn.render_samples(samples, numbers, Config.draw_window, input_mode)
+    elif Config.dataset_format == "shards" or input_mode == "series":
+        # shards prepared by 2_prepare
+        draw_size = Config.draw_window if input_mode == "series" else Config.draw_size
+        reader = functions_tf.ShardReader(functions_dataset.get_shards_folder(timeframe_0, input_mode))
+        tickers, datetimes, labels = reader.index["tickers"], reader.index["datetimes"], reader.index["labels"]
+        read_batch = reader.get_batch
+    else:
+        # PNG files NN/training_dataset_{timeframe_0}/{class}/{ticker}-{timeframe}-{date}.png
+        draw_size = Config.draw_size
+        data_dir = functions.join_paths(["NN", f"training_dataset_{timeframe_0}"])
+        files, labels = functions_tf.get_png_files(data_dir, 0.0, "training")
+        files, labels = np.asarray(files), np.asarray(labels, dtype=np.int64)
+        _names = [os.path.basename(_file)[:-len(".png")].split("-") for _file in files]
+        tickers = np.asarray([_name[0] for _name in _names])
+        datetimes = pd.to_datetime([_name[2] for _name in _names], format="%Y_%m_%d_%H_%M_%S")
+        datetimes = datetimes.values.astype("datetime64[ns]").view(np.int64)
+
+        def read_batch(numbers):
+            return np.stack([np.asarray(Image.open(_file).convert("RGB")) for _file in files[numbers]]), labels[numbers]
+
+    numbers = np.arange(len(labels))
+    if Config.eval_holdout_start:
+        numbers = numbers[datetimes >= pd.Timestamp(Config.eval_holdout_start).value]
+        print(f"Holdout from {Config.eval_holdout_start}: {len(numbers)} of {len(labels)} samples")
+    else:
+        print(f"Whole dataset: {len(numbers)} samples")
+    if not len(numbers):
+        functions.print_error_and_exit("No samples to evaluate", 1)
+
+    # stream the samples through the model in large batches
+    input_shape = functions_tf.get_input_shape(input_mode, draw_size)
+    ds = functions_tf.get_batches_dataset(read_batch, numbers, input_shape, parallel_calls, batch_size, input_mode)
+    infer = tf.function(lambda x: model(x, training=False), reduce_retracing=True)
+    infer(tf.zeros((1,) + input_shape, dtype=functions_tf.INPUT_DTYPES[input_mode]))  # warm-up: trace the graph
+
+    _start = time.perf_counter()
+    logits, eval_labels = [], []
+    for _inputs, _labels in ds:
+        logits.append(infer(_inputs).numpy())
+        eval_labels.append(_labels.numpy())
+    _elapsed = time.perf_counter() - _start
+    logits, eval_labels = np.concatenate(logits), np.concatenate(eval_labels)
+    print(f"Throughput: {len(numbers) / _elapsed:.0f} samples/s ({len(numbers)} samples in {_elapsed:.1f} s)")
+    print(functions_cache.format_stats(functions_cache.RENDER, functions_cache.SMA))  # inputs rendered on the fly
+
+    # metrics at the threshold of the live strategy
+    scores = logits[:, 1]  # class-1 logit
+    predicted = (scores >= threshold).astype(np.int64)
+    matrix = functions_eval.confusion_matrix(eval_labels, predicted)
+    precision, recall, f1 = functions_eval.precision_recall(matrix)
+    print(f"\nConfusion matrix at class-1 logit >= {threshold} (rows - true class, columns - predicted class):")
+    print(f"{'':>10}{'pred 0':>10}{'pred 1':>10}")
+    for _class in (0, 1):
+        print(f"{'true ' + str(_class):>10}{matrix[_class, 0]:>10}{matrix[_class, 1]:>10}")
+    print(f"Accuracy: {np.trace(matrix) / matrix.sum():.4f}")
+    for _class in (0, 1):
+        print(f"Class {_class}: precision={precision[_class]:.4f} recall={recall[_class]:.4f} f1={f1[_class]:.4f}")
+
+    # calibration of the class-1 logit threshold
+    curve, best_threshold = functions_eval.calibrate_threshold(eval_labels, scores)
+    print(f"\nClass-1 logit threshold calibration (best F1 at threshold {best_threshold:.4f}):")
+    print(f"{'threshold':>12}{'precision':>12}{'recall':>12}{'f1':>12}{'signals':>12}")
+    for _i in np.unique(np.linspace(0, len(curve["threshold"]) - 1, 11).astype(int)):
+        print(f"{curve['threshold'][_i]:>12.4f}{curve['precision'][_i]:>12.4f}{curve['recall'][_i]:>12.4f}"
+              f"{curve['f1'][_i]:>12.4f}{curve['signals'][_i]:>12.4f}")
+
+    bins, ece = functions_eval.reliability(eval_labels, functions_eval.softmax(logits)[:, 1])
+    print(f"\nReliability of P(class 1), ECE={ece:.4f}:")
+    print(f"{'bin':>12}{'samples':>12}{'predicted':>12}{'observed':>12}")
+    for _bin in range(len(bins["count"])):
+        print(f"{_bin / len(bins['count']):>12.1f}{bins['count'][_bin]:>12}{bins['predicted'][_bin]:>12.4f}"
+              f"{bins['observed'][_bin]:>12.4f}")
+
+    # per-sample predictions for later analysis
+    _filename = functions.join_paths(["NN", "_eval", f"predictions_{model_name}_{timeframe_0}.npz"])
+    functions_eval.save_predictions(_filename, tickers[numbers], datetimes[numbers], eval_labels, logits)
+    print(f"\nPredictions saved to {_filename}")
+
+    # stop redirecting output from the console to the file
+    functions.stop_redirect_output_from_screen_to_file()
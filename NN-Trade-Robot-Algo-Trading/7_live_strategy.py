@@ -15,12 +15,17 @@ import aiohttp
 import aiomoex
 import logging
 import functions
+import functions_indicators
+import functions_live
 import functions_nn
+import functions_orders
+import functions_strategy
+import functions_tf
 import pandas as pd
 import numpy as np
 from aiohttp import ClientSession
 from datetime import datetime, timedelta
-from typing import List, Optional
+from typing import Optional
 
 from FinamPy import FinamPy  # Connect to Finam API for placing buy/sell orders
 from FinamPy.proto.tradeapi.v1.common_pb2 import BUY_SELL_BUY, BUY_SELL_SELL
@@ -29,16 +34,18 @@ from my_config.Config import Config as ConfigAPI  # Finam API config file
 from my_config.trade_config import Config  # Trade robot config file
 
 from keras.models import load_model
-from keras.utils.image_utils import img_to_array
 
 
 logging.basicConfig(format="%(asctime)s %(levelname)s:%(message)s", level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
 
-class HackathonFinamStrategy:
+class HackathonFinamStrategy(functions_strategy.OneBarHoldRule):
     """This class implements our trading strategy."""
 
+    buy_sell_buy = BUY_SELL_BUY  # Sides of the orders as defined by FinamPy
+    buy_sell_sell = BUY_SELL_SELL
+
     def __init__(
         self,
         ticker: str,
@@ -50,124 +57,89 @@ class HackathonFinamStrategy:
         trading_hours_end: str,
         security_board: str,
         client_id: str,
+        clock=datetime.now,
+        report_orders: bool = True,
     ):
+        super().__init__(ticker, security_board, client_id, clock=clock, report_orders=report_orders)
         self.account_id = None
-        self.ticker = ticker
         self.timeframe = timeframe
         self.days_back = days_back
         self.check_interval = check_interval
         self.session = session
-        self.candles: List[List] = []
+        self.period_sma_slow = Config.period_sma_slow  # Period of the slow SMA
+        self.period_sma_fast = Config.period_sma_fast  # Period of the fast SMA
+        self.draw_window = Config.draw_window  # Data window
+        # Fast and slow SMA updated with every new bar - the same indicators as in the dataset preparation
+        self.indicators = functions_indicators.IndicatorSet(
+            functions_indicators.get_sma_specs(self.period_sma_fast, self.period_sma_slow))
+        # Last bars needed to draw the window, with the SMA values of every bar
+        self.candles = functions_live.CandleRingBuffer(self.draw_window, features=tuple(self.indicators.specs))
         self.live_mode = False
         self.trading_hours_start = trading_hours_start
         self.trading_hours_end = trading_hours_end
-        self.security_board = security_board
-        self.client_id = client_id
-        self.order_time = None
-        self.in_position = False
 
     async def get_all_candles(self, start, end):
-        """Function to get candles from MOEX."""
+        """Function to get candles from MOEX, the last one is the still-forming candle."""
         tf = functions.get_timeframe_moex(self.timeframe)
         data = await aiomoex.get_market_candles(self.session, self.ticker, interval=tf, start=start, end=end)  # M10
-        df = pd.DataFrame(data)
-        df['datetime'] = pd.to_datetime(df['begin'], format='%Y-%m-%d %H:%M:%S')
-        # For M1, M10, H1 - correct the candle's date format
-        if tf in [1, 10, 60]:
-            df['datetime'] = df['datetime'].apply(lambda x: x + timedelta(minutes=tf))
-        df = df[["datetime", "open", "high", "low", "close", "volume"]].copy()
-        # Except for the last candle, as its volume may change in the market
-        df = df[:-1]
-        return df.values.tolist()
-
-    async def get_historical_data(self, model, fp_provider):
-        """Retrieve historical data for the ticker."""
+        # For M1, M10, H1 - correct the candle's date format: the date of a candle is its end
+        _shift = timedelta(minutes=tf) if tf in [1, 10, 60] else timedelta(0)
+        return [[datetime.fromisoformat(_candle["begin"]) + _shift, _candle["open"], _candle["high"], _candle["low"],
+                 _candle["close"], _candle["volume"]] for _candle in data]
+
+    def get_start(self):
+        """Start of the request to MOEX: from the end of the last stored bar, or days_back for the first request."""
+        if self.candles.last_datetime is None:
+            return (datetime.now().date() - timedelta(days=self.days_back)).strftime("%Y-%m-%d")
+        # The end of the last complete bar is the begin of the next one - MOEX filters candles by their begin
+        return pd.Timestamp(self.candles.last_datetime).strftime("%Y-%m-%d %H:%M:%S")
+
+    async def get_historical_data(self, inference, gateway):
+        """Retrieve the new bars for the ticker: only candles after the last stored one are requested."""
         logger.debug("Fetching historical data for ticker: %s", self.ticker)
-        start = (datetime.now().date()-timedelta(days=self.days_back)).strftime("%Y-%m-%d")
+        start = self.get_start()
         end = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         _candles = await self.get_all_candles(start=start, end=end)
+        if not _candles:
+            return
+        # The last candle is still forming (its volume may change in the market): it is skipped and gets into
+        # the buffer once a newer candle appears, in this or a later request
+        _candles.pop()
         for candle in _candles:
-            if candle not in self.candles:
-                self.candles.append(candle)
+            if self.candles.append(candle):
+                self.candles.set_last(self.indicators.update(candle[4]))  # SMA of the new bar, O(1)
                 logger.debug("- Found %s - ticker: %s - live: %s", candle, self.ticker, self.live_mode)
 
                 # If already in live mode
                 if self.live_mode:
-                    await self.live_check_can_we_open_position(model, fp_provider)
+                    await self.live_check_can_we_open_position(inference, gateway)
 
-    async def live_check_can_we_open_position(self, model, fp_provider):
+    async def live_check_can_we_open_position(self, inference, gateway):
         """In live mode, check if we can open a position based on the neural network's class 1 signal."""
         # Create current image to send to the neural network
 
-        df = pd.DataFrame(self.candles, columns=["datetime", "open", "high", "low", "close", "volume"])
-        df['datetime'] = pd.to_datetime(df['datetime'], format='%Y-%m-%d %H:%M:%S')
-
-        period_sma_slow = 64
-        period_sma_fast = 16
-        draw_window = 128  # Data window
-        steps_skip = 16  # Step for window shift
-        draw_size = 128  # Size of the square image
-
-        df['datetime'] = pd.to_datetime(df['datetime'], format='%Y-%m-%d %H:%M:%S')
-        df['sma_fast'] = df['close'].rolling(period_sma_fast).mean()  # Create fast SMA
-        df['sma_slow'] = df['close'].rolling(period_sma_slow).mean()  # Create slow SMA
+        draw_window = self.draw_window  # Data window
+        _window = self.candles.window(draw_window)  # Views of the last bars, no copy
+        if len(_window["close"]) < draw_window or np.isnan(_window["sma_slow"][0]):
+            return  # Not enough bars yet to draw the window
 
-        df.dropna(inplace=True)  # Remove all NULL values
+        _sma_fast_list = _window["sma_fast"]
+        _sma_slow_list = _window["sma_slow"]
+        _closes_list = _window["close"]
 
-        df_in = df.copy()
-        _close_in = df_in["close"].tolist()
-        sma_fast = df_in["sma_fast"].tolist()
-        sma_slow = df_in["sma_slow"].tolist()
-        j = len(_close_in)
+        # Generate image (or normalized series in the "series" input mode) for the neural network
+        if Config.input_mode == "series":
+            img_array = functions_nn.generate_series_array(_sma_fast_list, _sma_slow_list, _closes_list, draw_window)
+        else:
+            img_array = functions_nn.generate_img_array(_sma_fast_list, _sma_slow_list, _closes_list, draw_window)
 
-        _sma_fast_list = sma_fast[j - draw_window:j]
-        _sma_slow_list = sma_slow[j - draw_window:j]
-        _closes_list = _close_in[j - draw_window:j]
-
-        # Generate image for neural network training/test
-        img = functions_nn.generate_img(_sma_fast_list, _sma_slow_list, _closes_list, draw_window)
-
-        # Send the generated image to the neural network
-        img_array = img_to_array(img)
-        img_array = np.expand_dims(img_array, axis=0)
-        _predict = model.predict(img_array, verbose=0)
+        # Send the generated image to the neural network - batched with the requests of the other tickers
+        _predict = await inference.predict(img_array.astype(np.float32))
         _class = 0
-        if _predict[0][1] >= 0: _class = 1
-        print("Predicted: ", model.predict(img_array), " class = ", _class)
-
-        # +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
-        # Now implement simple trading logic
-        if not self.in_position:  # If no open position
-            if _class == 1:
-                # Buy if we haven't yet and the neural network predicts growth
-                rez = fp_provider.new_order(client_id=self.client_id, security_board=self.security_board,
-                                            security_code=self.ticker,
-                                            buy_sell=BUY_SELL_BUY, quantity=1,
-                                            use_credit=True,
-                                            )
-
-                self.order_time = datetime.now()
-                self.in_position = True
-                print(f"Placed a buy order for 1 lot of {self.ticker}:", rez)
-                print("\t - transaction:", rez.transaction_id)
-                print("\t - time:", self.order_time)
-        else:  # If there is an open position, check if it's time to close it
-            _now = datetime.now()
-            _timeframe_1 = Config.timeframe_1  # Higher timeframe
-            _delta = functions.get_timeframe_moex(tf=_timeframe_1)
-            if _now >= self.order_time + timedelta(minutes=_delta):
-                # Sell if enough time has passed +1 bar of the higher timeframe
-                rez = fp_provider.new_order(client_id=self.client_id, security_board=self.security_board,
-                                            security_code=self.ticker,
-                                            buy_sell=BUY_SELL_SELL, quantity=1,
-                                            use_credit=True,
-                                            )
-                self.order_time = None
-                self.in_position = False
-                print(f"Placed a sell order for 1 lot of {self.ticker}:", rez)
-                print("\t - transaction:", rez.transaction_id)
-                print("\t - time:", self.order_time)
-        # +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+        if _predict[1] >= 0: _class = 1
+        print("Predicted: ", _predict, " class = ", _class, " ticker = ", self.ticker)
+
+        self.trade(_class, gateway)
 
     async def ensure_market_open(self):
         """Wait for the market to open. Ignores weekends and holidays."""
@@ -180,12 +152,59 @@ class HackathonFinamStrategy:
             if now_start <= now <= now_end: is_trading_hours = True
             if not is_trading_hours: await asyncio.sleep(60)
 
-    async def main_cycle(self, model, fp_provider):
+    async def main_cycle(self, inference, gateway):
         """Main live strategy cycle."""
         while True:
             try:
-                await self.get_historical_data(model, fp_provider)  # Retrieve historical data from MOEX
+                await self.get_historical_data(inference, gateway)  # Retrieve historical data from MOEX
 
                 if not self.live_mode: self.live_mode = True  # Switch to live mode
 
-                # Signals for buy/sell are handled in live_check_can_we_open
\ No newline at end of file
+                # Signals for buy/sell are handled in live_check_can_we_open_position
+                logger.debug("- Live mode: running the buy/sell strategy code - ticker: %s", self.ticker)
+
+            except aiohttp.ClientError as are:
+                logger.error("Client error %s - ticker: %s", are, self.ticker)
+            except Exception as e:
+                logger.exception("Error in the main cycle - ticker: %s: %s", self.ticker, e)
+
+            await asyncio.sleep(self.check_interval)
+
+
+async def run_strategy(model, broker, client_id):
+    """Run the strategy for all tickers of the portfolio in one shared MOEX session and one inference service."""
+    # Compiled and warmed-up forward pass with preallocated input buffers
+    _input_shape = functions_tf.get_input_shape(Config.input_mode, Config.draw_window)
+    _predictor = functions_tf.CompiledModel(model, _input_shape, backend=Config.live_inference_backend,
+                                            max_batch=Config.live_max_batch)
+    inference = functions_live.InferenceService(_predictor.predict_batch, max_batch=Config.live_max_batch,
+                                                batch_window=Config.live_batch_window).start()
+    # Broker calls run in a bounded pool of threads and do not block the event loop
+    gateway = functions_orders.OrderGateway(broker, max_workers=Config.live_order_workers)
+    async with aiohttp.ClientSession() as session:
+        strategy_tasks = []
+        for ticker in sorted(Config.portfolio):
+            strategy = HackathonFinamStrategy(
+                ticker=ticker,
+                timeframe=Config.timeframe_0,
+                days_back=1,
+                check_interval=10,
+                session=session,
+                trading_hours_start=Config.trading_hours_start,
+                trading_hours_end=Config.trading_hours_end,
+                security_board=Config.security_board,
+                client_id=client_id,
+            )
+            await strategy.ensure_market_open()
+            strategy_tasks.append(asyncio.create_task(strategy.main_cycle(inference, gateway)))
+        await asyncio.gather(*strategy_tasks)
+
+
+if __name__ == "__main__":
+    # Neural network selected at step #3: cnn_Open.hdf5 for images, cnn1d_Open.hdf5 for series
+    _model = load_model(os.path.join("NN_winner", f"{functions_tf.MODEL_NAMES[Config.input_mode]}.hdf5"))
+
+    _fp_provider = FinamPy(ConfigAPI.AccessToken)  # Connect to Finam API
+    _client_id = ConfigAPI.ClientIds[0]  # Trading account
+
+    asyncio.run(run_strategy(_model, _fp_provider, _client_id))
@@ -0,0 +1,70 @@
+"""
+In this code, we compare the two input modes of the neural network side by side:
+- "image" - 128x128x3 chart images of close + SMA1 + SMA2 with the Conv2D model
+- "series" - the same three series normalized to (128, 3) with a compact Conv1D model
+
+Both datasets are rendered in memory from the same candles and samples (see functions_nn.load_samples),
+both models are trained on the same split, and for each mode we print:
+- dataset size in bytes
+- time of one training epoch
+- p50/p99 latency of a single-sample inference
+- validation accuracy
+"""
+
+import functions_dataset
+import functions_nn
+import functions_tf
+import numpy as np
+import time
+import tensorflow as tf
+
+from my_config.trade_config import Config  # Configuration file for the trading bot
+
+
+if __name__ == '__main__':  # Entry point when running this script
+
+    epochs = 3  # number of epochs to train each model
+    latency_samples = 200  # number of single-sample inferences to measure latency
+    batch_size = Config.train_batch_size  # batch size
+    draw_window = Config.draw_window  # data window
+
+    samples = functions_nn.load_samples(Config.training_NN, Config.timeframe_0, Config.timeframe_1,
+                                        Config.period_sma_fast, Config.period_sma_slow, draw_window, Config.steps_skip)
+    num_samples = len(samples["labels"])
+    # the latest 20% of the samples by datetime (of all tickers) are used for validation
+    train_numbers, val_numbers = functions_dataset.get_time_split(samples["datetimes"], samples["label_datetimes"], 0.2)
+    num_train = len(train_numbers)
+    print(f"{num_samples} samples: {num_train} for training, {len(val_numbers)} for validation")
+
+    results = {}
+    for input_mode in ("image", "series"):
+        tf.keras.utils.set_random_seed(Config.train_seed)
+        inputs, labels = functions_nn.render_samples(samples, np.arange(num_samples), draw_window, input_mode)
+        train_ds = tf.data.Dataset.from_tensor_slices((inputs[train_numbers], labels[train_numbers]))
+        train_ds = train_ds.shuffle(num_train, seed=Config.train_seed).batch(batch_size).prefetch(tf.data.AUTOTUNE)
+        val_ds = tf.data.Dataset.from_tensor_slices((inputs[val_numbers], labels[val_numbers])).batch(batch_size)
+
+        model = functions_tf.build_model(input_mode, num_classes=2)
+        model.fit(train_ds, epochs=1, verbose=0)  # warm-up epoch, builds and traces the model
+        _start = time.perf_counter()
+        history = model.fit(train_ds, validation_data=val_ds, epochs=epochs, verbose=0)
+        epoch_time = (time.perf_counter() - _start) / epochs
+
+        _latencies = []
+        for _input in inputs[:latency_samples]:
+            _start = time.perf_counter()
+            model(_input[None], training=False)
+            _latencies.append(time.perf_counter() - _start)
+
+        results[input_mode] = {
+            "dataset bytes": f"{inputs.nbytes:,}",
+            "epoch time, s": f"{epoch_time:.2f}",
+            "latency p50, ms": f"{np.percentile(_latencies, 50) * 1000:.2f}",
+            "latency p99, ms": f"{np.percentile(_latencies, 99) * 1000:.2f}",
+            "val accuracy": f"{history.history['val_accuracy'][-1]:.4f}",
+            "parameters": f"{model.count_params():,}",
+        }
+
+    print(f"{'':<18}{'image':>16}{'series':>16}")
+    for _name in results["image"]:
+        print(f"{_name:<18}{results['image'][_name]:>16}{results['series'][_name]:>16}")
@@ -0,0 +1,54 @@
+"""
+In this code, we measure the per-signal latency of the neural network from NN_winner:
+- "predict" - model.predict on a batch of one, as the live strategy used to do
+- "keras" - model.predict_on_batch
+- "function" - tf.function with a fixed input signature (functions_tf.CompiledModel)
+- "tflite" - TFLite interpreter (functions_tf.CompiledModel)
+For each path we print p50/p99 latency of one signal and of a batch of Config.live_max_batch signals.
+"""
+
+import os
+import time
+import functions_tf
+import numpy as np
+
+from keras.models import load_model
+
+from my_config.trade_config import Config  # Configuration file for the trading bot
+
+
+def measure(predict, inputs, repeats):
+    """p50 and p99 latency in milliseconds of predict(inputs)"""
+    _latencies = []
+    for _ in range(repeats):
+        _start = time.perf_counter()
+        predict(inputs)
+        _latencies.append((time.perf_counter() - _start) * 1000)
+    return np.percentile(_latencies, 50), np.percentile(_latencies, 99)
+
+
+if __name__ == "__main__":
+
+    repeats = 300  # number of measured calls of every path
+    input_mode = Config.input_mode  # "image" - chart images, "series" - normalized raw series
+    input_shape = functions_tf.get_input_shape(input_mode, Config.draw_window)
+    max_batch = Config.live_max_batch
+
+    model = load_model(os.path.join("NN_winner", f"{functions_tf.MODEL_NAMES[input_mode]}.hdf5"))
+    rng = np.random.default_rng(Config.train_seed)
+    if input_mode == "series":
+        inputs = rng.random((max_batch,) + input_shape, dtype=np.float32)
+    else:
+        inputs = rng.integers(0, 256, (max_batch,) + input_shape).astype(np.float32)
+
+    paths = {"predict": lambda x: model.predict(x, verbose=0)}
+    for backend in ("keras", "function", "tflite"):
+        _start = time.perf_counter()
+        paths[backend] = functions_tf.CompiledModel(model, input_shape, backend, max_batch).predict_batch
+        print(f"{backend}: created and warmed up in {time.perf_counter() - _start:.2f} s")
+
+    print(f"\n{'path':<10}{'1 p50, ms':>12}{'1 p99, ms':>12}{f'{max_batch} p50, ms':>14}{f'{max_batch} p99, ms':>14}")
+    for name, predict in paths.items():
+        _p50, _p99 = measure(predict, inputs[:1], repeats)
+        _batch_p50, _batch_p99 = measure(predict, inputs, max(repeats // 10, 10))
+        print(f"{name:<10}{_p50:>12.2f}{_p99:>12.2f}{_batch_p50:>14.2f}{_batch_p99:>14.2f}")
@@ -1,6 +1,8 @@
 import datetime
 import math
+import numpy as np
 import os
+import shutil
 import sys
 
 def get_timeframe_moex(tf, rv=False):
@@ -13,6 +15,9 @@ def get_timeframe_moex(tf, rv=False):
         return tfs[tf]
     return False
 
+# Length of timeframes in minutes, False - not a fixed length
+TIMEFRAME_MINUTES = {'M1': 1, 'M2': 2, 'M5': 5, 'M10': 10, 'M15': 15, 'M30': 30, 'H1': 60, 'H2': 120, 'H4': 240, 'D1': 1440, 'W1': False, 'MN1': False}
+
 def get_future_key(key, tf, future_tf):
     """Calculate the next key for a higher timeframe, except for tf == D1, W1, MN1 and except future_tf == W1, MN1"""
     if tf in ["D1", "W1", "MN1"] or future_tf in ["W1", "MN1"]: 
@@ -25,7 +30,7 @@ def get_future_key(key, tf, future_tf):
     else:
         future_key = datetime.datetime.fromisoformat(key.strftime('%Y-%m-%d') + " 00:00")
 
-    tfs = {'M1': 1, 'M2': 2, 'M5': 5, 'M10': 10, 'M15': 15, 'M30': 30, 'H1': 60, 'H2': 120, 'H4': 240, 'D1': 1440, 'W1': False, 'MN1': False}
+    tfs = TIMEFRAME_MINUTES
 
     _k = tfs[tf]
     _k2 = tfs[future_tf]
@@ -38,6 +43,26 @@ def get_future_key(key, tf, future_tf):
     # print("\t", _hour, _minute, _k, _k2, _i1)
     return key, future_key, future_key2
 
+def get_future_keys(keys, tf, future_tf):
+    """Vectorized get_future_key for a whole array of keys (DatetimeIndex, datetime64 or int64 epoch in nanoseconds).
+    Returns datetime64[ns] arrays keys, future_keys, future_keys2 or False for the same unsupported timeframes"""
+    if tf in ["D1", "W1", "MN1"] or future_tf in ["W1", "MN1"]:
+        return False
+
+    _minute_ns = 60 * 10**9
+    keys = _to_epoch_ns(keys)
+    _k2 = TIMEFRAME_MINUTES[future_tf]
+    _i1 = (keys // _minute_ns) % 60 // _k2
+    if future_tf != "D1":
+        future_keys = keys - keys % (60 * _minute_ns)  # Start of the hour
+    else:
+        future_keys = keys - keys % (1440 * _minute_ns)  # Start of the day
+
+    _shift = _k2 * (_i1 + 1) * _minute_ns
+    future_keys = future_keys + _shift
+    future_keys2 = future_keys + _shift
+    return keys.view('datetime64[ns]'), future_keys.view('datetime64[ns]'), future_keys2.view('datetime64[ns]')
+
 def detect_class(key, future_key, future_key2, arr_OHLCV_1, timeframe_1, expected_change):
     """Determine the class to which the future candles at future_key, future_key2 belong"""
     if future_key in arr_OHLCV_1:
@@ -91,6 +116,48 @@ def get_classification(_p, tf, ex_ch):
             break
     return _class_percent
 
+def get_classification_batch(_p, tf, ex_ch):
+    """Vectorized get_classification for an array of candle percentages (ex_ch[tf] sorted ascending)"""
+    _thresholds = np.asarray(ex_ch[tf], dtype=np.float64)
+    _i = np.searchsorted(_thresholds, _p, side='right') - 1  # Bucket with ex_ch[tf][i] <= _p < ex_ch[tf][i + 1]
+    return np.where((_i >= 0) & (_i < len(_thresholds) - 1), _i, 6)
+
+def _to_epoch_ns(values):
+    """Convert timestamps (datetime64, datetime or int64 epoch in nanoseconds) to an int64 array"""
+    return np.asarray(values, dtype='datetime64[ns]').view(np.int64)
+
+def _get_future_rows(keys, future_keys, timestamps_1):
+    """Rows of the candles at future_keys, or of the first candle after key if future_key is missing"""
+    _pos = np.searchsorted(timestamps_1, future_keys)
+    _found = _pos < len(timestamps_1)
+    _found[_found] = timestamps_1[_pos[_found]] == future_keys[_found]
+    _rows = np.where(_found, _pos, np.searchsorted(timestamps_1, keys, side='right'))  # Nearest k > key
+    if np.any(_rows >= len(timestamps_1)):
+        raise KeyError(f"No candle of timeframe_1 after {keys[_rows >= len(timestamps_1)][0]}")
+    return _rows
+
+def detect_class_batch(keys, future_keys, future_keys2, timestamps_1, percents_1, timeframe_1, expected_change):
+    """Vectorized detect_class for all samples at once.
+    timestamps_1, percents_1 - sorted timestamps of the candles of timeframe_1 and their _percent_OC,
+    i.e. the keys of arr_OHLCV_1 in time order and _future_ohlcv[5]"""
+    keys, future_keys, future_keys2 = _to_epoch_ns(keys), _to_epoch_ns(future_keys), _to_epoch_ns(future_keys2)
+    timestamps_1 = _to_epoch_ns(timestamps_1)
+    percents_1 = np.asarray(percents_1, dtype=np.float64)
+
+    _percent_OC = percents_1[_get_future_rows(keys, future_keys, timestamps_1)]
+    _sign = np.copysign(1, _percent_OC)  # Get the sign of the percentage
+    _classification_percent = _sign * get_classification_batch(np.abs(_percent_OC), tf=timeframe_1, ex_ch=expected_change)
+
+    # Attempt to classify again by looking two candles ahead
+    _again = np.flatnonzero(_classification_percent == 0)
+    if len(_again):
+        _percent_OC2 = percents_1[_get_future_rows(keys[_again], future_keys2[_again], timestamps_1)]
+        _sign = np.copysign(1, _percent_OC2)  # Sign of the second candle alone, as in detect_class
+        _percent_OC2 = _percent_OC2 + _percent_OC[_again]  # Consider % of the previous candle
+        _classification_percent[_again] = _sign * get_classification_batch(np.abs(_percent_OC2), tf=timeframe_1,
+                                                                           ex_ch=expected_change)
+    return _classification_percent
+
 class bcolors:
     HEADER = '\033[95m'
     OKBLUE = '\033[94m'
@@ -118,6 +185,45 @@ def join_paths(paths):
         _folder = os.path.join(_folder, _path)
     return _folder
 
+def split_date_range(start, end, chunk_days):
+    """Function to split the date range [start, end] into consecutive non-overlapping chunks of chunk_days days"""
+    _start = datetime.date.fromisoformat(start[:10])
+    _end = datetime.date.fromisoformat(end[:10])
+    _chunks = []
+    while _start <= _end:
+        _chunk_end = min(_start + datetime.timedelta(days=chunk_days - 1), _end)
+        _chunks.append((_start.strftime("%Y-%m-%d"), _chunk_end.strftime("%Y-%m-%d")))
+        _start = _chunk_end + datetime.timedelta(days=1)
+    return _chunks
+
+def get_last_datetime_from_csv(filename):
+    """Function to get the datetime of the last candle in a CSV file without reading the whole file"""
+    if not os.path.exists(filename):
+        return None
+    with open(filename, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        _size = f.tell()
+        f.seek(max(0, _size - 1024))  # One row of candles is much shorter than 1 KB
+        _lines = f.read().decode('utf-8').strip().splitlines()
+    if not _lines:
+        return None
+    _last = _lines[-1].split(',')[0]
+    if _last == 'datetime':  # Only the header is present
+        return None
+    return datetime.datetime.fromisoformat(_last)
+
+def append_df_to_csv_atomically(df, filename, date_format=None):
+    """Function to append rows to a CSV file through a temporary copy, so an interrupted run never leaves a half-written file"""
+    if df.empty and os.path.exists(filename):
+        return  # Nothing to append, the file is not rewritten
+    _tmp_filename = filename + ".tmp"
+    if os.path.exists(filename):
+        shutil.copyfile(filename, _tmp_filename)
+        df.to_csv(_tmp_filename, mode='a', header=False, index=False, encoding='utf-8', sep=',', date_format=date_format)
+    else:
+        df.to_csv(_tmp_filename, index=False, encoding='utf-8', sep=',', date_format=date_format)
+    os.replace(_tmp_filename, filename)  # Atomic on both POSIX and Windows
+
 def create_some_folders(timeframes, classes=None):
     """Function to create necessary directories"""
     folder = 'NN_winner'
@@ -128,6 +234,10 @@ def create_some_folders(timeframes, classes=None):
     if not os.path.exists(folder): 
         os.makedirs(folder)
 
+    folder = 'store'
+    if not os.path.exists(folder): 
+        os.makedirs(folder)
+
     folder = 'NN'
     if not os.path.exists(folder): 
         os.makedirs(folder)
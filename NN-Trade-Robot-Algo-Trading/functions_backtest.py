@@ -0,0 +1,177 @@
+"""
+Vectorized backtest of the rule of the live strategy: buy 1 lot on class 1 when flat, sell at the first bar at least
+one timeframe_1 bar after the entry, no stop loss (see functions_strategy.OneBarHoldRule.trade).
+
+Arrays are (T, C): T bars, C columns - tickers, or tickers x parameter variants. Columns are independent, every
+column has its own timeline: series of different lengths are padded at the end (pad_series), padded bars are
+never traded. A column is evaluated with array operations only; trades follow each other (the next entry is the
+first signal after the exit), so the entries are found by jumping from trade to trade in all columns at once -
+the number of steps is the maximum number of trades of a column.
+
+Returns are per trade, relative to the entry price: (exit - entry) / entry - commission * (entry + exit) / entry.
+The equity curve is the cumulative sum of the returns of the closed trades (realized), the drawdown is measured
+on it. A position still open at the end of a column is closed at its last bar.
+"""
+
+import numpy as np
+import pandas as pd
+
+MAX_INT64 = np.iinfo(np.int64).max  # Padding of datetimes, see pad_series
+
+
+def pad_series(series, fill=np.nan, dtype=np.float64):
+    """Stack 1D series of different lengths into a (T, C) array padded at the end"""
+    _result = np.full((max((len(_values) for _values in series), default=0), len(series)), fill, dtype=dtype)
+    for _column, _values in enumerate(series):
+        _result[:len(_values), _column] = _values
+    return _result
+
+
+def get_exit_index(datetimes, lengths, hold):
+    """Bar of the exit for an entry at every bar: the first bar with datetime >= entry datetime + hold, at least the
+    next bar, at most the last bar of the column. datetimes - (T, C) int64 epoch in ns, hold - pd.Timedelta or ns"""
+    _hold = pd.Timedelta(hold).value
+    _exit = np.empty(datetimes.shape, dtype=np.int64)
+    _bars = np.arange(len(datetimes))
+    for _column, _length in enumerate(lengths):
+        _times = datetimes[:_length, _column]
+        _exit[:_length, _column] = np.searchsorted(_times, _times + _hold, side='left')
+        _exit[_length:, _column] = _length
+        _exit[:_length, _column] = np.clip(np.maximum(_exit[:_length, _column], _bars[:_length] + 1), 0, _length - 1)
+    return _exit
+
+
+def get_trades(signals, exit_index, lengths):
+    """Entries and exits of all trades of all columns.
+    signals - (T, C) bool, class 1 at the bar; exit_index - (T, C) from get_exit_index; lengths - (C,) bars per column.
+    Returns arrays of the trades sorted by column and entry: column, entry bar, exit bar"""
+    _t, _c = signals.shape
+    _lengths = np.asarray(lengths)
+    _valid = signals & (np.arange(_t)[:, None] < _lengths[None, :])
+    # First signal at or after every bar, _t if none
+    _next_signal = np.where(_valid, np.arange(_t)[:, None], _t)
+    _next_signal = np.minimum.accumulate(_next_signal[::-1], axis=0)[::-1]
+    _next_signal = np.vstack([_next_signal, np.full((1, _c), _t)])
+
+    _columns, _entries, _exits = [], [], []
+    _active = np.arange(_c)
+    _entry = _next_signal[0]
+    while True:
+        _mask = _entry < _t
+        _active, _entry = _active[_mask], _entry[_mask]
+        if not len(_active):
+            break
+        _exit = exit_index[_entry, _active]
+        _columns.append(_active)
+        _entries.append(_entry)
+        _exits.append(_exit)
+        _entry = _next_signal[np.minimum(_exit + 1, _t), _active]  # the next entry is after the exit bar
+
+    if not _columns:
+        return {"column": np.empty(0, np.int64), "entry": np.empty(0, np.int64), "exit": np.empty(0, np.int64)}
+    _columns, _entries, _exits = np.concatenate(_columns), np.concatenate(_entries), np.concatenate(_exits)
+    _order = np.lexsort((_entries, _columns))
+    return {"column": _columns[_order], "entry": _entries[_order], "exit": _exits[_order]}
+
+
+def get_trade_returns(trades, close, commission=0.0, open_=None, fill="close"):
+    """Entry/exit prices, commissions and returns of the trades.
+    fill - "close": at the close of the signal/exit bar, "next_open": at the open of the next bar"""
+    _columns, _entries, _exits = trades["column"], trades["entry"], trades["exit"]
+    _entry_price = close[_entries, _columns]
+    _exit_price = close[_exits, _columns]
+    if fill == "next_open" and open_ is not None:
+        _t = len(close)
+        _next_entry = open_[np.minimum(_entries + 1, _t - 1), _columns]
+        _next_exit = open_[np.minimum(_exits + 1, _t - 1), _columns]
+        _entry_price = np.where((_entries + 1 < _t) & ~np.isnan(_next_entry), _next_entry, _entry_price)
+        _exit_price = np.where((_exits + 1 < _t) & ~np.isnan(_next_exit), _next_exit, _exit_price)
+    _commission = commission * (_entry_price + _exit_price)
+    return {
+        "entry_price": _entry_price,
+        "exit_price": _exit_price,
+        "commission": _commission,
+        "return": (_exit_price - _entry_price - _commission) / _entry_price,
+    }
+
+
+def get_dense(trades, returns, shape):
+    """Per-bar arrays (T, C): position (1 from the entry bar up to the exit bar), realized return at the exit bar,
+    commission at the exit bar and the equity curve"""
+    _markers = np.zeros((shape[0] + 1, shape[1]), dtype=np.int64)
+    np.add.at(_markers, (trades["entry"], trades["column"]), 1)
+    np.add.at(_markers, (trades["exit"], trades["column"]), -1)
+    _realized = np.zeros(shape)
+    np.add.at(_realized, (trades["exit"], trades["column"]), returns["return"])
+    _commission = np.zeros(shape)
+    np.add.at(_commission, (trades["exit"], trades["column"]), returns["commission"])
+    return {
+        "position": np.cumsum(_markers, axis=0)[:-1].astype(np.int8),
+        "realized": _realized,
+        "realized_commission": _commission,
+        "equity": np.cumsum(_realized, axis=0),
+    }
+
+
+def get_stats(trades, returns, columns):
+    """Statistics of every column from its trades: number, win rate, total and mean return, commission,
+    maximum drawdown of the realized equity"""
+    _column, _return = trades["column"], returns["return"]
+    _trades = np.bincount(_column, minlength=columns)
+    _total = np.bincount(_column, weights=_return, minlength=columns)
+    _wins = np.bincount(_column, weights=_return > 0, minlength=columns)
+
+    # Equity of every column: cumulative sum of the returns within the column (trades are sorted by column)
+    _starts = np.concatenate([[0], np.cumsum(_trades)[:-1]])
+    _cumsum = np.cumsum(_return)
+    _equity = _cumsum - np.repeat(np.concatenate([[0], _cumsum])[_starts], _trades)
+    # Running maximum within columns: offset the columns so that a column never sees the maximum of the previous one
+    _offset = (np.ptp(_equity) + 1 if len(_equity) else 1) * _column
+    _peak = np.maximum(np.maximum.accumulate(_equity + _offset) - _offset, 0)
+    _max_drawdown = np.zeros(columns)
+    np.maximum.at(_max_drawdown, _column, _peak - _equity)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return {
+            "trades": _trades,
+            "win_rate": np.where(_trades > 0, _wins / _trades, 0.0),
+            "total_return": _total,
+            "mean_return": np.where(_trades > 0, _total / _trades, 0.0),
+            "commission": np.bincount(_column, weights=returns["commission"] / returns["entry_price"],
+                                      minlength=columns),
+            "max_drawdown": _max_drawdown,
+        }
+
+
+def backtest(signals, close, exit_index, lengths, commission=0.0, open_=None, fill="close", dense=False):
+    """Backtest of the signals (T, C) on the prices (T, C); returns the trades, their returns, the statistics of
+    every column and, with dense=True, per-bar positions, returns, commissions and equity"""
+    _trades = get_trades(signals, exit_index, lengths)
+    _returns = get_trade_returns(_trades, close, commission, open_, fill)
+    _result = {"trades": _trades, "returns": _returns, "stats": get_stats(_trades, _returns, signals.shape[1])}
+    if dense:
+        _result.update(get_dense(_trades, _returns, signals.shape))
+    return _result
+
+
+def sweep_thresholds(scores, thresholds, close, exit_index, lengths, commission=0.0, open_=None, fill="close",
+                     chunk=64):
+    """Statistics for every threshold of the class-1 score: signals are scores >= threshold.
+    scores, close, exit_index - (T, K) of K tickers; returns statistics as (V, K) arrays for V thresholds.
+    Thresholds are evaluated in chunks, each chunk as one (T, chunk * K) backtest"""
+    _t, _k = scores.shape
+    _thresholds = np.asarray(thresholds, dtype=np.float64)
+    _stats = {}
+    for _i0 in range(0, len(_thresholds), chunk):
+        _chunk = _thresholds[_i0:_i0 + chunk]
+        # Columns: threshold-major, ticker-minor
+        _signals = (scores[:, None, :] >= _chunk[None, :, None]).reshape(_t, -1)
+
+        def _tile(_values):
+            return None if _values is None else np.tile(_values, (1, len(_chunk)))
+
+        _result = backtest(_signals, _tile(close), _tile(exit_index), np.tile(lengths, len(_chunk)), commission,
+                           _tile(open_), fill)
+        for _name, _values in _result["stats"].items():
+            _stats.setdefault(_name, []).append(_values.reshape(len(_chunk), _k))
+    return {_name: np.concatenate(_values) for _name, _values in _stats.items()}
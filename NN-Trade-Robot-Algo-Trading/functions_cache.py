@@ -0,0 +1,210 @@
+"""
+Content-keyed cache of rendered inputs and indicators.
+
+The same chart is rendered by 2_prepare, 4_check, the backtests and the live strategy. The key of a cached value is
+a hash of its input data and parameters - for a chart image the close, fast SMA and slow SMA of the window plus
+draw_window and the version of the renderer - so the same window gives the same key in any script, whatever ticker,
+date or row it comes from.
+
+Every cache has two tiers:
+- memory - LRU with a size cap in bytes, per process
+- disk - optional folder with one .npy file per key, shared by all scripts and processes; the oldest files are
+  removed when the folder exceeds its size cap
+Hits, misses and evictions are counted, see LRUCache.stats.
+
+Only chart images are cached: normalized series ("series" input mode) are cheaper to compute than to hash.
+The default caches RENDER and SMA are configured by the cache_* settings of my_config/trade_config.py and are off
+by default: a cold cache is slower than rendering without it, so it is enabled only where windows repeat.
+"""
+
+import collections
+import hashlib
+import json
+import os
+import numpy as np
+
+from my_config.trade_config import Config  # Configuration file for the trading robot
+
+cur_run_folder = os.path.abspath(os.getcwd())  # Current directory
+
+
+def _get_hash(params):
+    """Hash object initialized with the parameters (JSON-serializable)"""
+    return hashlib.blake2b(json.dumps(params, sort_keys=True).encode('utf-8'), digest_size=16)
+
+
+def get_key(params, *arrays):
+    """Hash of the parameters and the content of the arrays"""
+    _hash = _get_hash(params)
+    for _values in arrays:
+        _values = np.ascontiguousarray(_values)
+        _hash.update(f"{_values.dtype.str}{_values.shape}".encode('utf-8'))
+        _hash.update(_values.data)
+    return _hash.hexdigest()
+
+
+class LRUCache:
+    """Cache of NumPy arrays: in-memory LRU tier of max_bytes plus an optional disk tier in folder of disk_max_bytes"""
+
+    def __init__(self, name, max_bytes, folder="", disk_max_bytes=0):
+        self.name = name
+        self.max_bytes = max_bytes
+        self.folder = folder
+        self.disk_max_bytes = disk_max_bytes
+        self.bytes = 0
+        self._values = collections.OrderedDict()  # key -> array, the most recently used last
+        self._disk_sizes = None  # key -> file size, read from the folder on the first write
+        self._disk_bytes = 0
+        self.counters = {"hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0, "disk_evictions": 0}
+
+    @property
+    def enabled(self):
+        return bool(self.max_bytes or self.folder)
+
+    def _get_filename(self, key):
+        return os.path.join(self.folder, key[:2], f"{key}.npy")
+
+    def _put_memory(self, key, value):
+        if value.nbytes > self.max_bytes:
+            return
+        if key in self._values:
+            self.bytes -= self._values.pop(key).nbytes
+        self._values[key] = value
+        self.bytes += value.nbytes
+        while self.bytes > self.max_bytes:
+            self.bytes -= self._values.popitem(last=False)[1].nbytes
+            self.counters["evictions"] += 1
+
+    def _put_disk(self, key, value):
+        _filename = self._get_filename(key)
+        os.makedirs(os.path.dirname(_filename), exist_ok=True)
+        _tmp = f"{_filename}.{os.getpid()}.tmp"  # Processes may write the same key at once
+        with open(_tmp, 'wb') as f:
+            np.save(f, value)
+        os.replace(_tmp, _filename)
+        if self.disk_max_bytes:
+            if self._disk_sizes is None:
+                self._disk_sizes = {_entry.name[:-len(".npy")]: _entry.stat().st_size
+                                    for _dir in os.scandir(self.folder) if _dir.is_dir()
+                                    for _entry in os.scandir(_dir.path) if _entry.name.endswith(".npy")}
+                self._disk_bytes = sum(self._disk_sizes.values())
+            self._disk_bytes += os.path.getsize(_filename) - self._disk_sizes.get(key, 0)
+            self._disk_sizes[key] = os.path.getsize(_filename)
+            if self._disk_bytes > self.disk_max_bytes:
+                self._evict_disk()
+
+    def _evict_disk(self):
+        """Remove the least recently used files (by modification time) down to 90% of the cap"""
+        _files = []
+        for _key in self._disk_sizes:
+            try:
+                _files.append((os.path.getmtime(self._get_filename(_key)), _key))
+            except OSError:
+                pass  # Removed by another process
+        for _, _key in sorted(_files):
+            if self._disk_bytes <= 0.9 * self.disk_max_bytes:
+                break
+            try:
+                os.remove(self._get_filename(_key))
+                self.counters["disk_evictions"] += 1
+            except OSError:
+                pass
+            self._disk_bytes -= self._disk_sizes.pop(_key)
+
+    def get(self, key):
+        """Cached array or None; a value found on disk is moved to the memory tier"""
+        if key in self._values:
+            self._values.move_to_end(key)
+            self.counters["hits"] += 1
+            return self._values[key]
+        if self.folder:
+            _filename = self._get_filename(key)
+            try:
+                _value = np.load(_filename)
+                os.utime(_filename)  # The file was used - evicted last
+            except (OSError, ValueError):
+                _value = None
+            if _value is not None:
+                self.counters["disk_hits"] += 1
+                _value.flags.writeable = False
+                self._put_memory(key, _value)
+                return _value
+        self.counters["misses"] += 1
+        return None
+
+    def put(self, key, value):
+        """Add a value to both tiers; the value is copied, so the cache never shares memory with the caller and
+        a cached row never keeps the whole array it came from alive"""
+        _value = np.array(value)
+        _value.flags.writeable = False
+        self._put_memory(key, _value)
+        if self.folder:
+            self._put_disk(key, _value)
+
+    def get_or_compute(self, key, compute):
+        """Cached value of the key, computed by compute() and added on a miss"""
+        _value = self.get(key)
+        if _value is None:
+            _value = compute()
+            self.put(key, _value)
+        return _value
+
+    def stats(self):
+        """Counters, hit rate and the size of the memory tier"""
+        _lookups = self.counters["hits"] + self.counters["disk_hits"] + self.counters["misses"]
+        return {**self.counters, "items": len(self._values), "bytes": self.bytes,
+                "hit_rate": (self.counters["hits"] + self.counters["disk_hits"]) / _lookups if _lookups else 0.0}
+
+    def clear(self, disk=False):
+        """Empty the memory tier and, with disk=True, remove the files of the disk tier"""
+        self._values.clear()
+        self.bytes = 0
+        if disk and self.folder and os.path.exists(self.folder):
+            for _dir in os.scandir(self.folder):
+                if _dir.is_dir():
+                    for _entry in os.scandir(_dir.path):
+                        os.remove(_entry.path)
+            self._disk_sizes, self._disk_bytes = {}, 0
+
+
+def get_rows(cache, params, arrays, compute):
+    """Values of N rows, e.g. N windows of the same length: row i is keyed by params and row i of every array,
+    compute(rows) is called once for the rows missing in the cache and returns their values. Returns the stacked
+    values of all rows"""
+    _arrays = [np.ascontiguousarray(_values, dtype=np.float64) for _values in arrays]
+    _n = len(_arrays[0])
+    if not cache.enabled or not _n:
+        return compute(np.arange(_n))
+    # The parameters and the shape of the rows are hashed once, then every row is added to a copy of the hash
+    _base = _get_hash({"params": params, "shapes": [_values.shape[1:] for _values in _arrays]})
+    _keys = []
+    for _i in range(_n):
+        _hash = _base.copy()
+        for _values in _arrays:
+            _hash.update(_values[_i].data)
+        _keys.append(_hash.hexdigest())
+    _values = [cache.get(_key) for _key in _keys]
+    _missing = [_i for _i, _value in enumerate(_values) if _value is None]
+    if not _missing:
+        return np.stack(_values)
+    _computed = compute(np.array(_missing))
+    for _i, _value in zip(_missing, _computed):
+        cache.put(_keys[_i], _value)
+        _values[_i] = _value
+    return _computed if len(_missing) == _n else np.stack(_values)
+
+
+def format_stats(*caches):
+    """One line with the counters of every cache"""
+    return "; ".join(f"{_cache.name} cache: {_stats['hits']} hits, {_stats['disk_hits']} disk hits, "
+                     f"{_stats['misses']} misses ({_stats['hit_rate']:.0%}), {_stats['items']} items, "
+                     f"{_stats['bytes'] / 2 ** 20:.0f} MB" for _cache in caches for _stats in [_cache.stats()])
+
+
+def _get_folder(name):
+    return os.path.join(cur_run_folder, Config.cache_folder, name) if Config.cache_folder else ""
+
+
+# Default caches of the rendered chart images and of the SMA of the candles
+RENDER = LRUCache("render", Config.cache_render_mb * 2 ** 20, _get_folder("render"), Config.cache_disk_mb * 2 ** 20)
+SMA = LRUCache("sma", Config.cache_sma_mb * 2 ** 20, _get_folder("sma"), Config.cache_disk_mb * 2 ** 20)
@@ -0,0 +1,251 @@
+"""
+Sharded storage of the training dataset.
+
+Instead of one PNG per sample, samples are written into fixed-size shards in the folder
+`NN/training_dataset_{timeframe}_shards`, each shard is a set of .npy files with a common prefix:
+- {prefix}_images.npy - (n, draw_size, draw_size, 3) uint8 images,
+  or (n, draw_window, 3) float32 normalized series in the "series" input mode
+- {prefix}_tickers.npy - (n,) ticker
+- {prefix}_datetimes.npy - (n,) int64 epoch in nanoseconds of the sample date (of the last bar of its window)
+- {prefix}_label_datetimes.npy - (n,) int64 epoch in nanoseconds of the timeframe_1 bar giving the class
+- {prefix}_labels.npy - (n,) int64 class
+Shards are read with memory-mapping, so only the used part of the images is loaded.
+
+Generation is split into work units - one shard of one ticker, {ticker}_{unit:05d} - which are rendered
+by a pool of processes from candle/SMA arrays placed in shared memory. The units depend only on the
+shard size, so the output is the same for any number of workers.
+
+`{ticker}_manifest.json` records the generation parameters and the samples already generated for the ticker,
+so a rerun renders only the new windows and starts from scratch, removing the old shards and PNG files,
+when a parameter changes.
+"""
+
+import functions_nn
+import hashlib
+import json
+import os
+import numpy as np
+import pandas as pd
+from multiprocessing import shared_memory
+from PIL import Image
+
+cur_run_folder = os.path.abspath(os.getcwd())  # Current directory
+
+ARRAYS = ("images", "tickers", "datetimes", "label_datetimes", "labels")
+
+
+def get_shards_folder(timeframe, input_mode="image"):
+    """Folder with the shards of the dataset for timeframe and input mode ("image" or "series")"""
+    if input_mode == "series":
+        return os.path.join(cur_run_folder, "NN", f"training_dataset_{timeframe}_series_shards")
+    return os.path.join(cur_run_folder, "NN", f"training_dataset_{timeframe}_shards")
+
+
+def save_shard(folder, prefix, arrays):
+    """Save one shard; every file is written to a temporary name first, so a shard is either complete or absent"""
+    os.makedirs(folder, exist_ok=True)
+    for _name in ARRAYS:
+        _filename = os.path.join(folder, f"{prefix}_{_name}.npy")
+        with open(_filename + ".tmp", 'wb') as f:
+            np.save(f, arrays[_name])
+        os.replace(_filename + ".tmp", _filename)
+
+
+def list_shards(folder):
+    """Sorted prefixes of all complete shards in the folder"""
+    if not os.path.exists(folder):
+        return []
+    _suffix = f"_{ARRAYS[-1]}.npy"  # Written last
+    return sorted(_filename[:-len(_suffix)] for _filename in os.listdir(folder) if _filename.endswith(_suffix))
+
+
+def remove_shards(folder, prefix):
+    """Remove all shards whose names start with prefix, e.g. the previous shards of a ticker"""
+    for _shard in list_shards(folder):
+        if _shard.startswith(prefix):
+            for _name in ARRAYS:
+                _filename = os.path.join(folder, f"{_shard}_{_name}.npy")
+                if os.path.exists(_filename):  # Shards of older versions may lack some arrays
+                    os.remove(_filename)
+
+
+def remove_pngs(folder, prefix):
+    """Remove the PNG files whose names start with prefix from the class folders, e.g. the previous PNGs of a ticker"""
+    if not os.path.exists(folder):
+        return
+    for _class in os.scandir(folder):
+        if _class.is_dir():
+            for _entry in os.scandir(_class.path):
+                if _entry.name.startswith(prefix) and _entry.name.endswith(".png"):
+                    os.remove(_entry.path)
+
+
+def remove_other_tickers(folder, png_folder, tickers):
+    """Remove the shards, the manifests and the PNG files of the tickers not in tickers, e.g. removed from the
+    portfolio, so they are not mixed into the training data"""
+    _tickers = {_shard.rsplit("_", 1)[0] for _shard in list_shards(folder)}
+    if os.path.exists(folder):
+        _tickers |= {_name[:-len("_manifest.json")] for _name in os.listdir(folder) if _name.endswith("_manifest.json")}
+    if os.path.exists(png_folder):
+        _tickers |= {_entry.name.split("-", 1)[0] for _class in os.scandir(png_folder) if _class.is_dir()
+                     for _entry in os.scandir(_class.path) if _entry.name.endswith(".png")}
+    for ticker in _tickers - set(tickers):
+        remove_manifest(folder, ticker)
+        remove_shards(folder, f"{ticker}_")
+        remove_pngs(png_folder, f"{ticker}-")
+
+
+def load_shard(folder, prefix, mmap=True):
+    """Load the arrays of one shard, by default memory-mapped"""
+    return {_name: np.load(os.path.join(folder, f"{prefix}_{_name}.npy"), mmap_mode='r' if mmap else None)
+            for _name in ARRAYS}
+
+
+def load_index(folder):
+    """Labels, tickers, datetimes and label datetimes of all samples in the folder plus (prefix, row) of every sample"""
+    _index = {"labels": [], "tickers": [], "datetimes": [], "label_datetimes": [], "shards": [], "rows": []}
+    for _i, _prefix in enumerate(list_shards(folder)):
+        _shard = load_shard(folder, _prefix)
+        for _name in ("labels", "tickers", "datetimes", "label_datetimes"):
+            _index[_name].append(np.asarray(_shard[_name]))
+        _index["shards"].append(np.full(len(_shard["labels"]), _i))
+        _index["rows"].append(np.arange(len(_shard["labels"])))
+    _index = {_name: np.concatenate(_values) if _values else np.empty(0) for _name, _values in _index.items()}
+    _index["prefixes"] = list_shards(folder)
+    return _index
+
+
+def get_time_split(datetimes, label_datetimes, validation_split):
+    """Numbers of the training and the validation samples: the samples of all tickers from the datetime of the last
+    validation_split of the samples (ordered by the datetime of the last bar of the window) are for validation.
+    Earlier samples are for training unless their class is given by a timeframe_1 bar of the validation period"""
+    _num_val = int(validation_split * len(datetimes))
+    if not _num_val:
+        return np.arange(len(datetimes)), np.empty(0, dtype=np.int64)
+    _split = np.sort(datetimes)[len(datetimes) - _num_val]  # Samples of the same datetime are in one subset
+    return np.flatnonzero(label_datetimes < _split), np.flatnonzero(datetimes >= _split)
+
+
+def share_arrays(arrays):
+    """Copy arrays into shared memory; returns the memory blocks (keep them alive) and their spec for workers"""
+    _blocks, _spec = [], {}
+    for _name, _values in arrays.items():
+        _values = np.ascontiguousarray(_values)
+        _block = shared_memory.SharedMemory(create=True, size=max(_values.nbytes, 1))
+        np.ndarray(_values.shape, dtype=_values.dtype, buffer=_block.buf)[:] = _values
+        _blocks.append(_block)
+        _spec[_name] = (_block.name, _values.shape, _values.dtype.str)
+    return _blocks, _spec
+
+
+def attach_arrays(spec):
+    """Attach to arrays placed in shared memory by share_arrays, without copying them"""
+    _blocks, _arrays = [], {}
+    for _name, (_block_name, _shape, _dtype) in spec.items():
+        _block = shared_memory.SharedMemory(name=_block_name)
+        _blocks.append(_block)
+        _arrays[_name] = np.ndarray(_shape, dtype=_dtype, buffer=_block.buf)
+    return _blocks, _arrays
+
+
+def release_arrays(blocks, unlink=False):
+    """Close the shared memory blocks; the owner also unlinks them"""
+    for _block in blocks:
+        _block.close()
+        if unlink:
+            _block.unlink()
+
+
+def get_units(ticker, samples, shard_size, arrays_spec, first_sample=0):
+    """Split the samples of a ticker into work units, one unit per shard.
+    With first_sample only the units from the shard containing it are returned"""
+    return [{"ticker": ticker, "unit": _unit, "start": _unit * shard_size,
+             "stop": min((_unit + 1) * shard_size, samples), "arrays": arrays_spec}
+            for _unit in range(first_sample // shard_size, (samples + shard_size - 1) // shard_size)]
+
+
+def get_params_hash(params):
+    """Hash of the parameters that define the samples; a change of any of them invalidates the manifest"""
+    return hashlib.sha1(json.dumps(params, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def load_manifest(folder, ticker):
+    """Manifest of the samples already generated for the ticker, None if there is none"""
+    _filename = os.path.join(folder, f"{ticker}_manifest.json")
+    if not os.path.exists(_filename):
+        return None
+    with open(_filename, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_manifest(folder, ticker, params, datetimes):
+    """Record the parameters and the samples generated for the ticker - the last step of a successful run"""
+    os.makedirs(folder, exist_ok=True)
+    _manifest = {
+        "params": params,
+        "params_hash": get_params_hash(params),
+        "samples": len(datetimes),
+        "last_datetime": int(datetimes[-1]) if len(datetimes) else None,
+    }
+    _filename = os.path.join(folder, f"{ticker}_manifest.json")
+    with open(_filename + ".tmp", 'w', encoding='utf-8') as f:
+        json.dump(_manifest, f, indent=4)
+    os.replace(_filename + ".tmp", _filename)
+
+
+def remove_manifest(folder, ticker):
+    """Remove the manifest, e.g. before the samples of the ticker are regenerated from scratch"""
+    _filename = os.path.join(folder, f"{ticker}_manifest.json")
+    if os.path.exists(_filename):
+        os.remove(_filename)
+
+
+def get_generated_samples(folder, ticker, params, datetimes):
+    """Number of samples (out of datetimes, int64) that are already generated with the same parameters.
+    0 if there is no manifest, the parameters changed or the history does not match the generated samples"""
+    _manifest = load_manifest(folder, ticker)
+    if _manifest is None or _manifest["params_hash"] != get_params_hash(params):
+        return 0
+    _samples = _manifest["samples"]
+    if _samples > len(datetimes) or (_samples and int(datetimes[_samples - 1]) != _manifest["last_datetime"]):
+        return 0
+    return _samples
+
+
+def _render_unit(unit, arrays, params):
+    """Render the samples [start, stop) of the unit and save them as a shard and/or PNG files"""
+    _start, _stop, ticker = unit["start"], unit["stop"], unit["ticker"]
+    draw_window, render_batch = params["draw_window"], params["render_batch"]
+    _images = []
+    for _i0 in range(_start, _stop, render_batch):
+        _windows = arrays["ends"][_i0:min(_i0 + render_batch, _stop), None] + np.arange(-draw_window, 0)
+        _images.append(functions_nn.generate_input_batch(arrays["sma_fast"][_windows], arrays["sma_slow"][_windows],
+                                                         arrays["close"][_windows], draw_window, params["input_mode"]))
+    _shard = {
+        "images": np.concatenate(_images),
+        "labels": arrays["labels"][_start:_stop].copy(),
+        "tickers": np.full(_stop - _start, ticker),
+        "label_datetimes": arrays["label_datetimes"][_start:_stop].copy(),
+        "datetimes": arrays["datetimes"][_start:_stop].copy(),
+    }
+
+    if params["dataset_format"] == "shards":
+        save_shard(params["shards_folder"], f"{ticker}_{unit['unit']:05d}", _shard)
+
+    if params["export_png"] and params["input_mode"] == "image":
+        for img, _date, _label in zip(_shard["images"], _shard["datetimes"], _shard["labels"]):
+            _date_str = pd.Timestamp(_date).strftime("%Y_%m_%d_%H_%M_%S")
+            _filename = f"{ticker}-{params['timeframe_0']}-{_date_str}.png"
+            _path = os.path.join(params["png_folder"], str(_label))
+            Image.fromarray(img).save(os.path.join(_path, _filename))
+    return _stop - _start
+
+
+def render_unit(unit, params):
+    """Work unit of the dataset generation, runs in a worker process"""
+    _blocks, _arrays = attach_arrays(unit["arrays"])
+    try:
+        return unit["ticker"], _render_unit(unit, _arrays, params)
+    finally:
+        del _arrays  # Views must be released before the blocks are closed
+        release_arrays(_blocks)
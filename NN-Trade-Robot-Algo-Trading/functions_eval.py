@@ -0,0 +1,89 @@
+"""
+Metrics of the neural network predictions, computed with NumPy over the whole evaluated dataset.
+
+The live strategy opens a position when the class-1 logit is >= 0, so the score of a sample is its class-1 logit
+and the class-1 threshold is applied to it.
+
+Per-sample predictions are saved as one compressed .npz file with the arrays:
+- tickers - (n,) ticker
+- datetimes - (n,) int64 epoch in nanoseconds of the sample date
+- labels - (n,) int8 true class
+- logits - (n, num_classes) float32 output of the model
+"""
+
+import os
+import numpy as np
+
+PREDICTIONS = ("tickers", "datetimes", "labels", "logits")
+
+
+def softmax(logits):
+    """Probabilities of the classes from the logits"""
+    _exp = np.exp(logits - logits.max(axis=1, keepdims=True))
+    return _exp / _exp.sum(axis=1, keepdims=True)
+
+
+def confusion_matrix(labels, predicted, num_classes=2):
+    """Confusion matrix: rows - true class, columns - predicted class"""
+    return np.bincount(labels * num_classes + predicted, minlength=num_classes * num_classes).reshape(num_classes, -1)
+
+
+def precision_recall(matrix):
+    """Precision, recall and F1 of every class from the confusion matrix"""
+    _tp = np.diag(matrix).astype(np.float64)
+    _precision = np.divide(_tp, matrix.sum(axis=0), out=np.zeros_like(_tp), where=matrix.sum(axis=0) > 0)
+    _recall = np.divide(_tp, matrix.sum(axis=1), out=np.zeros_like(_tp), where=matrix.sum(axis=1) > 0)
+    _sum = _precision + _recall
+    _f1 = np.divide(2 * _precision * _recall, _sum, out=np.zeros_like(_tp), where=_sum > 0)
+    return _precision, _recall, _f1
+
+
+def threshold_curve(labels, scores, thresholds):
+    """Precision, recall, F1 of class 1 and the share of class-1 signals for every threshold (score >= threshold),
+    all thresholds at once via sorting"""
+    _order = np.argsort(-scores, kind="stable")
+    _sorted, _positives = scores[_order], np.cumsum(labels[_order] == 1)
+    _signals = np.searchsorted(-_sorted, -np.asarray(thresholds, dtype=np.float64), side='right')  # score >= thr
+    _tp = np.where(_signals > 0, _positives[np.maximum(_signals - 1, 0)], 0).astype(np.float64)
+    _precision = np.divide(_tp, _signals, out=np.zeros_like(_tp), where=_signals > 0)
+    _recall = _tp / max(int(_positives[-1]) if len(_positives) else 0, 1)
+    _sum = _precision + _recall
+    _f1 = np.divide(2 * _precision * _recall, _sum, out=np.zeros_like(_tp), where=_sum > 0)
+    return {"threshold": np.asarray(thresholds, dtype=np.float64), "precision": _precision, "recall": _recall,
+            "f1": _f1, "signals": _signals / max(len(scores), 1)}
+
+
+def calibrate_threshold(labels, scores, candidates=101):
+    """Curve over quantiles of the scores plus the threshold with the best F1 of class 1"""
+    _thresholds = np.unique(np.quantile(scores, np.linspace(0, 1, candidates))) if len(scores) else np.zeros(1)
+    _curve = threshold_curve(labels, scores, _thresholds)
+    return _curve, float(_curve["threshold"][np.argmax(_curve["f1"])])
+
+
+def reliability(labels, probabilities, bins=10):
+    """Mean predicted probability of class 1 vs observed share of class 1 in equal-width bins plus the expected
+    calibration error (ECE)"""
+    _bin = np.minimum((probabilities * bins).astype(np.int64), bins - 1)
+    _count = np.bincount(_bin, minlength=bins)
+    _predicted = np.bincount(_bin, weights=probabilities, minlength=bins)
+    _observed = np.bincount(_bin, weights=(labels == 1).astype(np.float64), minlength=bins)
+    _nonzero = _count > 0
+    _predicted[_nonzero] /= _count[_nonzero]
+    _observed[_nonzero] /= _count[_nonzero]
+    _ece = float(np.sum(_count * np.abs(_predicted - _observed)) / max(len(labels), 1))
+    return {"count": _count, "predicted": _predicted, "observed": _observed}, _ece
+
+
+def save_predictions(filename, tickers, datetimes, labels, logits):
+    """Save the per-sample predictions into a compressed .npz file"""
+    os.makedirs(os.path.dirname(filename) or ".", exist_ok=True)
+    with open(filename + ".tmp", 'wb') as f:
+        np.savez_compressed(f, tickers=np.asarray(tickers).astype(str), datetimes=np.asarray(datetimes, np.int64),
+                            labels=np.asarray(labels, np.int8), logits=np.asarray(logits, np.float32))
+    os.replace(filename + ".tmp", filename)
+
+
+def load_predictions(filename):
+    """Load the per-sample predictions saved by save_predictions"""
+    with np.load(filename) as _data:
+        return {_name: _data[_name] for _name in PREDICTIONS}
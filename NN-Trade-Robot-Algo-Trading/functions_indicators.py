@@ -0,0 +1,142 @@
+"""
+Streaming indicators shared by the dataset preparation and the live strategy.
+
+Every indicator is updated with one bar at a time in O(1) - update(value) returns the current value (NaN until
+enough bars) - and has a batch mode for whole arrays: batch(values) returns the same values as calling update for
+every element, so offline features and live features are identical by construction.
+The state of an indicator can be checkpointed with get_state() and restored with set_state().
+
+SMA keeps a running sum of prices in fixed point (int64 of price * scale), so the sum is exact: the value of a bar
+depends only on the last `period` prices, not on where the computation started - the live strategy, which starts
+from a few days of bars, gets the same SMA as the dataset computed over the whole history.
+
+New indicators are registered in INDICATORS and created from specs like {"type": "sma", "period": 16}.
+"""
+
+import json
+import os
+import numpy as np
+
+SCALE = 10 ** 8  # Fixed-point scale of the prices in SMA, exact for prices with up to 8 decimals
+
+
+class SMA:
+    """Simple moving average"""
+
+    def __init__(self, period, scale=SCALE):
+        self.period = period
+        self.scale = scale
+        self._values = np.zeros(period, dtype=np.int64)  # last prices in fixed point, a ring
+        self._sum = 0
+        self._count = 0  # number of bars seen
+
+    def update(self, value):
+        """Add one bar; returns the SMA at this bar"""
+        _value = int(np.rint(value * self.scale))
+        _i = self._count % self.period
+        self._sum += _value - int(self._values[_i])
+        self._values[_i] = _value
+        self._count += 1
+        return self._sum / (self.period * self.scale) if self._count >= self.period else np.nan
+
+    def batch(self, values):
+        """SMA at every bar of the values, continuing from the current state - vectorized"""
+        _values = np.rint(np.asarray(values, dtype=np.float64) * self.scale).astype(np.int64)
+        _n, _m = len(_values), min(self._count, self.period)
+        # The previous bars of the window followed by the new ones, exact sums of every window via cumsum
+        _history = np.concatenate([self._values[np.arange(self._count - _m, self._count) % self.period], _values])
+        _cumsum = np.concatenate([[0], np.cumsum(_history)])
+        _ends = np.arange(_m + 1, _m + _n + 1)
+        _result = (_cumsum[_ends] - _cumsum[np.maximum(_ends - self.period, 0)]) / (self.period * self.scale)
+        _result[self._count + np.arange(1, _n + 1) < self.period] = np.nan
+
+        # The state after the last bar
+        self._count += _n
+        _m = min(self._count, self.period)
+        self._values[np.arange(self._count - _m, self._count) % self.period] = _history[len(_history) - _m:]
+        self._sum = int(_history[len(_history) - _m:].sum())
+        return _result
+
+    def get_state(self):
+        return {"type": "sma", "period": self.period, "scale": self.scale, "values": self._values.tolist(),
+                "sum": self._sum, "count": self._count}
+
+    def set_state(self, state):
+        self._values = np.asarray(state["values"], dtype=np.int64)
+        self._sum, self._count = state["sum"], state["count"]
+
+
+class EMA:
+    """Exponential moving average with alpha = 2 / (period + 1), seeded with the first bar
+    (as pandas ewm(span=period, adjust=False)); unlike SMA its value depends on the whole history"""
+
+    def __init__(self, period):
+        self.period = period
+        self.alpha = 2 / (period + 1)
+        self._value = np.nan
+        self._count = 0
+
+    def update(self, value):
+        """Add one bar; returns the EMA at this bar"""
+        self._value = value if self._count == 0 else self._value + self.alpha * (value - self._value)
+        self._count += 1
+        return self._value if self._count >= self.period else np.nan
+
+    def batch(self, values):
+        """EMA at every bar of the values - the recurrence is sequential, so it runs update for every bar"""
+        return np.array([self.update(_value) for _value in np.asarray(values, dtype=np.float64)], dtype=np.float64)
+
+    def get_state(self):
+        return {"type": "ema", "period": self.period, "value": self._value, "count": self._count}
+
+    def set_state(self, state):
+        self._value, self._count = state["value"], state["count"]
+
+
+INDICATORS = {"sma": SMA, "ema": EMA}
+
+
+def make_indicator(spec):
+    """Create an indicator from a spec like {"type": "sma", "period": 16}"""
+    _spec = dict(spec)
+    return INDICATORS[_spec.pop("type")](**_spec)
+
+
+class IndicatorSet:
+    """Named indicators updated with the same bars, e.g. {"sma_fast": {"type": "sma", "period": 16}}"""
+
+    def __init__(self, specs):
+        self.specs = specs
+        self.indicators = {_name: make_indicator(_spec) for _name, _spec in specs.items()}
+
+    def update(self, value):
+        """Add one bar; returns the values of all indicators at this bar"""
+        return {_name: _indicator.update(value) for _name, _indicator in self.indicators.items()}
+
+    def batch(self, values):
+        """Values of all indicators at every bar"""
+        return {_name: _indicator.batch(values) for _name, _indicator in self.indicators.items()}
+
+    def get_state(self):
+        return {_name: _indicator.get_state() for _name, _indicator in self.indicators.items()}
+
+    def set_state(self, state):
+        for _name, _indicator in self.indicators.items():
+            _indicator.set_state(state[_name])
+
+    def save_state(self, filename):
+        """Checkpoint the state of all indicators into a JSON file"""
+        with open(filename + ".tmp", 'w', encoding='utf-8') as f:
+            json.dump(self.get_state(), f)
+        os.replace(filename + ".tmp", filename)
+
+    def load_state(self, filename):
+        """Restore the state saved by save_state"""
+        with open(filename, 'r', encoding='utf-8') as f:
+            self.set_state(json.load(f))
+
+
+def get_sma_specs(period_sma_fast, period_sma_slow):
+    """Specs of the fast and slow SMA used for the images"""
+    return {"sma_fast": {"type": "sma", "period": period_sma_fast},
+            "sma_slow": {"type": "sma", "period": period_sma_slow}}
@@ -0,0 +1,157 @@
+"""
+Data structures of the live strategy.
+
+CandleRingBuffer keeps the last bars of one ticker in NumPy arrays with the dtypes of the candle store
+(see functions_store.COLUMNS). The buffer holds capacity + slack rows: new bars are written after the last one,
+and when the end of the arrays is reached the last capacity - 1 bars are moved to the beginning. So the last
+bars are always contiguous, views of them are returned without copying and one append costs O(1) amortized.
+Bars come from MOEX in time order, so a bar is new if its timestamp is greater than the last one.
+Features computed per bar (e.g. SMA of functions_indicators) are kept in extra float64 columns next to the candles.
+
+InferenceService is one coroutine shared by the strategies of all tickers: requests arriving within a short window
+are stacked into one batch and run through the model in a single forward pass (in a worker thread, so the event
+loop keeps polling), then every strategy gets its own row of the logits.
+"""
+
+import asyncio
+import logging
+import time
+import numpy as np
+import pandas as pd
+
+from functions_store import COLUMNS
+
+logger = logging.getLogger(__name__)
+
+CANDLE_COLUMNS = tuple(COLUMNS)  # datetime, open, high, low, close, volume - the order of a candle row
+
+
+class CandleRingBuffer:
+    """Fixed-capacity buffer of the last OHLCV bars keyed by timestamp"""
+
+    def __init__(self, capacity, slack=None, features=()):
+        self.capacity = capacity
+        self.size = capacity + (capacity if slack is None else max(slack, 1))
+        self.columns = {_column: np.zeros(self.size, dtype=_dtype) for _column, _dtype in COLUMNS.items()}
+        self.columns.update({_feature: np.full(self.size, np.nan) for _feature in features})
+        self._start = 0  # first kept bar
+        self._end = 0  # next free row
+
+    def __len__(self):
+        return self._end - self._start
+
+    @property
+    def last_datetime(self):
+        """Epoch in nanoseconds of the last bar, None if the buffer is empty"""
+        return int(self.columns["datetime"][self._end - 1]) if len(self) else None
+
+    def append(self, candle):
+        """Add a candle row [datetime, open, high, low, close, volume]; returns True if it is a new bar.
+        A bar with the timestamp of the last one replaces it, older bars are ignored"""
+        _datetime = pd.Timestamp(candle[0]).value
+        _last = self.last_datetime
+        if _last is not None and _datetime < _last:
+            return False
+        _new = _last is None or _datetime > _last
+        if not _new:
+            _row = self._end - 1  # the same bar again - keep its latest values
+        else:
+            if self._end == self.size:
+                self._compact()
+            _row = self._end
+            self._end += 1
+            if len(self) > self.capacity:
+                self._start += 1
+        for _column, _value in zip(CANDLE_COLUMNS, candle):
+            self.columns[_column][_row] = _datetime if _column == "datetime" else _value
+        return _new
+
+    def set_last(self, features):
+        """Set the features of the last bar, e.g. {"sma_fast": 1.23}"""
+        for _feature, _value in features.items():
+            self.columns[_feature][self._end - 1] = _value
+
+    def _compact(self):
+        """Move the last capacity - 1 bars to the beginning of the arrays to free the space after them"""
+        _keep = min(len(self), self.capacity - 1)
+        for _values in self.columns.values():
+            _values[:_keep] = _values[self._end - _keep:self._end]
+        self._start, self._end = 0, _keep
+
+    def window(self, n=None):
+        """Views (no copy) of the last n bars, by default of all kept bars.
+        The views are valid until the next append"""
+        _n = len(self) if n is None else min(n, len(self))
+        return {_column: _values[self._end - _n:self._end] for _column, _values in self.columns.items()}
+
+
+class InferenceService:
+    """Micro-batched inference of the model for the strategies of all tickers"""
+
+    def __init__(self, predict_batch, max_batch=64, batch_window=0.005):
+        self.predict_batch = predict_batch  # function (n, ...) float32 inputs -> (n, num_classes) logits
+        self.max_batch = max_batch  # maximum number of requests in one forward pass
+        self.batch_window = batch_window  # seconds to wait for more requests after the first one
+        self.queue = None
+        self.stats = {"requests": 0, "batches": 0, "max_queue_depth": 0, "last_batch_ms": 0.0, "total_ms": 0.0}
+        self._task = None
+
+    def start(self):
+        """Start the batching coroutine in the running event loop"""
+        self.queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._run())
+        return self
+
+    async def stop(self):
+        """Stop the batching coroutine"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def predict(self, inputs):
+        """Logits for one input - the request waits for the next batch"""
+        _future = asyncio.get_running_loop().create_future()
+        await self.queue.put((inputs, _future))
+        return await _future
+
+    async def _collect(self):
+        """The first waiting request and all requests arriving within batch_window after it, up to max_batch"""
+        _requests = [await self.queue.get()]
+        _deadline = time.perf_counter() + self.batch_window
+        while len(_requests) < self.max_batch:
+            _timeout = _deadline - time.perf_counter()
+            if _timeout <= 0:
+                break
+            try:
+                _requests.append(await asyncio.wait_for(self.queue.get(), _timeout))
+            except asyncio.TimeoutError:
+                break
+        return _requests
+
+    async def _run(self):
+        while True:
+            _requests = await self._collect()
+            _depth = len(_requests) + self.queue.qsize()  # requests waiting when the batch was formed
+            _start = time.perf_counter()
+            try:
+                _logits = await asyncio.to_thread(self.predict_batch, np.stack([_inputs for _inputs, _ in _requests]))
+            except Exception as e:
+                for _, _future in _requests:
+                    if not _future.done():
+                        _future.set_exception(e)
+                continue
+            _elapsed = (time.perf_counter() - _start) * 1000
+            for _i, (_, _future) in enumerate(_requests):
+                if not _future.done():
+                    _future.set_result(np.asarray(_logits[_i]))
+
+            self.stats["requests"] += len(_requests)
+            self.stats["batches"] += 1
+            self.stats["max_queue_depth"] = max(self.stats["max_queue_depth"], _depth)
+            self.stats["last_batch_ms"] = _elapsed
+            self.stats["total_ms"] += _elapsed
+            logger.debug("Inference batch: %d requests, queue depth %d, %.1f ms", len(_requests), _depth, _elapsed)
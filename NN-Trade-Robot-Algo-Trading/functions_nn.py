@@ -1,34 +1,182 @@
 import os
+import functions_cache
+import functions_indicators
+import functions_store
+import numpy as np
 import pandas as pd
 from PIL import Image, ImageDraw
 
 cur_run_folder = os.path.abspath(os.getcwd())  # Current directory
 
-def get_df_tf0(ticker, timeframe_0, period_sma_fast, period_sma_slow):
-    """Read data for training the neural network - input - timeframe_0"""
-    _filename = os.path.join(os.path.join(cur_run_folder, "csv"), f"{ticker}_{timeframe_0}.csv")
+MODEL_NAMES = {"image": "cnn_Open", "series": "cnn1d_Open"}  # Names of the model files for the input modes
+
+def _read_df(ticker, timeframe, start=None, end=None, warmup=0):
+    """Read candles from the binary store if present, otherwise parse csv/{ticker}_{timeframe}.csv"""
+    if functions_store.store_exists(ticker, timeframe):
+        return functions_store.load_candles_df(ticker, timeframe, start=start, end=end, warmup=warmup)
+    _filename = os.path.join(os.path.join(cur_run_folder, "csv"), f"{ticker}_{timeframe}.csv")
     df = pd.read_csv(_filename, sep=',')  # , index_col='datetime')
-    if timeframe_0 in ["M1", "M10", "H1"]:
+    if timeframe in ["M1", "M10", "H1"]:
         df['datetime'] = pd.to_datetime(df['datetime'], format='%Y-%m-%d %H:%M:%S')
     else:
         df['datetime'] = pd.to_datetime(df['datetime'], format='%Y-%m-%d')
-    df['sma_fast'] = df['close'].rolling(period_sma_fast).mean()  # Create fast SMA
-    df['sma_slow'] = df['close'].rolling(period_sma_slow).mean()  # Create slow SMA
-    df.dropna(inplace=True)  # Remove all NULL values
-    return df.copy()
+    if start is not None:
+        _i0 = max(0, int(df['datetime'].searchsorted(pd.Timestamp(start))) - warmup)
+        df = df.iloc[_i0:]
+    if end is not None:
+        df = df[df['datetime'] <= pd.Timestamp(end)]
+    return df.reset_index(drop=True)
+
+def get_df_tf0(ticker, timeframe_0, period_sma_fast, period_sma_slow, start=None, end=None):
+    """Read data for training the neural network - input - timeframe_0"""
+    # Extra candles before start are needed to compute the SMA from the first bar of the range
+    df = _read_df(ticker, timeframe_0, start=start, end=end, warmup=max(period_sma_fast, period_sma_slow) - 1)
+    # Fast and slow SMA - the same streaming indicators as in the live strategy, in batch mode
+    # Cached by the content of the close series, the same candles are read by most scripts
+    _specs = functions_indicators.get_sma_specs(period_sma_fast, period_sma_slow)
+    _close = df['close'].to_numpy(dtype=np.float64)
+    _sma = functions_cache.SMA.get_or_compute(
+        functions_cache.get_key(_specs, _close),
+        lambda: np.stack(list(functions_indicators.IndicatorSet(_specs).batch(_close).values())))
+    for _name, _values in zip(_specs, _sma):
+        df[_name] = _values.copy()
+    return df.iloc[max(period_sma_fast, period_sma_slow) - 1:]  # Remove the first NULL values of the SMA
 
-def get_df_t1(ticker, timeframe_1):
+def get_df_t1(ticker, timeframe_1, start=None, end=None):
     """Read data for training the neural network - output - timeframe_1"""
-    _filename = os.path.join(os.path.join(cur_run_folder, "csv"), f"{ticker}_{timeframe_1}.csv")
-    df = pd.read_csv(_filename, sep=',')  # , index_col='datetime')
-    if timeframe_1 in ["M1", "M10", "H1"]:
-        df['datetime'] = pd.to_datetime(df['datetime'], format='%Y-%m-%d %H:%M:%S')
-    else:
-        df['datetime'] = pd.to_datetime(df['datetime'], format='%Y-%m-%d')
-    return df.copy()
+    return _read_df(ticker, timeframe_1, start=start, end=end)
+
+def get_windows_and_labels(df_in, df_out, draw_window, steps_skip):
+    """Align timeframe_0 with timeframe_1 in one vectorized pass.
+    A sample is taken at every steps_skip-th timeframe_0 bar whose date is present in timeframe_1, once it has a full
+    window; its window is the draw_window bars ending at this bar, as in the live strategy.
+    Returns for all samples: window ends j (the window is rows [j - draw_window, j) of df_in), dates of the samples
+    (of the last bar of the window), classes (1 if the close of the next timeframe_1 bar > the close at the date -
+    the move the live strategy trades) and dates of the timeframe_1 bars giving the classes"""
+    _t_in = df_in["datetime"].to_numpy(dtype="datetime64[ns]").view(np.int64)
+    _t_out = df_out["datetime"].to_numpy(dtype="datetime64[ns]").view(np.int64)
+    _close_out = df_out["close"].to_numpy()
+
+    # Position of every timeframe_0 date among the sorted timeframe_1 dates
+    _pos = np.searchsorted(_t_out, _t_in)
+    _found = _pos < len(_t_out)
+    _found[_found] = _t_out[_pos[_found]] == _t_in[_found]
+    _matched = np.flatnonzero(_found)
+
+    _rows = _matched[max(steps_skip, 1) - 1::max(steps_skip, 1)]  # Rows of df_in with the dates of the samples
+    _rows = _rows[(_rows + 1 >= draw_window) & (_pos[_rows] + 1 < len(_t_out))]  # Full window and a next bar
+    _pos = _pos[_rows]
+    _labels = (_close_out[_pos + 1] > _close_out[_pos]).astype(np.int64)
+    return _rows + 1, df_in["datetime"].to_numpy()[_rows], _labels, df_out["datetime"].to_numpy()[_pos + 1]
+
+def load_samples(tickers, timeframe_0, timeframe_1, period_sma_fast, period_sma_slow, draw_window, steps_skip):
+    """Candles and samples of several tickers for rendering on the fly, in the order of sorted tickers.
+    Series of all tickers are concatenated, ends index the concatenated series"""
+    _series = {"close": [], "sma_fast": [], "sma_slow": []}
+    _samples = {"ends": [], "datetimes": [], "labels": [], "label_datetimes": [], "tickers": []}
+    _offset = 0
+    for ticker in sorted(tickers):
+        df_out = get_df_t1(ticker, timeframe_1)
+        df_in = get_df_tf0(ticker, timeframe_0, period_sma_fast, period_sma_slow)
+        _ends, _dates, _labels, _label_dates = get_windows_and_labels(df_in, df_out, draw_window, steps_skip)
+        for _column in _series:
+            _series[_column].append(df_in[_column].to_numpy())
+        _samples["ends"].append(_ends + _offset)
+        _samples["datetimes"].append(_dates.astype("datetime64[ns]").view(np.int64))
+        _samples["labels"].append(_labels)
+        _samples["label_datetimes"].append(_label_dates.astype("datetime64[ns]").view(np.int64))
+        _samples["tickers"].append(np.full(len(_ends), ticker))
+        _offset += len(df_in)
+    return {_name: np.concatenate(_values) for _name, _values in {**_series, **_samples}.items()}
+
+def render_samples(samples, numbers, draw_window, input_mode="image"):
+    """Model inputs and labels of the samples with the given numbers (see load_samples)"""
+    _windows = samples["ends"][numbers, None] + np.arange(-draw_window, 0)
+    _inputs = generate_input_batch(samples["sma_fast"][_windows], samples["sma_slow"][_windows],
+                                   samples["close"][_windows], draw_window, input_mode)
+    return _inputs, samples["labels"][numbers]
+
+_COLORS = np.array([[255, 0, 0], [0, 0, 255], [0, 128, 0]], dtype=np.uint8)  # PIL "red", "blue", "green"
+RENDERER_VERSION = 1  # Part of the key of the cached images - increase on any change of generate_img_batch
+
+def generate_img_batch(_sma_fast_windows, _sma_slow_windows, _closes_windows, draw_window):
+    """Generate images for N windows at once - an (N, draw_window, draw_window, 3) uint8 array.
+    Draws the same 1 px polylines as PIL: close in red, fast SMA in blue, slow SMA in green"""
+    _series = np.stack([np.asarray(_closes_windows, dtype=np.float64),
+                        np.asarray(_sma_fast_windows, dtype=np.float64),
+                        np.asarray(_sma_slow_windows, dtype=np.float64)], axis=1)  # (N, 3, w) in drawing order
+    _n, w = len(_series), draw_window
+
+    _min = _series.min(axis=(1, 2), keepdims=True)
+    _delta_h = _series.max(axis=(1, 2), keepdims=True) - _min
+    # Scaling coefficient for _h to fit in square, a flat window is drawn on the first row
+    _k_h = np.divide(w - 1, _delta_h, out=np.zeros_like(_delta_h), where=_delta_h > 0)
+    _h = ((_series - _min) * _k_h).astype(np.int64)  # Same truncation as int() for non-negative values
+
+    # Segments (i - 1, _h_1) -> (i, _h) in the PIL drawing order: window, column, colour
+    _h_1 = _h[:, :, :-1].transpose(0, 2, 1).ravel()
+    _h = _h[:, :, 1:].transpose(0, 2, 1).ravel()
+    _segment = np.arange(_h.size)
+    _x_1 = (_segment // 3) % (w - 1)
+    _window = _segment // (3 * (w - 1))
+
+    # Bresenham for a segment one pixel wide: rows _h_1.._h, the first half of them in column i - 1,
+    # the rest in column i; a horizontal segment covers both columns
+    _dy = np.abs(_h - _h_1)
+    _count = np.maximum(_dy + 1, 2)
+    _half = np.maximum((_dy + 1) // 2, 1)
+    _pixel_segment = np.repeat(_segment, _count)
+    _k = np.arange(_pixel_segment.size) - np.repeat(np.cumsum(_count) - _count, _count)
+    _y = _h_1[_pixel_segment] + np.sign(_h - _h_1)[_pixel_segment] * _k
+    _x = _x_1[_pixel_segment] + (_k >= _half[_pixel_segment])
+    _pixel = (_window[_pixel_segment] * w + _y) * w + _x
+
+    # The segment drawn last wins: stable sort keeps the drawing order among equal pixels
+    _order = np.argsort(_pixel, kind='stable')
+    _pixel, _pixel_segment = _pixel[_order], _pixel_segment[_order]
+    _last = np.append(_pixel[1:] != _pixel[:-1], True)
+
+    img = np.zeros((_n * w * w, 3), dtype=np.uint8)
+    img[_pixel[_last]] = _COLORS[_pixel_segment[_last] % 3]
+    return img.reshape(_n, w, w, 3)
+
+def generate_img_array(_sma_fast_list, _sma_slow_list, _closes_list, draw_window):
+    """Generate an image for training/testing the neural network as a (draw_window, draw_window, 3) uint8 array"""
+    return generate_input_batch([_sma_fast_list], [_sma_slow_list], [_closes_list], draw_window, "image")[0]
+
+def generate_series_batch(_sma_fast_windows, _sma_slow_windows, _closes_windows, draw_window):
+    """Generate the raw-series input for N windows - an (N, draw_window, 3) float32 array of close, fast SMA and
+    slow SMA scaled to [0, 1] by the min/max of the window, the same scaling as in the images"""
+    _series = np.stack([np.asarray(_closes_windows, dtype=np.float64)[:, :draw_window],
+                        np.asarray(_sma_fast_windows, dtype=np.float64)[:, :draw_window],
+                        np.asarray(_sma_slow_windows, dtype=np.float64)[:, :draw_window]], axis=2)
+    _min = _series.min(axis=(1, 2), keepdims=True)
+    _delta_h = _series.max(axis=(1, 2), keepdims=True) - _min
+    return np.divide(_series - _min, _delta_h, out=np.zeros_like(_series), where=_delta_h > 0).astype(np.float32)
+
+def generate_series_array(_sma_fast_list, _sma_slow_list, _closes_list, draw_window):
+    """Generate the raw-series input for one window - a (draw_window, 3) float32 array"""
+    return generate_series_batch([_sma_fast_list], [_sma_slow_list], [_closes_list], draw_window)[0]
+
+def generate_input_batch(_sma_fast_windows, _sma_slow_windows, _closes_windows, draw_window, input_mode):
+    """Model inputs for N windows: "image" - chart images, "series" - normalized raw series.
+    Images are taken from the render cache by the content of the window, only the missing ones are drawn"""
+    if input_mode == "series":
+        return generate_series_batch(_sma_fast_windows, _sma_slow_windows, _closes_windows, draw_window)
+    _fast, _slow, _closes = (np.asarray(_windows, dtype=np.float64)
+                             for _windows in (_sma_fast_windows, _sma_slow_windows, _closes_windows))
+    return functions_cache.get_rows(functions_cache.RENDER, {"input": "image", "draw_window": draw_window,
+                                                              "renderer": RENDERER_VERSION},
+                                    (_closes, _fast, _slow),
+                                    lambda _rows: generate_img_batch(_fast[_rows], _slow[_rows], _closes[_rows],
+                                                                     draw_window))
 
 def generate_img(_sma_fast_list, _sma_slow_list, _closes_list, draw_window):
     """Generate an image for training/testing the neural network"""
+    return Image.fromarray(generate_img_array(_sma_fast_list, _sma_slow_list, _closes_list, draw_window))
+
+def generate_img_pil(_sma_fast_list, _sma_slow_list, _closes_list, draw_window):
+    """Generate an image with PIL line by line - the reference implementation for generate_img_batch"""
     _max = max(max(_sma_fast_list), max(_sma_slow_list), max(_closes_list))
     _min = min(min(_sma_fast_list), min(_sma_slow_list), min(_closes_list))
     _delta_h = _max - _min
@@ -36,6 +184,7 @@ def generate_img(_sma_fast_list, _sma_slow_list, _closes_list, draw_window):
     w, h = draw_window, draw_window
 
     # Creating a new Image object - https://www.geeksforgeeks.org/python-pil-imagedraw-draw-line/
+    # width=1 gives the 1 px line that width=0 gave on Pillow 9 - newer Pillow draws nothing for width=0
     img = Image.new("RGB", (w, h))
     img1 = ImageDraw.Draw(img)
     for i in range(1, w):
@@ -44,15 +193,15 @@ def generate_img(_sma_fast_list, _sma_slow_list, _closes_list, draw_window):
         _h_1 = int((_closes_list[i - 1] - _min) * _k_h)
         _h = int((_closes_list[i] - _min) * _k_h)
         shape = [(i - 1, _h_1), (i, _h)]
-        img1.line(shape, fill="red", width=0)
+        img1.line(shape, fill="red", width=1)
         # Output fast SMA
         _h_1 = int((_sma_fast_list[i - 1] - _min) * _k_h)
         _h = int((_sma_fast_list[i] - _min) * _k_h)
         shape = [(i - 1, _h_1), (i, _h)]
-        img1.line(shape, fill="blue", width=0)
+        img1.line(shape, fill="blue", width=1)
         # Output slow SMA
         _h_1 = int((_sma_slow_list[i - 1] - _min) * _k_h)
         _h = int((_sma_slow_list[i] - _min) * _k_h)
         shape = [(i - 1, _h_1), (i, _h)]
-        img1.line(shape, fill="green", width=0)
+        img1.line(shape, fill="green", width=1)
     return img
@@ -0,0 +1,156 @@
+"""
+Non-blocking order gateway of the live strategy.
+
+FinamPy new_order is a synchronous gRPC call. Made directly in a coroutine it blocks the event loop, so polling
+and signal evaluation of all other tickers stall until the broker answers. OrderGateway runs the broker calls
+in a bounded pool of threads: submit() queues the order and returns at once, the order is tracked with its
+status, timings and transaction id, and can be awaited if needed.
+
+FakeBroker has the same new_order interface as FinamPy with a configurable latency, so the gateway can be
+tested offline. Run this file to check that orders do not block the event loop:
+    python functions_orders.py
+"""
+
+import asyncio
+import itertools
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+logger = logging.getLogger(__name__)
+
+
+class Order:
+    """Order sent through the gateway"""
+
+    def __init__(self, order_id, kwargs):
+        self.order_id = order_id
+        self.kwargs = kwargs  # arguments of new_order
+        self.status = "queued"  # queued -> sent -> done / error
+        self.result = None  # response of the broker
+        self.transaction_id = None
+        self.error = None
+        self.created = time.perf_counter()
+        self.sent = None
+        self.done = None
+        self.future = None  # asyncio future of the response
+
+    @property
+    def latency(self):
+        """Seconds from submit to the response of the broker, None while pending"""
+        return None if self.done is None else self.done - self.created
+
+    def __repr__(self):
+        return (f"Order({self.order_id}, {self.kwargs.get('security_code')}, {self.kwargs.get('buy_sell')}, "
+                f"{self.kwargs.get('quantity')}, status={self.status}, transaction_id={self.transaction_id})")
+
+
+class OrderGateway:
+    """Runs broker.new_order in a bounded thread pool and tracks the orders"""
+
+    def __init__(self, broker, max_workers=4):
+        self.broker = broker
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="orders")
+        self.orders = {}  # order_id -> Order
+        self.transactions = {}  # transaction_id -> Order
+        self._ids = itertools.count(1)
+
+    def _send(self, order):
+        """Blocking call of the broker, runs in a worker thread"""
+        order.sent = time.perf_counter()
+        return self.broker.new_order(**order.kwargs)
+
+    def _on_done(self, order, future):
+        """Record the response of the broker, runs in the event loop"""
+        order.done = time.perf_counter()
+        if future.cancelled():
+            order.status = "error"
+            order.error = "cancelled"
+        elif future.exception() is not None:
+            order.status = "error"
+            order.error = future.exception()
+            logger.error("Order %s failed: %s", order.order_id, order.error)
+        else:
+            order.status = "done"
+            order.result = future.result()
+            order.transaction_id = getattr(order.result, "transaction_id", None)
+            self.transactions[order.transaction_id] = order
+            logger.debug("Order %s done in %.1f ms: transaction %s", order.order_id, order.latency * 1000,
+                         order.transaction_id)
+
+    def submit(self, **kwargs):
+        """Queue an order with the arguments of new_order; returns the Order at once, without waiting"""
+        order = Order(next(self._ids), kwargs)
+        self.orders[order.order_id] = order
+        order.future = asyncio.get_running_loop().run_in_executor(self.executor, self._send, order)
+        order.status = "sent"
+        order.future.add_done_callback(lambda _future: self._on_done(order, _future))
+        return order
+
+    async def wait(self, order):
+        """Wait for the response of the broker to the order; returns the order"""
+        try:
+            await asyncio.shield(order.future)
+        except Exception:
+            pass  # the error is recorded in the order
+        return order
+
+    def pending(self):
+        """Orders without a response yet"""
+        return [order for order in self.orders.values() if order.done is None]
+
+    def close(self):
+        """Wait for the sent orders and stop the worker threads"""
+        self.executor.shutdown(wait=True)
+
+
+class FakeBroker:
+    """Broker with the new_order interface of FinamPy that answers after latency seconds"""
+
+    def __init__(self, latency=0.2, fail_every=0):
+        self.latency = latency
+        self.fail_every = fail_every  # every n-th order fails, 0 - never
+        self.orders = []
+        self._lock = threading.Lock()
+        self._transaction_ids = itertools.count(1)
+
+    def new_order(self, client_id, security_board, security_code, buy_sell, quantity, use_credit=False, price=None,
+                  **kwargs):
+        time.sleep(self.latency)  # blocking, like the gRPC call
+        with self._lock:
+            _transaction_id = next(self._transaction_ids)
+            self.orders.append({"transaction_id": _transaction_id, "client_id": client_id,
+                                "security_board": security_board, "security_code": security_code,
+                                "buy_sell": buy_sell, "quantity": quantity, "use_credit": use_credit, "price": price})
+        if self.fail_every and _transaction_id % self.fail_every == 0:
+            raise RuntimeError(f"Order {_transaction_id} rejected by the fake broker")
+        return SimpleNamespace(client_id=client_id, transaction_id=_transaction_id, security_code=security_code)
+
+
+async def check_event_loop_is_not_blocked(orders=20, latency=0.2, max_workers=4, tick=0.01):
+    """Place orders through the gateway while another coroutine ticks every `tick` seconds;
+    returns the maximum delay of a tick and the latencies of the orders"""
+    gateway = OrderGateway(FakeBroker(latency=latency), max_workers=max_workers)
+    _lags = []
+
+    async def _ticker():
+        while True:
+            _start = time.perf_counter()
+            await asyncio.sleep(tick)
+            _lags.append(time.perf_counter() - _start - tick)
+
+    _task = asyncio.create_task(_ticker())
+    _orders = [gateway.submit(client_id="test", security_board="TQBR", security_code="SBER", buy_sell="buy",
+                              quantity=1) for _ in range(orders)]
+    await asyncio.gather(*[gateway.wait(_order) for _order in _orders])
+    _task.cancel()
+    gateway.close()
+    return max(_lags), [_order.latency for _order in _orders]
+
+
+if __name__ == "__main__":
+    _max_lag, _latencies = asyncio.run(check_event_loop_is_not_blocked())
+    print(f"20 orders, 0.2 s each, 4 workers: done in {max(_latencies):.2f} s, "
+          f"max event loop delay {_max_lag * 1000:.1f} ms")
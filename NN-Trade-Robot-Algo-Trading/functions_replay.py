@@ -0,0 +1,167 @@
+"""
+Accelerated replay of stored candles through the decision logic of the live strategy.
+
+The class of every bar does not depend on the position, so the model inputs of all bars are rendered and
+predicted in large batches first - with the same indicators (functions_indicators) and renderer (functions_nn)
+as the live strategy. Then the bars are replayed one by one through the trading rule of the live strategy
+(functions_strategy.OneBarHoldRule.trade) with:
+- VirtualClock in place of datetime.now() - the time of the current bar
+- ImmediateGateway + SimulatedBroker in place of the order gateway and FinamPy - market orders are filled
+  at the close of the current bar or at the open of the next bar
+The fills are paired into trades and summarized into a PnL report.
+"""
+
+import itertools
+import functions_nn
+import functions_orders
+import numpy as np
+import pandas as pd
+from types import SimpleNamespace
+
+
+class VirtualClock:
+    """Replacement of datetime.now() - returns the time of the replayed bar"""
+
+    def __init__(self):
+        self.now = None
+
+    def __call__(self):
+        return self.now
+
+
+class SimulatedBroker:
+    """Broker with the new_order interface of FinamPy that fills market orders at the prices of the current bar"""
+
+    def __init__(self, buy_value, fill="close"):
+        self.buy_value = buy_value  # value of buy_sell of a buy order, BUY_SELL_BUY of FinamPy
+        self.fill = fill  # "close" - close of the current bar, "next_open" - open of the next bar
+        self.fills = []
+        self._bars = {}  # ticker -> (datetime, close, next open)
+        self._transaction_ids = itertools.count(1)
+
+    def set_bar(self, ticker, _datetime, close, next_open):
+        """Prices of the current bar of the ticker"""
+        self._bars[ticker] = (_datetime, close, next_open)
+
+    def new_order(self, client_id, security_board, security_code, buy_sell, quantity, use_credit=False, price=None,
+                  **kwargs):
+        _datetime, _close, _next_open = self._bars[security_code]
+        _price = _next_open if self.fill == "next_open" and not np.isnan(_next_open) else _close
+        _fill = {"transaction_id": next(self._transaction_ids), "ticker": security_code, "datetime": _datetime,
+                 "side": 1 if buy_sell == self.buy_value else -1, "quantity": quantity, "price": _price}
+        self.fills.append(_fill)
+        return SimpleNamespace(client_id=client_id, transaction_id=_fill["transaction_id"],
+                               security_code=security_code, price=_price)
+
+
+class ImmediateGateway:
+    """Order gateway of the replay: the simulated broker answers at once, in the calling thread"""
+
+    def __init__(self, broker):
+        self.broker = broker
+        self.orders = {}
+        self._ids = itertools.count(1)
+
+    def submit(self, **kwargs):
+        order = functions_orders.Order(next(self._ids), kwargs)
+        order.result = self.broker.new_order(**kwargs)
+        order.transaction_id = order.result.transaction_id
+        order.status = "done"
+        order.done = order.created
+        self.orders[order.order_id] = order
+        return order
+
+    async def wait(self, order):
+        return order
+
+
+def get_replay_data(ticker, timeframe_0, period_sma_fast, period_sma_slow, draw_window, start=None, end=None):
+    """Candles and SMA of the ticker for the replay of [start, end] plus draw_window - 1 bars before start,
+    first - the row of the first replayed bar. A date-only end includes the whole day"""
+    if end and pd.Timestamp(end) == pd.Timestamp(end).normalize():
+        end = pd.Timestamp(end) + pd.Timedelta(days=1) - pd.Timedelta(1, unit="ns")  # The last moment of the day
+    df = functions_nn.get_df_tf0(ticker, timeframe_0, period_sma_fast, period_sma_slow, end=end or None)
+    _datetimes = df["datetime"].to_numpy(dtype="datetime64[ns]")
+    _first = int(np.searchsorted(_datetimes, np.datetime64(pd.Timestamp(start)))) if start else 0
+    _i0 = max(_first - draw_window + 1, 0)
+    _data = {_column: df[_column].to_numpy()[_i0:] for _column in ("open", "close", "sma_fast", "sma_slow")}
+    _data["datetime"] = _datetimes[_i0:]
+    _data["first"] = _first - _i0
+    return _data
+
+
+def predict_logits(data, draw_window, input_mode, predict_batch, batch_size=256):
+    """Logits of the model for every bar with a full window (NaN for the first draw_window - 1 bars),
+    rendered and predicted in batches"""
+    _n = len(data["close"])
+    _logits = None
+    _ends = np.arange(max(draw_window - 1, data["first"]), _n)
+    for _i0 in range(0, len(_ends), batch_size):
+        _windows = _ends[_i0:_i0 + batch_size, None] + np.arange(-draw_window + 1, 1)
+        _inputs = functions_nn.generate_input_batch(data["sma_fast"][_windows], data["sma_slow"][_windows],
+                                                    data["close"][_windows], draw_window, input_mode)
+        _batch_logits = predict_batch(_inputs.astype(np.float32))
+        if _logits is None:
+            _logits = np.full((_n, _batch_logits.shape[1]), np.nan, dtype=np.float32)
+        _logits[_ends[_i0:_i0 + batch_size]] = _batch_logits
+    return _logits if _logits is not None else np.full((_n, 2), np.nan, dtype=np.float32)
+
+
+def replay(strategy, data, logits, clock, broker, gateway, threshold=0.0):
+    """Replay the bars from data["first"] through strategy.trade; the class of a bar is 1 if its class-1 logit
+    >= threshold, bars without a full window are skipped like in the live strategy"""
+    _datetimes = pd.to_datetime(data["datetime"]).to_pydatetime()
+    _next_open = np.append(data["open"][1:], np.nan)
+    _classes = np.where(np.isnan(logits[:, 1]), -1, logits[:, 1] >= threshold)
+    for _i in range(data["first"], len(_datetimes)):
+        if _classes[_i] < 0:
+            continue
+        clock.now = _datetimes[_i]
+        broker.set_bar(strategy.ticker, _datetimes[_i], data["close"][_i], _next_open[_i])
+        strategy.trade(int(_classes[_i]), gateway)
+
+
+def get_trades(fills, last_prices, commission=0.0):
+    """Pair the fills of every ticker into round trips; a position still open is closed at the last price"""
+    _trades = []
+    for ticker, _fills in itertools.groupby(sorted(fills, key=lambda f: (f["ticker"], f["transaction_id"])),
+                                            key=lambda f: f["ticker"]):
+        _entry = None
+        for _fill in _fills:
+            if _fill["side"] > 0 and _entry is None:
+                _entry = _fill
+            elif _fill["side"] < 0 and _entry is not None:
+                _trades.append((ticker, _entry, _fill["datetime"], _fill["price"], False))
+                _entry = None
+        if _entry is not None:
+            _datetime, _price = last_prices[ticker]
+            _trades.append((ticker, _entry, _datetime, _price, True))
+
+    df = pd.DataFrame({
+        "ticker": [t[0] for t in _trades],
+        "entry_datetime": [t[1]["datetime"] for t in _trades],
+        "entry_price": [t[1]["price"] for t in _trades],
+        "exit_datetime": [t[2] for t in _trades],
+        "exit_price": [t[3] for t in _trades],
+        "quantity": [t[1]["quantity"] for t in _trades],
+        "open": [t[4] for t in _trades],
+    })
+    df["commission"] = commission * (df["entry_price"] + df["exit_price"]) * df["quantity"]
+    df["pnl"] = (df["exit_price"] - df["entry_price"]) * df["quantity"] - df["commission"]
+    df["return"] = df["pnl"] / (df["entry_price"] * df["quantity"])
+    return df.sort_values("exit_datetime", kind="stable").reset_index(drop=True)
+
+
+def get_report(trades):
+    """Summary of the trades: count, win rate, PnL, returns and the maximum drawdown of the cumulative return"""
+    _equity = np.cumsum(trades["return"].to_numpy())
+    _drawdown = np.maximum.accumulate(np.append(0, _equity))[1:] - _equity
+    return {
+        "trades": len(trades),
+        "win rate": float((trades["pnl"] > 0).mean()) if len(trades) else 0.0,
+        "pnl": float(trades["pnl"].sum()),
+        "commission": float(trades["commission"].sum()),
+        "mean return": float(trades["return"].mean()) if len(trades) else 0.0,
+        "total return": float(_equity[-1]) if len(trades) else 0.0,
+        "max drawdown": float(_drawdown.max()) if len(trades) else 0.0,
+    }
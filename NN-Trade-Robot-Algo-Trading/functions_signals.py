@@ -0,0 +1,191 @@
+"""
+Columnar store of the scores of the neural network for every bar of the history.
+
+Each model/ticker/timeframe is kept in the folder `signals/{model_id}/{ticker}_{timeframe}`, in the same layout
+as the candle store (functions_store):
+- datetime.bin - int64 epoch in nanoseconds of the scored bar (sorted)
+- logits.bin - float32, num_classes logits of the model per bar
+- _meta.json - number of committed rows, number of classes and the parameters the inputs were rendered with
+The model id is the name of the model file plus the hash of its content, so scores of a retrained model never mix
+with the old ones. A bar is scored when it has a full window: the window of draw_window bars ending at the bar,
+the same input as in the live strategy and in the replay (functions_replay.predict_logits).
+
+Scoring is split into work units - bars [start, stop) of one ticker - rendered by a pool of processes from
+candle/SMA arrays in shared memory, while the parent predicts the rendered units in large batches. Only a few units
+are rendered ahead of the predictions (render_units), so the rendered inputs never pile up in memory.
+"""
+
+import collections
+import functions_dataset
+import functions_nn
+import functools
+import hashlib
+import itertools
+import json
+import os
+import numpy as np
+import pandas as pd
+
+cur_run_folder = os.path.abspath(os.getcwd())  # Current directory
+
+
+def get_model_id(filename):
+    """Id of the model: name of the file plus the hash of its content"""
+    _hash = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        for _chunk in iter(lambda: f.read(1 << 20), b''):
+            _hash.update(_chunk)
+    return f"{os.path.splitext(os.path.basename(filename))[0]}_{_hash.hexdigest()[:12]}"
+
+
+def get_params(timeframe_0, period_sma_fast, period_sma_slow, draw_window, input_mode):
+    """Parameters of the inputs the scores depend on besides the model"""
+    return {"timeframe_0": timeframe_0, "period_sma_fast": period_sma_fast, "period_sma_slow": period_sma_slow,
+            "sma": "fixed_point", "draw_window": draw_window, "input_mode": input_mode}
+
+
+def get_signals_path(model_id, ticker, timeframe):
+    """Path to the folder with the signals of the model for ticker/timeframe"""
+    return os.path.join(cur_run_folder, "signals", model_id, f"{ticker}_{timeframe}")
+
+
+def list_tickers(timeframe):
+    """Tickers with candles of the timeframe in the candle store or in csv/"""
+    _tickers = set()
+    _store = os.path.join(cur_run_folder, "store")
+    if os.path.exists(_store):
+        _tickers |= {_name.rsplit("_", 1)[0] for _name in os.listdir(_store) if _name.endswith(f"_{timeframe}")}
+    _csv = os.path.join(cur_run_folder, "csv")
+    if os.path.exists(_csv):
+        _tickers |= {_name[:-len(".csv")].rsplit("_", 1)[0] for _name in os.listdir(_csv)
+                     if _name.endswith(f"_{timeframe}.csv")}
+    return sorted(_tickers)
+
+
+def get_meta(model_id, ticker, timeframe):
+    """Meta of the stored signals, None if there are none"""
+    _filename = os.path.join(get_signals_path(model_id, ticker, timeframe), "_meta.json")
+    if not os.path.exists(_filename):
+        return None
+    with open(_filename, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _write_meta(path, rows, num_classes, params):
+    """Commit the number of rows - the last step of any write, so readers never see a partial append"""
+    _filename = os.path.join(path, "_meta.json")
+    with open(_filename + ".tmp", 'w', encoding='utf-8') as f:
+        json.dump({"rows": int(rows), "num_classes": int(num_classes), "params": params}, f, indent=4)
+    os.replace(_filename + ".tmp", _filename)
+
+
+def append_signals(model_id, ticker, timeframe, datetimes, logits, params, rows=None):
+    """Append the logits of bars to the stored signals at row `rows` (by default after the committed rows);
+    rows=0 replaces the signals. Returns the number of rows after the append"""
+    _path = get_signals_path(model_id, ticker, timeframe)
+    os.makedirs(_path, exist_ok=True)
+    if rows is None:
+        _meta = get_meta(model_id, ticker, timeframe)
+        rows = _meta["rows"] if _meta else 0
+    logits = np.ascontiguousarray(logits, dtype=np.float32)
+    _num_classes = logits.shape[1]
+    for _column, _values, _width in (("datetime", np.asarray(datetimes, dtype=np.int64), 1),
+                                     ("logits", logits, _num_classes)):
+        with open(os.path.join(_path, f"{_column}.bin"), 'ab') as f:
+            f.truncate(rows * _width * _values.itemsize)  # Drop leftovers of an interrupted append
+            f.write(_values.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+    _write_meta(_path, rows + len(logits), _num_classes, params)
+    return rows + len(logits)
+
+
+def read_signals(model_id, ticker, timeframe, start=None, end=None):
+    """Read the signals as memory-mapped arrays: datetime (n,) int64 and logits (n, num_classes) float32.
+    start/end - optional bounds of the datetime (inclusive)"""
+    _meta = get_meta(model_id, ticker, timeframe)
+    if _meta is None:
+        raise FileNotFoundError(f"No signals of {model_id} for {ticker} {timeframe}")
+    _path, _rows = get_signals_path(model_id, ticker, timeframe), _meta["rows"]
+    if not _rows:
+        return {"datetime": np.empty(0, np.int64), "logits": np.empty((0, _meta["num_classes"]), np.float32)}
+    _datetimes = np.memmap(os.path.join(_path, "datetime.bin"), dtype=np.int64, mode='r', shape=(_rows,))
+    _logits = np.memmap(os.path.join(_path, "logits.bin"), dtype=np.float32, mode='r',
+                        shape=(_rows, _meta["num_classes"]))
+    _i0 = 0 if start is None else int(np.searchsorted(_datetimes, pd.Timestamp(start).value, side='left'))
+    _i1 = _rows if end is None else int(np.searchsorted(_datetimes, pd.Timestamp(end).value, side='right'))
+    return {"datetime": np.asarray(_datetimes[_i0:_i1]), "logits": np.asarray(_logits[_i0:_i1])}
+
+
+def load_signals_df(model_id, tickers, timeframe, start=None, end=None):
+    """Signals of several tickers as one DataFrame: ticker, datetime, logit_0.., model_id"""
+    _frames = []
+    for ticker in sorted(tickers):
+        _signals = read_signals(model_id, ticker, timeframe, start=start, end=end)
+        df = pd.DataFrame({"ticker": ticker, "datetime": _signals["datetime"].view("datetime64[ns]")})
+        for _class in range(_signals["logits"].shape[1]):
+            df[f"logit_{_class}"] = _signals["logits"][:, _class]
+        df["model_id"] = model_id
+        _frames.append(df)
+    return pd.concat(_frames, ignore_index=True) if _frames else pd.DataFrame()
+
+
+def get_logits(model_id, ticker, timeframe, datetimes, params):
+    """Stored logits for the bars with the given datetimes (datetime64 or int64 ns), NaN for bars without a score;
+    None if there are no signals rendered with the same parameters"""
+    _meta = get_meta(model_id, ticker, timeframe)
+    if _meta is None or _meta["params"] != params:
+        return None
+    _signals = read_signals(model_id, ticker, timeframe)
+    _datetimes = np.asarray(datetimes).astype("datetime64[ns]").view(np.int64)
+    _logits = np.full((len(_datetimes), _meta["num_classes"]), np.nan, dtype=np.float32)
+    _pos = np.searchsorted(_signals["datetime"], _datetimes)
+    _found = _pos < len(_signals["datetime"])
+    _found[_found] = _signals["datetime"][_pos[_found]] == _datetimes[_found]
+    _logits[_found] = _signals["logits"][_pos[_found]]
+    return _logits
+
+
+def get_first_bar(model_id, ticker, timeframe, params, datetimes, draw_window):
+    """First bar to score and the row of the store to write it at: after the last stored signal if the signals
+    were rendered with the same parameters and their last bar is in the history, otherwise from scratch"""
+    _from_scratch = (draw_window - 1, 0)
+    _meta = get_meta(model_id, ticker, timeframe)
+    if _meta is None or _meta["params"] != params or not _meta["rows"]:
+        return _from_scratch
+    _last = read_signals(model_id, ticker, timeframe)["datetime"][-1]
+    _i = int(np.searchsorted(datetimes, _last))
+    if _i >= len(datetimes) or datetimes[_i] != _last:
+        return _from_scratch  # The history changed
+    return max(_i + 1, draw_window - 1), _meta["rows"]
+
+
+def get_units(ticker, first, bars, unit_size, arrays_spec):
+    """Split the bars [first, bars) of a ticker into work units of unit_size bars"""
+    return [{"ticker": ticker, "start": _start, "stop": min(_start + unit_size, bars), "arrays": arrays_spec}
+            for _start in range(first, bars, unit_size)]
+
+
+def render_unit(unit, draw_window, input_mode):
+    """Work unit of the scoring, runs in a worker process: inputs of the bars [start, stop) of the unit"""
+    _blocks, _arrays = functions_dataset.attach_arrays(unit["arrays"])
+    try:
+        _windows = np.arange(unit["start"], unit["stop"])[:, None] + np.arange(-draw_window + 1, 1)
+        _inputs = functions_nn.generate_input_batch(_arrays["sma_fast"][_windows], _arrays["sma_slow"][_windows],
+                                                    _arrays["close"][_windows], draw_window, input_mode)
+        return unit, _inputs, _arrays["datetimes"][unit["start"]:unit["stop"]].copy()
+    finally:
+        del _arrays  # Views must be released before the blocks are closed
+        functions_dataset.release_arrays(_blocks)
+
+
+def render_units(pool, units, draw_window, input_mode, ahead):
+    """Yield (unit, inputs, datetimes) of the units in order, rendered by the pool at most `ahead` units in advance"""
+    _render = functools.partial(render_unit, draw_window=draw_window, input_mode=input_mode)
+    _units = iter(units)
+    _pending = collections.deque(pool.apply_async(_render, (_unit,)) for _unit in itertools.islice(_units, ahead))
+    while _pending:
+        _result = _pending.popleft().get()
+        for _unit in itertools.islice(_units, 1):
+            _pending.append(pool.apply_async(_render, (_unit,)))
+        yield _result
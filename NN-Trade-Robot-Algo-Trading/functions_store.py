@@ -0,0 +1,155 @@
+"""
+Columnar binary storage of candles.
+
+Each ticker/timeframe is kept in the folder `store/{ticker}_{timeframe}` as one raw binary file per column
+plus `_meta.json` with the number of committed rows:
+- datetime.bin - int64 epoch in nanoseconds (sorted), used as the index
+- open.bin, high.bin, low.bin, close.bin - float64
+- volume.bin - int64
+Columns are read through memory-mapping, so selecting a date range touches only the needed part of the files.
+
+Run this file to convert the existing `csv/*.csv` files into the store:
+    python functions_store.py
+"""
+
+import json
+import os
+import numpy as np
+import pandas as pd
+
+cur_run_folder = os.path.abspath(os.getcwd())  # Current directory
+
+COLUMNS = {
+    "datetime": np.int64,
+    "open": np.float64,
+    "high": np.float64,
+    "low": np.float64,
+    "close": np.float64,
+    "volume": np.int64,
+}
+
+
+def get_store_path(ticker, timeframe):
+    """Path to the folder with the columns of ticker/timeframe"""
+    return os.path.join(cur_run_folder, "store", f"{ticker}_{timeframe}")
+
+
+def get_rows(ticker, timeframe):
+    """Number of committed rows in the store, None if there is no store for ticker/timeframe"""
+    _filename = os.path.join(get_store_path(ticker, timeframe), "_meta.json")
+    if not os.path.exists(_filename):
+        return None
+    with open(_filename, 'r', encoding='utf-8') as f:
+        return json.load(f)["rows"]
+
+
+def store_exists(ticker, timeframe):
+    """Whether candles of ticker/timeframe are present in the store"""
+    return get_rows(ticker, timeframe) is not None
+
+
+def _write_rows(path, rows):
+    """Commit the number of rows - the last step of any write, so readers never see a partial append"""
+    _filename = os.path.join(path, "_meta.json")
+    with open(_filename + ".tmp", 'w', encoding='utf-8') as f:
+        json.dump({"rows": int(rows)}, f)
+    os.replace(_filename + ".tmp", _filename)
+
+
+def _df_to_columns(df):
+    """Convert a DataFrame of candles into contiguous arrays of the store dtypes"""
+    _columns = {"datetime": pd.to_datetime(df["datetime"]).values.astype("datetime64[ns]").view(np.int64)}
+    for _column, _dtype in COLUMNS.items():
+        if _column != "datetime":
+            _columns[_column] = df[_column].to_numpy(dtype=_dtype)
+    return _columns
+
+
+def append_candles(df, ticker, timeframe):
+    """Append candles newer than the last stored one; creates the store if needed. Returns the number of new rows"""
+    _path = get_store_path(ticker, timeframe)
+    os.makedirs(_path, exist_ok=True)
+    _rows = get_rows(ticker, timeframe) or 0
+    _columns = _df_to_columns(df)
+
+    if _rows:
+        _last = read_candles(ticker, timeframe)["datetime"][-1]
+        _mask = _columns["datetime"] > _last
+        _columns = {_column: _values[_mask] for _column, _values in _columns.items()}
+    _new_rows = len(_columns["datetime"])
+    if not _new_rows:
+        return 0
+
+    for _column, _dtype in COLUMNS.items():
+        _filename = os.path.join(_path, f"{_column}.bin")
+        with open(_filename, 'ab') as f:
+            f.truncate(_rows * np.dtype(_dtype).itemsize)  # Drop leftovers of an interrupted append
+            f.write(_columns[_column].tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+    _write_rows(_path, _rows + _new_rows)
+    return _new_rows
+
+
+def write_candles(df, ticker, timeframe):
+    """Replace all candles of ticker/timeframe in the store"""
+    _path = get_store_path(ticker, timeframe)
+    if store_exists(ticker, timeframe):
+        _write_rows(_path, 0)
+    append_candles(df, ticker, timeframe)
+
+
+def read_candles(ticker, timeframe, start=None, end=None, warmup=0):
+    """Read the columns of ticker/timeframe as memory-mapped arrays (zero-copy).
+    start/end - optional bounds of the datetime (inclusive), warmup - number of extra rows before start"""
+    _path = get_store_path(ticker, timeframe)
+    _rows = get_rows(ticker, timeframe)
+    if _rows is None:
+        raise FileNotFoundError(f"No candle store for {ticker} {timeframe} in {_path}")
+
+    _columns = {}
+    for _column, _dtype in COLUMNS.items():
+        if _rows:
+            _columns[_column] = np.memmap(os.path.join(_path, f"{_column}.bin"), dtype=_dtype, mode='r', shape=(_rows,))
+        else:
+            _columns[_column] = np.empty(0, dtype=_dtype)
+
+    # Binary search on the sorted datetime column - only the touched pages are read from disk
+    _i0, _i1 = 0, _rows
+    if start is not None:
+        _i0 = int(np.searchsorted(_columns["datetime"], pd.Timestamp(start).value, side='left'))
+    if end is not None:
+        _i1 = int(np.searchsorted(_columns["datetime"], pd.Timestamp(end).value, side='right'))
+    _i0 = max(0, _i0 - warmup)
+    return {_column: np.asarray(_values[_i0:_i1]) for _column, _values in _columns.items()}  # Plain views of the maps
+
+
+def load_candles_df(ticker, timeframe, start=None, end=None, warmup=0):
+    """Read candles of ticker/timeframe from the store into a DataFrame without copying the columns"""
+    _columns = read_candles(ticker, timeframe, start=start, end=end, warmup=warmup)
+    _columns["datetime"] = _columns["datetime"].view("datetime64[ns]")
+    return pd.DataFrame(_columns, copy=False)
+
+
+def convert_csv_to_store(ticker, timeframe):
+    """One-shot conversion of csv/{ticker}_{timeframe}.csv into the store"""
+    _filename = os.path.join(cur_run_folder, "csv", f"{ticker}_{timeframe}.csv")
+    df = pd.read_csv(_filename, sep=',')
+    df['datetime'] = pd.to_datetime(df['datetime'])
+    write_candles(df, ticker, timeframe)
+    return len(df)
+
+
+def convert_all_csv_to_store():
+    """Convert all csv/{ticker}_{timeframe}.csv files into the store"""
+    _folder = os.path.join(cur_run_folder, "csv")
+    for _filename in sorted(os.listdir(_folder)):
+        if not _filename.endswith(".csv"):
+            continue
+        ticker, timeframe = _filename[:-len(".csv")].rsplit("_", 1)
+        _rows = convert_csv_to_store(ticker, timeframe)
+        print(f"{ticker} {timeframe}: {_rows} candles converted")
+
+
+if __name__ == "__main__":
+    convert_all_csv_to_store()
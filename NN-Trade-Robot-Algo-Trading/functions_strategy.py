@@ -0,0 +1,111 @@
+"""
+Trading rule of the live strategy, without the broker and MOEX connections.
+
+OneBarHoldRule buys 1 lot at market on a class 1 signal and sells it one timeframe_1 bar later, no stop loss.
+HackathonFinamStrategy of 7_live_strategy.py adds the MOEX polling and the neural network to it, the replay of
+the history (10_replay_backtest.py) runs it as is with a virtual clock and a simulated broker - so the replay
+needs neither FinamPy nor aiohttp nor the Finam API credentials.
+"""
+
+import asyncio
+import functions
+import logging
+from datetime import datetime, timedelta
+
+from my_config.trade_config import Config  # Trade robot config file
+
+logger = logging.getLogger(__name__)
+
+# Values of buy_sell in the orders - the BuySell enum of the Finam Trade API (FinamPy.proto.tradeapi.v1.common_pb2)
+BUY_SELL_SELL = 1
+BUY_SELL_BUY = 2
+
+
+class OneBarHoldRule:
+    """Trading decision on the class predicted for the last bar: buy on class 1, sell +1 bar of timeframe_1 later"""
+
+    buy_sell_buy = BUY_SELL_BUY  # Side of the buy orders
+    buy_sell_sell = BUY_SELL_SELL  # Side of the sell orders
+
+    def __init__(self, ticker, security_board, client_id, clock=datetime.now, report_orders=True):
+        self.ticker = ticker
+        self.security_board = security_board
+        self.client_id = client_id
+        self.order_time = None
+        self.in_position = False
+        self.entry_order = None  # The buy order of the open position
+        self.exit_order = None  # The sell order closing the position
+        self.order_reports = set()  # Tasks printing the results of the orders
+        self.clock = clock  # Current time, a virtual clock in the replay of the history
+        self.report_orders = report_orders  # Print the results of the orders
+
+    def trade(self, _class, gateway):
+        """Trading decision on the class predicted for the last bar; also used by the replay of the history."""
+        # +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+        # Now implement simple trading logic
+        if self.in_position and self.entry_order.status == "error":
+            # The buy was rejected - there is no position to close, selling would open a short one
+            logger.error("The buy order for %s failed, no position is open", self.ticker)
+            self.order_time = None
+            self.in_position = False
+            self.entry_order = None
+        if self.exit_order is not None:
+            if self.exit_order.status == "done":
+                # The position is closed
+                self.order_time = None
+                self.in_position = False
+                self.entry_order = None
+                self.exit_order = None
+            elif self.exit_order.status == "error":
+                # The sell was rejected - the position is still open, the sell is sent again below
+                logger.error("The sell order for %s failed, the position is still open", self.ticker)
+                self.exit_order = None
+            else:
+                return  # Wait for the answer of the broker to the sell order
+        if not self.in_position:  # If no open position
+            if _class == 1:
+                # Buy if we haven't yet and the neural network predicts growth
+                order = gateway.submit(client_id=self.client_id, security_board=self.security_board,
+                                       security_code=self.ticker,
+                                       buy_sell=self.buy_sell_buy, quantity=1,
+                                       use_credit=True,
+                                       )
+
+                self.order_time = self.clock()
+                self.in_position = True
+                self.entry_order = order
+                self.report_order_later(gateway, order, "buy")
+        else:  # If there is an open position, check if it's time to close it
+            _now = self.clock()
+            _timeframe_1 = Config.timeframe_1  # Higher timeframe
+            _delta = functions.get_timeframe_moex(tf=_timeframe_1)
+            if self.entry_order.status != "done":
+                return  # Wait for the answer of the broker to the buy order
+            if _now >= self.order_time + timedelta(minutes=_delta):
+                # Sell if enough time has passed +1 bar of the higher timeframe
+                order = gateway.submit(client_id=self.client_id, security_board=self.security_board,
+                                       security_code=self.ticker,
+                                       buy_sell=self.buy_sell_sell, quantity=1,
+                                       use_credit=True,
+                                       )
+                self.exit_order = order  # The position is closed once the broker executes the sell
+                self.report_order_later(gateway, order, "sell")
+        # +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+
+    def report_order_later(self, gateway, order, side):
+        """Report the order in a separate task, references to the tasks are kept until they finish."""
+        if not self.report_orders:
+            return
+        _task = asyncio.create_task(self.report_order(gateway, order, side))
+        self.order_reports.add(_task)
+        _task.add_done_callback(self.order_reports.discard)
+
+    async def report_order(self, gateway, order, side):
+        """Print the result of an order once the broker answers; the strategy does not wait for it."""
+        await gateway.wait(order)
+        if order.status == "done":
+            print(f"Placed a {side} order for 1 lot of {self.ticker}:", order.result)
+            print("\t - transaction:", order.transaction_id)
+            print(f"\t - broker latency: {order.latency * 1000:.0f} ms")
+        else:
+            logger.error("The %s order for %s failed: %s", side, self.ticker, order.error)
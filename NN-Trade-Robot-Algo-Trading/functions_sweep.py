@@ -0,0 +1,340 @@
+"""
+Parallel parameter sweep with walk-forward validation.
+
+A point of the sweep is one set of the parameters of the samples: timeframe pair, SMA periods, draw_window and
+steps_skip (see get_grid). Every point goes through the same time-ordered folds: the history is split into
+folds + 1 equal periods, fold k trains a model on the periods before k + 1 (all of them, or the last train_periods)
+and validates it on the period k + 1. The window of a sample ends at its own bar, the same bar-aligned windows as in
+the backtest, and samples whose class is given by a bar of the validation period are not trained on. The metrics
+of a fold are the classification metrics of the validation samples and, optionally, a backtest of the strategy rule
+(functions_backtest) on every bar of the validation period.
+
+The points run in a pool of processes. The candles of all tickers and timeframes are loaded once by the parent and
+placed in shared memory (functions_dataset.share_arrays), the workers compute the SMA and the samples from them.
+Artifacts are cached in `NN/_sweep/{hash}`, the hash covers the parameters of the point and the version of the
+candles (see get_point_hash):
+- samples.npz - series and samples of the point sorted by datetime, so every period is a contiguous range
+- *.npy shards of the rendered inputs (functions_dataset format), if cache_inputs
+- fold_{k}_{hash}.json - metrics of a fold, the hash covers the training parameters
+A rerun - after an interruption or with points added to the grid - computes only what is missing.
+"""
+
+import functions
+import functions_backtest
+import functions_dataset
+import functions_eval
+import functions_indicators
+import functions_nn
+import functions_replay
+import itertools
+import json
+import os
+import numpy as np
+import pandas as pd
+
+cur_run_folder = os.path.abspath(os.getcwd())  # Current directory
+
+POINT_PARAMS = ("timeframe_0", "timeframe_1", "period_sma_fast", "period_sma_slow", "draw_window", "steps_skip")
+SAMPLES = ("close", "open", "sma_fast", "sma_slow", "bar_datetimes", "offsets",
+           "ends", "datetimes", "labels", "label_datetimes", "tickers")
+
+
+def get_sweep_folder():
+    """Folder with the artifacts and the results of the sweeps"""
+    return os.path.join(cur_run_folder, "NN", "_sweep")
+
+
+def get_grid(grid):
+    """All points of the grid {name: [values]}; "timeframes" is a list of (timeframe_0, timeframe_1) pairs.
+    Points with period_sma_fast >= period_sma_slow are skipped"""
+    _names = list(grid)
+    _points = []
+    for _values in itertools.product(*(grid[_name] for _name in _names)):
+        _point = dict(zip(_names, _values))
+        if "timeframes" in _point:
+            _point["timeframe_0"], _point["timeframe_1"] = _point.pop("timeframes")
+        if _point["period_sma_fast"] >= _point["period_sma_slow"]:
+            continue
+        _points.append({_name: _point[_name] for _name in POINT_PARAMS})
+    return _points
+
+
+def load_candles(tickers, timeframes):
+    """Datetimes (int64 ns), open and close of all tickers and timeframes as flat arrays for share_arrays,
+    plus the version of the candles: number of candles and the last datetime of every series"""
+    _arrays, _version = {}, {}
+    for ticker in sorted(tickers):
+        for timeframe in sorted(timeframes):
+            df = functions_nn.get_df_t1(ticker, timeframe)  # Plain candles without SMA
+            _key = f"{ticker}_{timeframe}"
+            _arrays[f"{_key}_datetime"] = df["datetime"].to_numpy(dtype="datetime64[ns]").view(np.int64)
+            _arrays[f"{_key}_open"] = df["open"].to_numpy(dtype=np.float64)
+            _arrays[f"{_key}_close"] = df["close"].to_numpy(dtype=np.float64)
+            _last = int(_arrays[f"{_key}_datetime"][-1]) if len(df) else None
+            _version[_key] = [len(df), _last]
+    return _arrays, _version
+
+
+def get_fold_bounds(candles, tickers, timeframe, folds):
+    """Bounds of folds + 1 equal periods (int64 ns) of the common history of the tickers on the timeframe;
+    the same for all points, so the folds of all points cover the same dates"""
+    _first = max(int(candles[f"{ticker}_{timeframe}_datetime"][0]) for ticker in tickers)
+    _last = min(int(candles[f"{ticker}_{timeframe}_datetime"][-1]) for ticker in tickers)
+    _bounds = np.linspace(_first, _last, folds + 2).astype(np.int64)
+    _bounds[-1] = _last + 1  # The last period includes the last candle
+    return _bounds
+
+
+def get_point_hash(point, tickers, input_mode, version):
+    """Hash of everything that defines the samples and the inputs of the point"""
+    _timeframes = (point["timeframe_0"], point["timeframe_1"])
+    return functions_dataset.get_params_hash({
+        **point,
+        "tickers": sorted(tickers),
+        "input_mode": input_mode,
+        "sma": "fixed_point",
+        "windows": "bar_aligned",
+        "candles": {_key: _value for _key, _value in version.items() if _key.split("_", 1)[1] in _timeframes},
+    })
+
+
+def get_samples(candles, tickers, point):
+    """Series and samples of the point from the candles: series of all tickers are concatenated
+    (offsets - first row of every ticker), samples are sorted by datetime and ticker"""
+    _fast, _slow = point["period_sma_fast"], point["period_sma_slow"]
+    _specs = functions_indicators.get_sma_specs(_fast, _slow)
+    _warmup = max(_fast, _slow) - 1
+    _series = {"close": [], "open": [], "sma_fast": [], "sma_slow": [], "bar_datetimes": []}
+    _samples = {"ends": [], "datetimes": [], "labels": [], "label_datetimes": [], "tickers": []}
+    _offsets, _offset = [], 0
+    for ticker in sorted(tickers):
+        _in, _out = f"{ticker}_{point['timeframe_0']}", f"{ticker}_{point['timeframe_1']}"
+        # The same SMA and alignment as get_df_tf0 and get_windows_and_labels of 2_prepare
+        df_in = pd.DataFrame({
+            "datetime": candles[f"{_in}_datetime"].view("datetime64[ns]"),
+            "open": candles[f"{_in}_open"],
+            "close": candles[f"{_in}_close"],
+            **functions_indicators.IndicatorSet(_specs).batch(candles[f"{_in}_close"]),
+        }).iloc[_warmup:].reset_index(drop=True)
+        df_out = pd.DataFrame({"datetime": candles[f"{_out}_datetime"].view("datetime64[ns]"),
+                               "close": candles[f"{_out}_close"]})
+        _ends, _dates, _labels, _label_dates = functions_nn.get_windows_and_labels(df_in, df_out, point["draw_window"],
+                                                                                   point["steps_skip"])
+        for _column in ("close", "open", "sma_fast", "sma_slow"):
+            _series[_column].append(df_in[_column].to_numpy())
+        _series["bar_datetimes"].append(df_in["datetime"].to_numpy(dtype="datetime64[ns]").view(np.int64))
+        _samples["ends"].append(_ends + _offset)
+        _samples["datetimes"].append(_dates.astype("datetime64[ns]").view(np.int64))
+        _samples["labels"].append(_labels)
+        _samples["label_datetimes"].append(_label_dates.astype("datetime64[ns]").view(np.int64))
+        _samples["tickers"].append(np.full(len(_ends), ticker))
+        _offsets.append(_offset)
+        _offset += len(df_in)
+
+    _result = {_name: np.concatenate(_values) for _name, _values in {**_series, **_samples}.items()}
+    _order = np.lexsort((_result["tickers"], _result["datetimes"]))
+    for _name in _samples:
+        _result[_name] = _result[_name][_order]
+    _result["offsets"] = np.asarray(_offsets + [_offset], dtype=np.int64)
+    return _result
+
+
+def load_or_get_samples(folder, candles, tickers, point):
+    """Samples of the point from samples.npz of its folder, computed and saved if missing"""
+    _filename = os.path.join(folder, "samples.npz")
+    if os.path.exists(_filename):
+        with np.load(_filename) as _data:
+            return {_name: _data[_name] for _name in SAMPLES}
+    _samples = get_samples(candles, tickers, point)
+    os.makedirs(folder, exist_ok=True)
+    with open(_filename + ".tmp", 'wb') as f:
+        np.savez(f, **_samples)
+    os.replace(_filename + ".tmp", _filename)
+    return _samples
+
+
+def render_shards(folder, samples, point_hash, draw_window, input_mode, shard_size, render_batch=256):
+    """Rendered inputs of all samples as shards of the folder; skipped if the manifest shows they are complete"""
+    if functions_dataset.get_generated_samples(folder, "sweep", {"point": point_hash}, samples["datetimes"]):
+        return
+    functions_dataset.remove_shards(folder, "sweep_")
+    for _unit, _i0 in enumerate(range(0, len(samples["labels"]), shard_size)):
+        _i1 = min(_i0 + shard_size, len(samples["labels"]))
+        _inputs = [functions_nn.render_samples(samples, np.arange(_j0, min(_j0 + render_batch, _i1)), draw_window,
+                                               input_mode)[0] for _j0 in range(_i0, _i1, render_batch)]
+        functions_dataset.save_shard(folder, f"sweep_{_unit:05d}", {
+            "images": np.concatenate(_inputs),
+            "labels": samples["labels"][_i0:_i1],
+            "tickers": samples["tickers"][_i0:_i1],
+            "label_datetimes": samples["label_datetimes"][_i0:_i1],
+            "datetimes": samples["datetimes"][_i0:_i1],
+        })
+    functions_dataset.save_manifest(folder, "sweep", {"point": point_hash}, samples["datetimes"])
+
+
+def get_fold_ranges(datetimes, label_datetimes, bounds, train_periods=0):
+    """(train_numbers, val_start, val_stop) of every fold for samples sorted by datetime (of the last bar of window).
+    Fold k validates on the samples of the period k + 1, trains on the samples of all previous periods or the last
+    train_periods whose class is given by a timeframe_1 bar before the period k + 1 - the windows of the training
+    samples end before it, so no data of the validation period is trained on"""
+    _i = np.searchsorted(datetimes, bounds, side='left')
+    _folds = []
+    for _k in range(1, len(bounds) - 1):
+        _first_period = max(_k - train_periods, 0) if train_periods else 0
+        _train = np.arange(_i[_first_period], _i[_k])
+        _folds.append((_train[label_datetimes[_train] < bounds[_k]], int(_i[_k]), int(_i[_k + 1])))
+    return _folds
+
+
+def get_period_data(samples, ticker_number, start, stop, draw_window):
+    """Series of one ticker for the replay of the bars with datetimes in [start, stop), in the format of
+    functions_replay.get_replay_data: draw_window - 1 bars before start, first - the row of the first bar"""
+    _o0, _o1 = samples["offsets"][ticker_number], samples["offsets"][ticker_number + 1]
+    _datetimes = samples["bar_datetimes"][_o0:_o1]
+    _first, _last = np.searchsorted(_datetimes, [start, stop], side='left')
+    _i0 = max(_first - draw_window + 1, 0)
+    _data = {_column: samples[_column][_o0 + _i0:_o0 + _last] for _column in ("open", "close", "sma_fast", "sma_slow")}
+    _data["datetime"] = _datetimes[_i0:_last].view("datetime64[ns]")
+    _data["first"] = int(_first - _i0)
+    return _data
+
+
+def backtest_period(samples, tickers, start, stop, point, input_mode, predict_batch, threshold, commission, fill,
+                    batch_size=256):
+    """Backtest of the strategy rule on every bar of [start, stop) of all tickers, one column per ticker"""
+    _columns = {"close": [], "open": [], "datetime": [], "signals": []}
+    for _number, ticker in enumerate(sorted(tickers)):
+        _data = get_period_data(samples, _number, start, stop, point["draw_window"])
+        _logits = functions_replay.predict_logits(_data, point["draw_window"], input_mode, predict_batch, batch_size)
+        _first = _data["first"]
+        _columns["close"].append(_data["close"][_first:])
+        _columns["open"].append(_data["open"][_first:])
+        _columns["datetime"].append(_data["datetime"][_first:].view(np.int64))
+        _columns["signals"].append(np.nan_to_num(_logits[_first:, 1], nan=-np.inf) >= threshold)
+    _lengths = np.array([len(_values) for _values in _columns["close"]])
+    _datetimes = functions_backtest.pad_series(_columns["datetime"], functions_backtest.MAX_INT64, np.int64)
+    _hold = pd.Timedelta(minutes=functions.get_timeframe_moex(point["timeframe_1"]))  # as in the live strategy
+    _result = functions_backtest.backtest(functions_backtest.pad_series(_columns["signals"], False, bool),
+                                          functions_backtest.pad_series(_columns["close"]),
+                                          functions_backtest.get_exit_index(_datetimes, _lengths, _hold), _lengths,
+                                          commission, functions_backtest.pad_series(_columns["open"]), fill)
+    _stats = _result["stats"]
+    _trades = int(_stats["trades"].sum())
+    return {
+        "trades": _trades,
+        "win_rate": float(np.sum(_stats["win_rate"] * _stats["trades"]) / _trades) if _trades else 0.0,
+        "total_return": float(_stats["total_return"].sum()),
+        "max_drawdown": float(_stats["max_drawdown"].max()),
+    }
+
+
+def get_classification_metrics(labels, logits, threshold):
+    """Loss, accuracy, precision, recall and F1 of class 1 of the validation samples"""
+    _probabilities = functions_eval.softmax(logits.astype(np.float64))
+    _predicted = (logits[:, 1] >= threshold).astype(np.int64)
+    _precision, _recall, _f1 = functions_eval.precision_recall(functions_eval.confusion_matrix(labels, _predicted))
+    return {
+        "val_loss": float(-np.mean(np.log(np.maximum(_probabilities[np.arange(len(labels)), labels], 1e-12)))),
+        "val_accuracy": float(np.mean(_predicted == labels)),
+        "precision_1": float(_precision[1]),
+        "recall_1": float(_recall[1]),
+        "f1_1": float(_f1[1]),
+    }
+
+
+def run_fold(samples, folder, fold, point, settings):
+    """Train a model on the training range of the fold and evaluate it on the validation range"""
+    import functions_tf  # TensorFlow is imported only by the workers
+    import tensorflow as tf
+
+    _train_numbers, _val_start, _val_stop = fold["range"]
+    input_mode, draw_window = settings["input_mode"], point["draw_window"]
+    _input_shape = functions_tf.get_input_shape(input_mode, draw_window)
+    tf.keras.backend.clear_session()
+    tf.keras.utils.set_random_seed(settings["seed"])
+
+    def _dataset(numbers):
+        if settings["cache_inputs"]:
+            return functions_tf.get_shards_dataset(folder, numbers, _input_shape, tf.data.AUTOTUNE,
+                                                   input_mode=input_mode)
+        return functions_tf.get_rendered_dataset(samples, numbers, draw_window, tf.data.AUTOTUNE,
+                                                 input_mode=input_mode)
+
+    train_ds, num_train = _dataset(_train_numbers)
+    train_ds = functions_tf.build_pipeline(train_ds, num_train, settings["batch_size"], cache="", shuffle=True,
+                                           seed=settings["seed"], parallel_calls=tf.data.AUTOTUNE)
+    val_ds, num_val = _dataset(np.arange(_val_start, _val_stop))
+    val_ds = functions_tf.build_pipeline(val_ds, num_val, settings["eval_batch_size"], cache="", shuffle=False,
+                                         seed=settings["seed"], parallel_calls=tf.data.AUTOTUNE)
+
+    model = functions_tf.build_model(input_mode, num_classes=2)
+    model.fit(train_ds, epochs=settings["epochs"], verbose=0)
+    _logits = np.asarray(model.predict(val_ds, verbose=0))
+    _metrics = {"train_samples": num_train, "val_samples": num_val,
+                **get_classification_metrics(samples["labels"][_val_start:_val_stop], _logits, settings["threshold"])}
+
+    if settings["backtest"]:
+        _predictor = functions_tf.CompiledModel(model, _input_shape, backend="function",
+                                                max_batch=settings["eval_batch_size"])
+        _metrics.update(backtest_period(samples, settings["tickers"], fold["start"], fold["stop"], point, input_mode,
+                                        _predictor.predict_batch, settings["threshold"], settings["commission"],
+                                        settings["fill"], settings["eval_batch_size"]))
+    return _metrics
+
+
+def run_point(point, candles_spec, settings):
+    """Work unit of the sweep, runs in a worker process: samples, inputs and all folds of one point.
+    Returns the point with the mean and the standard deviation of the metrics over the folds"""
+    import tensorflow as tf
+    tf.config.threading.set_intra_op_parallelism_threads(settings["threads"])
+    tf.config.threading.set_inter_op_parallelism_threads(settings["threads"])
+
+    _point_hash = get_point_hash(point, settings["tickers"], settings["input_mode"], settings["version"])
+    folder = os.path.join(get_sweep_folder(), _point_hash[:16])
+    _blocks, _candles = functions_dataset.attach_arrays(candles_spec)
+    try:
+        samples = load_or_get_samples(folder, _candles, settings["tickers"], point)
+    finally:
+        del _candles  # Views must be released before the blocks are closed
+        functions_dataset.release_arrays(_blocks)
+
+    if settings["cache_inputs"]:
+        render_shards(folder, samples, _point_hash, point["draw_window"], settings["input_mode"],
+                      settings["shard_size"])
+
+    _bounds = settings["bounds"]
+    _folds = []
+    for _k, _range in enumerate(get_fold_ranges(samples["datetimes"], samples["label_datetimes"], _bounds,
+                                                settings["train_periods"])):
+        fold = {"range": _range, "start": int(_bounds[_k + 1]), "stop": int(_bounds[_k + 2])}
+        _fold_hash = functions_dataset.get_params_hash({
+            "point": _point_hash, "fold": _k, "bounds": [int(_bound) for _bound in _bounds],
+            **{_name: settings[_name] for _name in ("train_periods", "epochs", "batch_size", "seed", "threshold",
+                                                     "backtest", "commission", "fill")}})
+        _filename = os.path.join(folder, f"fold_{_k}_{_fold_hash[:16]}.json")
+        if os.path.exists(_filename):
+            with open(_filename, 'r', encoding='utf-8') as f:
+                _folds.append(json.load(f))
+            continue
+        if not len(_range[0]) or _range[1] == _range[2]:
+            continue  # No samples to train on or to validate
+        _metrics = run_fold(samples, folder, fold, point, settings)
+        with open(_filename + ".tmp", 'w', encoding='utf-8') as f:
+            json.dump(_metrics, f, indent=4)
+        os.replace(_filename + ".tmp", _filename)
+        _folds.append(_metrics)
+
+    _result = {**point, "hash": _point_hash[:16], "folds": len(_folds)}
+    for _name in (_folds[0] if _folds else {}):
+        _values = np.array([_fold[_name] for _fold in _folds], dtype=np.float64)
+        _result[_name] = float(_values.mean())
+        _result[f"{_name}_std"] = float(_values.std())
+    return _result
+
+
+def rank_results(results, metric, ascending=False):
+    """Results as a DataFrame sorted by the metric, the best point first; points without it go last"""
+    df = pd.DataFrame(results)
+    if metric not in df:
+        return df
+    return df.sort_values(metric, ascending=ascending, na_position='last', kind='stable').reset_index(drop=True)
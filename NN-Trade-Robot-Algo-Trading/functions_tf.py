@@ -0,0 +1,252 @@
+"""
+Models, input pipelines and callbacks for training the neural network with TensorFlow.
+"""
+
+import functions_dataset
+import functions_nn
+import numpy as np
+import os
+import time
+import tensorflow as tf
+
+from tensorflow import keras
+
+
+MODEL_NAMES = functions_nn.MODEL_NAMES  # Names of the model files for the input modes
+INPUT_DTYPES = {"image": tf.uint8, "series": tf.float32}
+
+
+def get_input_shape(input_mode, draw_size):
+    """Shape of one input of the neural network"""
+    if input_mode == "series":
+        return (draw_size, 3)
+    return (draw_size, draw_size, 3)
+
+
+def build_model(input_mode, num_classes):
+    """Compiled model for the input mode: Conv2D over chart images or compact Conv1D over the raw series"""
+    if input_mode == "series":
+        # 1D convolutions over the normalized close, fast SMA and slow SMA
+        model = keras.Sequential([
+            keras.layers.Conv1D(32, 5, activation='relu'),
+            keras.layers.MaxPooling1D(),
+            keras.layers.BatchNormalization(),
+            keras.layers.Conv1D(32, 5, activation='relu'),
+            keras.layers.MaxPooling1D(),
+            keras.layers.BatchNormalization(),
+            keras.layers.Conv1D(32, 3, activation='relu'),
+            keras.layers.MaxPooling1D(),
+            keras.layers.BatchNormalization(),
+            keras.layers.Flatten(),
+            keras.layers.Dense(64, activation='relu'),
+            keras.layers.Dense(num_classes)
+        ])
+    else:
+        # Second type of model of 3_train_neural_network.py
+        model = keras.Sequential([
+            keras.layers.Rescaling(1. / 255),
+            keras.layers.Conv2D(32, 3, activation='relu'),
+            keras.layers.MaxPooling2D(),
+            keras.layers.BatchNormalization(),
+            keras.layers.Conv2D(32, 3, activation='relu'),
+            keras.layers.MaxPooling2D(),
+            keras.layers.BatchNormalization(),
+            keras.layers.Conv2D(32, 3, activation='relu'),
+            keras.layers.MaxPooling2D(),
+            keras.layers.BatchNormalization(),
+            keras.layers.Flatten(),
+            keras.layers.Dense(128, activation='relu'),
+            keras.layers.Dense(num_classes)
+        ])
+    # version with Adam optimization (a stochastic gradient descent method)
+    model.compile(
+        optimizer='adam',
+        loss=keras.losses.SparseCategoricalCrossentropy(from_logits=True),
+        metrics=['accuracy'])
+    return model
+
+
+def get_png_files(data_dir, validation_split, subset):
+    """Files and classes of the dataset in data_dir/{class}/*.png, split like image_dataset_from_directory
+    without shuffling: the last validation_split of the files (sorted by class and name) are for validation"""
+    _classes = sorted(_class for _class in os.listdir(data_dir) if os.path.isdir(os.path.join(data_dir, _class)))
+    _files, _labels = [], []
+    for _label, _class in enumerate(_classes):
+        _folder = os.path.join(data_dir, _class)
+        _names = sorted(f for f in os.listdir(_folder) if f.endswith(".png"))
+        _files += [os.path.join(_folder, f) for f in _names]
+        _labels += [_label] * len(_names)
+    _num_val = int(validation_split * len(_files))
+    if subset == "training":
+        return _files[:len(_files) - _num_val], _labels[:len(_files) - _num_val]
+    return _files[len(_files) - _num_val:], _labels[len(_files) - _num_val:]
+
+
+def get_png_dataset(data_dir, validation_split, subset, parallel_calls):
+    """Dataset of (image, label) decoded from PNG files in parallel"""
+    _files, _labels = get_png_files(data_dir, validation_split, subset)
+
+    def _decode(filename, label):
+        return tf.io.decode_png(tf.io.read_file(filename), channels=3), label
+
+    ds = tf.data.Dataset.from_tensor_slices((_files, np.asarray(_labels, dtype=np.int64)))
+    return ds.map(_decode, num_parallel_calls=parallel_calls), len(_files)
+
+
+class ShardReader:
+    """Random access to the samples of the shards by their global number"""
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.index = functions_dataset.load_index(folder)
+        self.shards = [functions_dataset.load_shard(folder, _prefix) for _prefix in self.index["prefixes"]]
+
+    def __len__(self):
+        return len(self.index["labels"])
+
+    def get_batch(self, numbers):
+        """Inputs (images or series) and labels of the samples with the given numbers"""
+        _images = np.stack([self.shards[self.index["shards"][_i]]["images"][self.index["rows"][_i]] for _i in numbers])
+        return _images, self.index["labels"][numbers].astype(np.int64)
+
+
+def get_shards_dataset(folder, numbers, input_shape, parallel_calls, read_batch=256, input_mode="image"):
+    """Dataset of (input, label) for the samples of the shards with the given numbers, read in parallel"""
+    reader = ShardReader(folder)
+
+    def _read(numbers):
+        _images, _labels = tf.numpy_function(reader.get_batch, [numbers], [INPUT_DTYPES[input_mode], tf.int64])
+        _images.set_shape((None,) + tuple(input_shape))
+        _labels.set_shape((None,))
+        return _images, _labels
+
+    ds = tf.data.Dataset.from_tensor_slices(np.asarray(numbers, dtype=np.int64)).batch(read_batch)
+    return ds.map(_read, num_parallel_calls=parallel_calls).unbatch(), len(numbers)
+
+
+def get_rendered_dataset(samples, numbers, draw_window, parallel_calls, render_batch=64, input_mode="image"):
+    """Dataset of (input, label) for the samples with the given numbers rendered from the candles inside
+    the pipeline (see functions_nn.load_samples), no images on disk"""
+
+    def _render_numpy(numbers):
+        return functions_nn.render_samples(samples, numbers, draw_window, input_mode)
+
+    def _render(numbers):
+        _images, _labels = tf.numpy_function(_render_numpy, [numbers], [INPUT_DTYPES[input_mode], tf.int64])
+        _images.set_shape((None,) + get_input_shape(input_mode, draw_window))
+        _labels.set_shape((None,))
+        return _images, _labels
+
+    ds = tf.data.Dataset.from_tensor_slices(np.asarray(numbers, dtype=np.int64)).batch(render_batch)
+    return ds.map(_render, num_parallel_calls=parallel_calls).unbatch(), len(numbers)
+
+
+def get_batches_dataset(read_batch, numbers, input_shape, parallel_calls, batch_size=1024, input_mode="image"):
+    """Dataset of (inputs, labels) batches of the samples with the given numbers for inference,
+    read_batch(numbers) -> (inputs, labels) is called in parallel and the next batches are prefetched"""
+
+    def _read(_numbers):
+        _images, _labels = tf.numpy_function(read_batch, [_numbers], [INPUT_DTYPES[input_mode], tf.int64])
+        _images.set_shape((None,) + tuple(input_shape))
+        _labels.set_shape((None,))
+        return _images, _labels
+
+    ds = tf.data.Dataset.from_tensor_slices(np.asarray(numbers, dtype=np.int64)).batch(batch_size)
+    _options = tf.data.Options()
+    _options.deterministic = True  # Batches come in the order of the numbers
+    return ds.map(_read, num_parallel_calls=parallel_calls).with_options(_options).prefetch(tf.data.AUTOTUNE)
+
+
+def build_pipeline(ds, num_samples, batch_size, cache, shuffle, seed, parallel_calls):
+    """Cache, shuffle, batch and prefetch a dataset of (image, label).
+    cache - "" no caching, "memory" - in memory after the first epoch, otherwise the path of an on-disk cache"""
+    if cache == "memory":
+        ds = ds.cache()
+    elif cache:
+        ds = ds.cache(cache)
+    if shuffle:
+        # Deterministic for a given seed, a new order on every epoch
+        ds = ds.shuffle(num_samples, seed=seed, reshuffle_each_iteration=True)
+    ds = ds.batch(batch_size, num_parallel_calls=parallel_calls)
+    _options = tf.data.Options()
+    _options.deterministic = True  # Parallel calls keep the order of the samples
+    return ds.with_options(_options).prefetch(tf.data.AUTOTUNE)
+
+
+class ThroughputLogger(keras.callbacks.Callback):
+    """Print the number of training samples per second of every epoch to find stalls of the input pipeline"""
+
+    def __init__(self, num_samples):
+        super().__init__()
+        self.num_samples = num_samples
+        self._start = None
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self._start = time.perf_counter()
+
+    def on_epoch_end(self, epoch, logs=None):
+        _elapsed = time.perf_counter() - self._start
+        print(f"Epoch {epoch + 1}: {self.num_samples / _elapsed:.0f} samples/s ({_elapsed:.1f} s)")
+
+
+class CompiledModel:
+    """Low-latency inference of a trained model for the live strategy.
+    backend: "function" - a tf.function with a fixed input signature, traced once,
+             "tflite" - TFLite interpreters for batch sizes rounded up to a power of 2,
+             "keras" - model.predict_on_batch (no compilation, for comparison).
+    Inputs are copied into preallocated float32 buffers and every path is warmed up at creation, so the first
+    signal of the day does not pay for graph tracing"""
+
+    def __init__(self, model, input_shape, backend="function", max_batch=64):
+        self.model = model
+        self.input_shape = tuple(input_shape)
+        self.backend = backend
+        self.max_batch = max_batch
+        self._buffer = np.zeros((max_batch,) + self.input_shape, dtype=np.float32)
+        if backend == "function":
+            _spec = tf.TensorSpec((None,) + self.input_shape, tf.float32)
+            self._function = tf.function(lambda x: model(x, training=False), input_signature=[_spec])
+            self._function = self._function.get_concrete_function()
+        elif backend == "tflite":
+            _converter = tf.lite.TFLiteConverter.from_keras_model(model)
+            self._tflite_model = _converter.convert()
+            self._interpreters = {}
+            _size = 1
+            while True:
+                self._get_interpreter(_size)
+                if _size >= max_batch:
+                    break
+                _size *= 2
+        elif backend != "keras":
+            raise ValueError(f"Unknown inference backend: {backend}")
+        self.predict_batch(self._buffer[:1])  # warm-up
+        self.predict_batch(self._buffer)
+
+    def _get_interpreter(self, size):
+        """TFLite interpreter with the input of size samples, created once for every size"""
+        if size not in self._interpreters:
+            _interpreter = tf.lite.Interpreter(model_content=self._tflite_model)
+            _input = _interpreter.get_input_details()[0]["index"]
+            _interpreter.resize_tensor_input(_input, (size,) + self.input_shape, strict=False)
+            _interpreter.allocate_tensors()
+            self._interpreters[size] = (_interpreter, _input, _interpreter.get_output_details()[0]["index"])
+        return self._interpreters[size]
+
+    def predict_batch(self, inputs):
+        """Logits of a batch of inputs - (n, num_classes) float32, n up to max_batch"""
+        _n = len(inputs)
+        _buffer = self._buffer[:_n]
+        _buffer[...] = inputs  # the input is copied and cast once into the preallocated buffer
+        if self.backend == "function":
+            return self._function(tf.constant(_buffer)).numpy()
+        if self.backend == "tflite":
+            _size = 1 << max(_n - 1, 0).bit_length()  # the next power of 2
+            _interpreter, _input, _output = self._get_interpreter(_size)
+            _interpreter.set_tensor(_input, self._buffer[:_size])
+            _interpreter.invoke()
+            return _interpreter.get_tensor(_output)[:_n].copy()
+        return np.asarray(self.model.predict_on_batch(_buffer))
+
+    def predict(self, inputs):
+        """Logits of one input - (num_classes,)"""
+        return self.predict_batch(inputs[None])[0]
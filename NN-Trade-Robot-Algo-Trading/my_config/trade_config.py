@@ -18,6 +18,18 @@ class Config:
     
     # Start date for downloading historical data from MOEX
     start = "2021-01-01"
+    incremental_download = True  # Download only candles newer than those already stored in csv/
+    download_concurrency = 8  # Maximum number of simultaneous requests to MOEX ISS
+    download_chunk_days = 90  # The date range is split into chunks of this many days, fetched in parallel
+    download_retries = 3  # How many times to retry a failed request
+    download_backoff = 1.0  # Initial delay in seconds between retries, doubled after each attempt
+
+    # Live inference: signals of all tickers arriving within the window are predicted in one batch
+    live_batch_window = 0.005  # Seconds to wait for the requests of other tickers
+    live_max_batch = 64  # Maximum number of requests in one forward pass
+    live_inference_backend = "function"  # "function" - compiled tf.function, "tflite" - TFLite, "keras" - predict_on_batch
+
+    live_order_workers = 4  # Threads placing orders with the broker, orders never block the event loop
 
     # Trading hours for the exchange
     trading_hours_start = "10:00"  # Start time of the trading session
@@ -29,6 +41,63 @@ class Config:
     draw_window = 128  # Size of the data window for drawing
     steps_skip = 16  # Step size for shifting the data window
     draw_size = 128  # Size of the square image side
+    input_mode = "image"  # Input of the neural network: "image" - chart images, "series" - normalized (draw_window, 3) series
+
+    # Format of the training dataset
+    dataset_format = "shards"  # "shards" - uint8 tensors in .npy shards, "png" - one image file per sample
+    dataset_shard_size = 4096  # Number of samples in one shard
+    dataset_export_png = False  # Also save the samples as PNG files for debugging
+    dataset_workers = 0  # Number of processes generating the dataset, 0 - all CPU cores
+    dataset_incremental = True  # Render only samples missing from the manifest of the previous run
+
+    # Cache of rendered chart images and SMA keyed by the content of the window (functions_cache), opt-in: it pays off
+    # only when the same windows are rendered again in one process, e.g. 4_check or the replay run several times;
+    # the one-pass bulk rendering of 2_prepare, 12_score_signals and the sweep never hits it
+    cache_render_mb = 0  # Size of the in-memory cache of images in every process, 0 - no memory cache
+    cache_sma_mb = 0  # Size of the in-memory cache of SMA in every process, 0 - no memory cache
+    cache_folder = ""  # Folder of the disk cache shared by all scripts, e.g. "NN/_cache", "" - no disk cache
+    cache_disk_mb = 4096  # Size of the disk cache of images and of SMA, each; the oldest files are removed first
+
+    # Parameters of training the neural network
+    train_batch_size = 10  # Batch size
+    train_cache = "memory"  # Cache of decoded samples: "" - none, "memory" - in memory, otherwise path to a file on disk
+    train_shuffle = True  # Shuffle the training samples every epoch
+    train_seed = 123  # Seed of the shuffling, the same seed gives the same order
+    train_parallel_calls = 0  # Number of parallel calls decoding samples, 0 - chosen by TensorFlow
+    train_on_the_fly = False  # Render images from csv/store candles inside the input pipeline instead of the dataset
+
+    # Parameters of evaluating the neural network
+    eval_batch_size = 1024  # Number of samples in one forward pass
+    eval_holdout_start = ""  # Evaluate only samples from this date, e.g. "2023-01-01", "" - the whole dataset
+    eval_threshold = 0.0  # Class 1 if its logit >= threshold, the live strategy uses 0
+
+    # Backtests on the stored candles
+    backtest_start = ""  # First date of the backtest, e.g. "2023-01-01", "" - from the first candle
+    backtest_end = ""  # Last date of the backtest, "" - up to the last candle
+    backtest_commission = 0.0005  # Commission per side as a share of the trade value
+    backtest_fill = "close"  # Price of market orders: "close" - of the signal bar, "next_open" - of the next bar
+
+    # Offline scoring of every bar of the history into the signal store (12_score_signals.py)
+    signals_incremental = True  # Score only bars newer than the last stored score
+    signals_workers = 0  # Number of processes rendering the inputs, 0 - all CPU cores
+    signals_unit = 1024  # Number of bars rendered by a worker at once
+    backtest_use_signals = True  # 10_replay_backtest takes the scores from the signal store when they are there
+
+    # Parameter sweep with walk-forward validation (11_parameter_sweep.py), every combination of the values is a point
+    sweep_grid = {
+        "timeframes": [("M1", "M10")],  # Pairs (timeframe_0, timeframe_1)
+        "period_sma_fast": [8, 16],
+        "period_sma_slow": [32, 64],
+        "draw_window": [64, 128],
+        "steps_skip": [8, 16],
+    }
+    sweep_folds = 4  # The history is split into sweep_folds + 1 equal periods, fold k validates on the period k + 1
+    sweep_train_periods = 0  # Periods the model of a fold is trained on, 0 - all previous periods (expanding window)
+    sweep_epochs = 5  # Epochs of training in every fold
+    sweep_workers = 0  # Number of processes running the points, 0 - all CPU cores
+    sweep_cache_inputs = True  # Keep the rendered inputs of every point as shards, otherwise render them on the fly
+    sweep_backtest = True  # Backtest every bar of the validation periods, otherwise only classification metrics
+    sweep_rank = "total_return"  # Metric ranking the points, the higher the better
 
 # Example usage of the Config class
 if __name__ == "__main__":
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The scripts import the functions_* modules and my_config from the project folder
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
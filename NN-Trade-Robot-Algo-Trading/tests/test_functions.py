@@ -0,0 +1,49 @@
+import functions
+import numpy as np
+import pandas as pd
+import pytest
+
+EXPECTED_CHANGE = {"H1": [0, 0.1, 0.25, 0.5, 1, 2, 100]}  # Thresholds of the classes of timeframe_1, in percent
+
+
+def get_candles(seed):
+    """Timestamps of M10 bars and of gappy H1 bars with their percent changes _percent_OC"""
+    _rng = np.random.default_rng(seed)
+    _hours = pd.date_range("2023-01-02 10:00", periods=24 * 20, freq="h")
+    _hours = _hours[(_hours.hour >= 10) & (_hours.weekday < 5)]
+    _hours = _hours[_rng.random(len(_hours)) > 0.1]  # Missing bars
+    _percents = np.round(_rng.normal(0, 0.4, len(_hours)), 3)
+    _keys = pd.date_range(_hours[0], _hours[-10], freq="10min")
+    _keys = _keys[(_keys.hour >= 10) & (_keys.weekday < 5)]
+    return _keys, _hours, _percents
+
+
+@pytest.mark.parametrize("tf, future_tf", [("M10", "H1"), ("M1", "M10"), ("M10", "D1"), ("H1", "H4")])
+def test_get_future_keys(tf, future_tf):
+    _keys = pd.date_range("2023-01-02 10:00", periods=500, freq=f"{functions.TIMEFRAME_MINUTES[tf]}min")
+    _batch = functions.get_future_keys(_keys, tf, future_tf)
+    for _i, _key in enumerate(_keys.to_pydatetime()):
+        _scalar = functions.get_future_key(_key, tf, future_tf)
+        assert [pd.Timestamp(_value[_i]) for _value in _batch] == [pd.Timestamp(_value) for _value in _scalar]
+
+
+def test_get_future_keys_unsupported():
+    assert functions.get_future_keys(pd.date_range("2023-01-02", periods=3, freq="D"), "D1", "W1") is False
+
+
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_detect_class_batch(seed):
+    _keys, _hours, _percents = get_candles(seed)
+    arr_OHLCV_1 = {_hour: [0, 0, 0, 0, 0, _percent] for _hour, _percent in zip(_hours.to_pydatetime(), _percents)}
+    _future_keys = [functions.get_future_key(_key, "M10", "H1") for _key in _keys.to_pydatetime()]
+    keys, future_keys, future_keys2 = (np.array(_values, dtype="datetime64[ns]") for _values in zip(*_future_keys))
+    _batch = functions.detect_class_batch(keys, future_keys, future_keys2, _hours, _percents, "H1", EXPECTED_CHANGE)
+    for _i, (key, future_key, future_key2) in enumerate(_future_keys):
+        assert _batch[_i] == functions.detect_class(key, future_key, future_key2, arr_OHLCV_1, "H1", EXPECTED_CHANGE)
+
+
+def test_get_classification_batch():
+    _p = np.array([0, 0.05, 0.1, 0.3, 0.99, 1.5, 50, 100, 150])
+    _batch = functions.get_classification_batch(_p, "H1", EXPECTED_CHANGE)
+    assert _batch.tolist() == [functions.get_classification(_value, "H1", EXPECTED_CHANGE) for _value in _p]
+
@@ -0,0 +1,53 @@
+import functions_indicators
+import numpy as np
+import pandas as pd
+import pytest
+
+
+def get_prices(seed, n=2000):
+    _rng = np.random.default_rng(seed)
+    return np.round(100 + np.cumsum(_rng.normal(0, 0.5, n)), 2)
+
+
+@pytest.mark.parametrize("period", [1, 16, 32])
+def test_sma_matches_pandas(period):
+    _prices = get_prices(0)
+    _expected = pd.Series(_prices).rolling(period).mean().to_numpy()
+    np.testing.assert_allclose(functions_indicators.SMA(period).batch(_prices), _expected, rtol=1e-12)
+
+
+@pytest.mark.parametrize("period", [1, 16, 32])
+def test_sma_batch_equals_update(period):
+    _prices = get_prices(1)
+    _sma = functions_indicators.SMA(period)
+    _update = np.array([_sma.update(_price) for _price in _prices])
+    np.testing.assert_array_equal(functions_indicators.SMA(period).batch(_prices), _update)
+
+
+def test_sma_batch_continues_the_state():
+    _prices = get_prices(2)
+    _sma = functions_indicators.SMA(16)
+    _parts = np.concatenate([_sma.batch(_prices[:5]), _sma.batch(_prices[5:700]), _sma.batch(_prices[700:])])
+    np.testing.assert_array_equal(_parts, functions_indicators.SMA(16).batch(_prices))
+
+
+def test_sma_does_not_depend_on_the_start():
+    # The live strategy starts from a few days of bars and must get the SMA of the whole history exactly
+    _prices = get_prices(3)
+    _full = functions_indicators.SMA(32).batch(_prices)
+    _tail = functions_indicators.SMA(32).batch(_prices[1500:])
+    np.testing.assert_array_equal(_tail[31:], _full[1531:])
+
+
+def test_indicator_set_state(tmp_path):
+    _prices = get_prices(4)
+    _specs = {**functions_indicators.get_sma_specs(16, 32), "ema": {"type": "ema", "period": 10}}
+    _expected = functions_indicators.IndicatorSet(_specs).batch(_prices)
+    _set = functions_indicators.IndicatorSet(_specs)
+    _set.batch(_prices[:1000])
+    _set.save_state(str(tmp_path / "state.json"))
+    _restored = functions_indicators.IndicatorSet(_specs)
+    _restored.load_state(str(tmp_path / "state.json"))
+    _values = _restored.batch(_prices[1000:])
+    for _name in _specs:
+        np.testing.assert_array_equal(_values[_name], _expected[_name][1000:])
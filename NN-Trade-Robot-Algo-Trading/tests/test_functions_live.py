@@ -0,0 +1,37 @@
+import functions_live
+import numpy as np
+import pandas as pd
+
+
+def get_candles(n, start="2023-01-02 10:00"):
+    _datetimes = pd.date_range(start, periods=n, freq="10min")
+    return [[_datetime, 100 + _i, 101 + _i, 99 + _i, 100.5 + _i, 1000 + _i] for _i, _datetime in enumerate(_datetimes)]
+
+
+def test_ring_buffer_keeps_the_last_bars():
+    _buffer = functions_live.CandleRingBuffer(8, slack=3, features=("sma_fast",))
+    _candles = get_candles(50)
+    for _i, _candle in enumerate(_candles):
+        assert _buffer.append(_candle)
+        _buffer.set_last({"sma_fast": float(_i)})
+        _kept = _candles[max(_i - 7, 0):_i + 1]
+        assert len(_buffer) == len(_kept)
+        _window = _buffer.window()
+        np.testing.assert_array_equal(_window["close"], [_candle[4] for _candle in _kept])
+        np.testing.assert_array_equal(_window["datetime"], [pd.Timestamp(_candle[0]).value for _candle in _kept])
+        np.testing.assert_array_equal(_window["sma_fast"], np.arange(max(_i - 7, 0), _i + 1))
+    assert _buffer.last_datetime == pd.Timestamp(_candles[-1][0]).value
+    np.testing.assert_array_equal(_buffer.window(3)["volume"], [_candle[5] for _candle in _candles[-3:]])
+
+
+def test_ring_buffer_updates_the_forming_bar():
+    _buffer = functions_live.CandleRingBuffer(4)
+    _candles = get_candles(3)
+    for _candle in _candles:
+        _buffer.append(_candle)
+    _update = [_candles[-1][0], 1, 2, 0.5, 1.5, 7]
+    assert not _buffer.append(_update)  # The same bar again - its latest values are kept
+    assert not _buffer.append(_candles[0])  # An older bar is ignored
+    assert len(_buffer) == 3
+    assert _buffer.window(1)["close"][0] == 1.5
+    assert _buffer.window(2)["close"][0] == _candles[1][4]
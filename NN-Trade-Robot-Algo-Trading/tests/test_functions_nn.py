@@ -0,0 +1,46 @@
+import functions_nn
+import numpy as np
+import pandas as pd
+import pytest
+
+
+def get_windows(seed, n, draw_window, period_sma_fast=16, period_sma_slow=32):
+    """n windows of close, fast SMA and slow SMA of a random walk of prices"""
+    _rng = np.random.default_rng(seed)
+    _close = np.round(100 + np.cumsum(_rng.normal(0, 0.5, n + draw_window + period_sma_slow)), 2)
+    _fast = np.convolve(_close, np.ones(period_sma_fast) / period_sma_fast)[:len(_close)]
+    _slow = np.convolve(_close, np.ones(period_sma_slow) / period_sma_slow)[:len(_close)]
+    _windows = np.arange(period_sma_slow, period_sma_slow + n)[:, None] + np.arange(draw_window)
+    return _fast[_windows], _slow[_windows], _close[_windows]
+
+
+@pytest.mark.parametrize("draw_window", [16, 128])
+def test_generate_img_batch_matches_pil(draw_window):
+    _fast, _slow, _close = get_windows(0, 50, draw_window)
+    _batch = functions_nn.generate_img_batch(_fast, _slow, _close, draw_window)
+    for _i in range(len(_batch)):
+        _reference = functions_nn.generate_img_pil(_fast[_i].tolist(), _slow[_i].tolist(), _close[_i].tolist(),
+                                                   draw_window)
+        np.testing.assert_array_equal(_batch[_i], np.asarray(_reference))
+
+
+def test_generate_img_batch_flat_window():
+    _flat = np.full((1, 16), 100.0)
+    _img = functions_nn.generate_img_batch(_flat, _flat, _flat, 16)
+    assert _img[0, 1:].max() == 0  # A flat window is drawn on the first row
+    assert _img[0, 0].any(axis=1).all()
+
+
+def test_get_windows_and_labels():
+    _index = pd.date_range("2023-01-02 10:00", periods=600, freq="10min")
+    df_in = pd.DataFrame({"datetime": _index, "close": np.arange(600.0)})
+    _out = _index[5::6]  # Every hour
+    df_out = pd.DataFrame({"datetime": _out, "close": np.where(np.arange(len(_out)) % 2, 1.0, 2.0)})
+    _ends, _dates, _labels, _label_dates = functions_nn.get_windows_and_labels(df_in, df_out, 32, 2)
+    assert len(_ends)
+    # The window ends at the bar of the sample, the class is given by the next timeframe_1 bar
+    np.testing.assert_array_equal(df_in["datetime"].to_numpy()[_ends - 1], _dates)
+    assert (_ends >= 32).all()
+    _rows = np.searchsorted(df_out["datetime"].to_numpy(), _dates)
+    np.testing.assert_array_equal(df_out["datetime"].to_numpy()[_rows + 1], _label_dates)
+    np.testing.assert_array_equal(_labels, (df_out["close"].to_numpy()[_rows + 1] > df_out["close"].to_numpy()[_rows]))